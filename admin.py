@@ -4,6 +4,7 @@ from google.appengine.ext.webapp.util import run_wsgi_app
 import config
 import post_deploy
 import handlers
+import profiler
 
 # Run deployment tasks
 post_deploy.run_deploy_task()
@@ -11,11 +12,14 @@ post_deploy.run_deploy_task()
 # Define the WSGI application
 application = webapp.WSGIApplication([
     (config.url_prefix + '/admin/', handlers.AdminHandler),
-    (config.url_prefix + '/admin/posts', handlers.AdminHandler),  # Consider if this should be separate
+    (config.url_prefix + '/admin/posts', handlers.AdminHandler),
     (config.url_prefix + '/admin/pages', handlers.PageAdminHandler),
     (config.url_prefix + '/admin/newpost', handlers.PostHandler),
     (config.url_prefix + '/admin/post/(\d+)', handlers.PostHandler),
     (config.url_prefix + '/admin/regenerate', handlers.RegenerateHandler),
+    (config.url_prefix + '/admin/jobs', handlers.JobsHandler),
+    (config.url_prefix + '/admin/stats', handlers.StatsHandler),
+    (config.url_prefix + '/admin/profiles', handlers.ProfilesHandler),
     (config.url_prefix + '/admin/post/delete/(\d+)', handlers.DeleteHandler),
     (config.url_prefix + '/admin/post/preview/(\d+)', handlers.PreviewHandler),
     (config.url_prefix + '/admin/newpage', handlers.PageHandler),
@@ -24,7 +28,7 @@ application = webapp.WSGIApplication([
 ])
 
 def main():
-    run_wsgi_app(application)
+    run_wsgi_app(profiler.middleware(application))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,11 @@
+"""
+Benchmarks for the rendering and serving paths.
+
+These run outside the dev_appserver, against the App Engine SDK's in-memory
+service stubs, and aren't uploaded with the application. Run them from the
+application directory, eg:
+
+  python -m benchmarks.highlighting_bench
+
+Set APPENGINE_SDK if the SDK isn't installed in /usr/local/google_appengine.
+"""
@@ -0,0 +1,124 @@
+"""
+Setup and timing helpers shared by the benchmarks.
+"""
+
+import gc
+import math
+import os
+import sys
+import time
+
+
+SDK_DIR = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXTRA_PATHS = [
+    SDK_DIR,
+    os.path.join(SDK_DIR, 'lib', 'antlr3'),
+    os.path.join(SDK_DIR, 'lib', 'django'),
+    os.path.join(SDK_DIR, 'lib', 'webob'),
+    os.path.join(SDK_DIR, 'lib', 'yaml', 'lib'),
+    APP_DIR,
+    os.path.join(APP_DIR, 'lib'),
+]
+
+
+def setup_paths():
+  """Puts the SDK and the application on sys.path."""
+  for path in reversed(EXTRA_PATHS):
+    if path not in sys.path:
+      sys.path.insert(0, path)
+
+
+def setup_stubs():
+  """Installs fresh in-memory stubs for the App Engine services we use."""
+  from google.appengine.api import apiproxy_stub_map
+  from google.appengine.api import datastore_file_stub
+  from google.appengine.api.taskqueue import taskqueue_stub
+  from google.appengine.api.memcache import memcache_stub
+
+  app_id = os.environ.setdefault('APPLICATION_ID', 'bloggart-bench')
+  os.environ.setdefault('CURRENT_VERSION_ID', 'bench.1')
+  os.environ.setdefault('AUTH_DOMAIN', 'gmail.com')
+  apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+  apiproxy_stub_map.apiproxy.RegisterStub(
+      'datastore_v3', datastore_file_stub.DatastoreFileStub(app_id, None, None))
+  apiproxy_stub_map.apiproxy.RegisterStub(
+      'memcache', memcache_stub.MemcacheServiceStub())
+  apiproxy_stub_map.apiproxy.RegisterStub(
+      'taskqueue', taskqueue_stub.TaskQueueServiceStub(root_path=APP_DIR))
+
+
+def setup():
+  """Prepares the environment for importing application modules."""
+  setup_paths()
+  setup_stubs()
+  import appengine_config
+
+
+def timed(func, repeat=5, number=1, before=None):
+  """Times calls to func.
+
+  Args:
+    func: The function to time.
+    repeat: Number of timed runs.
+    number: Number of calls to func in each run.
+    before: If provided, a function called (untimed) before each run.
+  Returns:
+    The best time per call, in seconds.
+  """
+  best = None
+  for i in range(repeat):
+    if before:
+      before()
+    gc.collect()
+    start = time.time()
+    for j in range(number):
+      func()
+    elapsed = (time.time() - start) / number
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+
+def report(name, seconds, baseline=None):
+  """Prints one line of benchmark results."""
+  line = '%-48s %10.3f ms' % (name, seconds * 1000)
+  if baseline:
+    line += '  (%.1fx)' % (baseline / seconds)
+  print line
+
+
+def percentile(values, p):
+  """Returns the p'th percentile (0-100) of values, by nearest rank."""
+  if not values:
+    return None
+  ordered = sorted(values)
+  rank = int(math.ceil(p / 100.0 * len(ordered))) - 1
+  return ordered[max(0, min(rank, len(ordered) - 1))]
+
+
+def summarize(latencies):
+  """Returns a dict of statistics for a list of latencies, in seconds."""
+  total = sum(latencies)
+  return {
+      'count': len(latencies),
+      'mean_ms': total / len(latencies) * 1000,
+      'p50_ms': percentile(latencies, 50) * 1000,
+      'p90_ms': percentile(latencies, 90) * 1000,
+      'p99_ms': percentile(latencies, 99) * 1000,
+      'max_ms': max(latencies) * 1000,
+  }
+
+
+def git_revision():
+  """Returns the commit the application directory is at, if known."""
+  import subprocess
+  try:
+    process = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'],
+                               cwd=APP_DIR, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    revision = process.communicate()[0].strip()
+  except OSError:
+    return None
+  return revision or None
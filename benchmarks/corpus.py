@@ -0,0 +1,332 @@
+"""
+Benchmark corpora of post bodies in each supported markup.
+
+The synthetic corpus is generated from a fixed seed, so every run (and every
+commit) renders the same documents. A real-world corpus is a directory with
+a subdirectory per markup id, each holding one post body per file; since
+posts may be unpublished drafts, they should be anonymised before being
+shared:
+
+  python -m benchmarks.corpus anonymise SOURCE_DIR DEST_DIR
+  python -m benchmarks.corpus export [-l] DEST_DIR
+
+export fetches every post over remote_api (see script/remote.py) and writes
+anonymised copies of their bodies.
+"""
+
+import hashlib
+import keyword
+import os
+import random
+import re
+import sys
+
+import common
+
+
+VOCABULARY = (
+    'the of and to in is that for it as with was on be by this are from at '
+    'or an have not which but all were when we there can more if will one '
+    'about up out so what time only into some could them other than then '
+    'its also two how our first well way even new want because any these '
+    'give day most us request cache render page post tag feed server index '
+    'query entity memcache datastore template theme latency regenerate '
+    'publish deploy handler instance queue task markup summary archive'
+).split()
+
+CODE_SNIPPETS = (
+    ('python', '''class Cache(object):
+    def __init__(self, size=100):
+        self.size = size
+        self._items = {}
+
+    def get(self, key, default=None):
+        """Returns a cached value."""
+        return self._items.get(key, default)
+'''),
+    ('javascript', '''function debounce(fn, wait) {
+  var timer = null;
+  return function() {
+    var args = arguments, self = this;
+    clearTimeout(timer);
+    timer = setTimeout(function() { fn.apply(self, args); }, wait);
+  };
+}
+'''),
+    ('html', '''<ul class="posts">
+  <li><a href="/2010/01/hello">Hello &amp; welcome</a></li>
+  <li><a href="/2010/02/second">Second post</a></li>
+</ul>
+'''),
+    ('sql', '''SELECT p.title, COUNT(t.tag) AS tags
+  FROM posts p LEFT JOIN tags t ON t.post_id = p.id
+ WHERE p.published > '2010-01-01'
+ GROUP BY p.title ORDER BY tags DESC;
+'''),
+)
+
+
+class Generator(object):
+  """Generates documents in one markup from a seeded random source."""
+
+  def __init__(self, seed):
+    self.random = random.Random(seed)
+
+  def words(self, count):
+    return ' '.join(self.random.choice(VOCABULARY) for i in range(count))
+
+  def sentence(self):
+    text = self.words(self.random.randint(6, 18))
+    return text[0].upper() + text[1:] + '.'
+
+  def prose(self, sentences):
+    return ' '.join(self.sentence() for i in range(sentences))
+
+  def snippet(self):
+    return self.random.choice(CODE_SNIPPETS)
+
+  def document(self, markup, words, code_blocks=0):
+    """Returns a document of roughly words words with code_blocks snippets."""
+    parts = []
+    count = 0
+    # Spread the code blocks evenly through the prose.
+    code_at = [words * (i + 1) / (code_blocks + 1) for i in range(code_blocks)]
+    while count < words:
+      if code_at and count >= code_at[0]:
+        code_at.pop(0)
+        parts.append(getattr(self, markup + '_code')(*self.snippet()))
+        continue
+      kind = self.random.random()
+      text = self.prose(self.random.randint(2, 5))
+      count += len(text.split())
+      if kind < 0.1:
+        parts.append(getattr(self, markup + '_heading')(self.words(4)))
+      elif kind < 0.25:
+        parts.append(getattr(self, markup + '_list')(
+            [self.sentence() for i in range(self.random.randint(2, 6))]))
+      else:
+        parts.append(getattr(self, markup + '_paragraph')(text))
+    for i in code_at:
+      parts.append(getattr(self, markup + '_code')(*self.snippet()))
+    return '\n\n'.join(parts) + '\n'
+
+  def _inline(self, text, em, strong, code, link):
+    """Adds inline markup to some of the words in text.
+
+    em, strong and code are format strings taking the word; link is one
+    taking a dict with the link text and url.
+    """
+    words = text.split(' ')
+    for i in range(0, len(words) - 1, 7):
+      choice = self.random.randint(0, 4)
+      word = words[i]
+      if choice == 0:
+        words[i] = em % word
+      elif choice == 1:
+        words[i] = strong % word
+      elif choice == 2:
+        words[i] = code % word
+      elif choice == 3:
+        words[i] = link % {'text': word, 'url': 'http://example.com/' + word}
+    return ' '.join(words)
+
+  # HTML
+  def html_heading(self, text):
+    return '<h2>%s</h2>' % text
+
+  def html_paragraph(self, text):
+    return '<p>%s</p>' % self._inline(
+        text, '<em>%s</em>', '<strong>%s</strong>', '<code>%s</code>',
+        '<a href="%(url)s">%(text)s</a>')
+
+  def html_list(self, items):
+    return '<ul>\n%s\n</ul>' % '\n'.join('<li>%s</li>' % x for x in items)
+
+  def html_code(self, language, code):
+    return '<pre class="%s">%s</pre>' % (
+        language, code.replace('&', '&amp;').replace('<', '&lt;'))
+
+  # Plain text
+  def txt_heading(self, text):
+    return text.upper()
+
+  def txt_paragraph(self, text):
+    return text
+
+  def txt_list(self, items):
+    return '\n'.join('- %s' % x for x in items)
+
+  def txt_code(self, language, code):
+    return code
+
+  # Markdown
+  def markdown_heading(self, text):
+    return '## %s' % text
+
+  def markdown_paragraph(self, text):
+    return self._inline(text, '*%s*', '**%s**', '`%s`', '[%(text)s](%(url)s)')
+
+  def markdown_list(self, items):
+    return '\n'.join('* %s' % x for x in items)
+
+  def markdown_code(self, language, code):
+    return '[sourcecode:%s]\n%s[/sourcecode]' % (language, code)
+
+  # Textile
+  def textile_heading(self, text):
+    return 'h2. %s' % text
+
+  def textile_paragraph(self, text):
+    return self._inline(text, '_%s_', '*%s*', '@%s@', '"%(text)s":%(url)s')
+
+  def textile_list(self, items):
+    return '\n'.join('* %s' % x for x in items)
+
+  def textile_code(self, language, code):
+    return 'bc.. %s\n\np. %s' % (code.rstrip('\n'), self.sentence())
+
+  # reStructuredText
+  def rst_heading(self, text):
+    return '%s\n%s' % (text, '-' * len(text))
+
+  def rst_paragraph(self, text):
+    return self._inline(text, '*%s*', '**%s**', '``%s``',
+                        '`%(text)s <%(url)s>`__')
+
+  def rst_list(self, items):
+    return '\n'.join('* %s' % x for x in items)
+
+  def rst_code(self, language, code):
+    lines = ['   ' + line if line else '' for line in code.split('\n')]
+    return '.. sourcecode:: %s\n\n%s' % (language, '\n'.join(lines))
+
+
+# Cases in the synthetic corpus: name -> (words, code blocks, documents)
+SYNTHETIC_CASES = {
+    'short': (300, 0, 20),
+    'long': (5000, 0, 4),
+    'code': (1500, 20, 4),
+}
+
+
+def synthetic(markup, seed=1):
+  """Returns a dict of case name -> list of documents in a markup."""
+  cases = {}
+  for name, (words, code_blocks, count) in sorted(SYNTHETIC_CASES.items()):
+    generator = Generator('%s:%s:%s' % (seed, markup, name))
+    cases[name] = [generator.document(markup, words, code_blocks)
+                   for i in range(count)]
+  return cases
+
+
+def load(directory, markup):
+  """Returns a dict of case name -> documents from a real-world corpus."""
+  path = os.path.join(directory, markup)
+  if not os.path.isdir(path):
+    return {}
+  documents = []
+  for filename in sorted(os.listdir(path)):
+    f = open(os.path.join(path, filename))
+    try:
+      documents.append(f.read().decode('utf-8'))
+    finally:
+      f.close()
+  return {'real': documents}
+
+
+def _keep_words():
+  from pygments.lexers._mapping import LEXERS
+  words = set(keyword.kwlist)
+  for module_name, name, aliases, filenames, mimetypes in LEXERS.itervalues():
+    words.update(aliases)
+  words.update([
+      # Markup syntax: HTML tags and attributes, Textile block signatures,
+      # reStructuredText directives, and URL parts.
+      'href', 'src', 'alt', 'title', 'class', 'id', 'style', 'div', 'span',
+      'pre', 'code', 'em', 'strong', 'ul', 'ol', 'li', 'img', 'blockquote',
+      'table', 'tr', 'td', 'th', 'br', 'hr', 'notextile', 'bc', 'bq', 'fn',
+      'sourcecode', 'image', 'figure', 'note', 'warning', 'contents',
+      'literal', 'raw', 'http', 'https', 'www', 'com', 'org', 'mailto',
+      'function', 'var', 'return', 'true', 'false', 'null', 'self',
+      'select', 'from', 'where', 'join', 'order', 'group',
+  ])
+  return words
+
+_word = re.compile(r'[^\W\d_]+', re.U)
+_keep = None
+
+
+def anonymise(text, salt=''):
+  """Replaces the words in text with pseudo-words of the same shape.
+
+  Markup keywords, language names and programming language keywords are
+  kept, so the anonymised text exercises the same markup paths. Each word
+  always maps to the same pseudo-word for a given salt.
+  """
+  global _keep
+  if _keep is None:
+    _keep = _keep_words()
+
+  def replace(match):
+    word = match.group(0)
+    if len(word) <= 2 or word.lower() in _keep:
+      return word
+    digest = hashlib.sha1(salt + word.lower().encode('utf-8')).digest()
+    digest *= len(word) / len(digest) + 1
+    pseudo = ''.join(chr(ord('a') + ord(c) % 26) for c in digest[:len(word)])
+    if word.isupper():
+      return pseudo.upper()
+    if word[0].isupper():
+      return pseudo.capitalize()
+    return pseudo
+
+  return _word.sub(replace, text)
+
+
+def _write(directory, markup, name, body):
+  path = os.path.join(directory, markup)
+  if not os.path.isdir(path):
+    os.makedirs(path)
+  f = open(os.path.join(path, name), 'w')
+  try:
+    f.write(body.encode('utf-8'))
+  finally:
+    f.close()
+
+
+def anonymise_directory(source, dest, salt=''):
+  """Writes anonymised copies of a real-world corpus."""
+  for markup in sorted(os.listdir(source)):
+    for body in load(source, markup).get('real', []):
+      name = hashlib.sha1(body.encode('utf-8')).hexdigest()[:12] + '.txt'
+      _write(dest, markup, name, anonymise(body, salt))
+
+
+def export(dest, host=None, salt=''):
+  """Writes anonymised copies of every post body in an application."""
+  sys.path.insert(0, os.path.join(common.APP_DIR, 'script'))
+  import remote
+  remote.attach(host)
+  import models
+  for post in models.BlogPost.all():
+    _write(dest, post.body_markup, '%d.txt' % post.key().id(),
+           anonymise(post.body, salt))
+
+
+def main(argv):
+  if len(argv) == 3 and argv[0] == 'anonymise':
+    common.setup_paths()
+    anonymise_directory(argv[1], argv[2], os.environ.get('CORPUS_SALT', ''))
+  elif argv and argv[0] == 'export':
+    host = None
+    if argv[1] == '-l':
+      host = 'localhost:8080'
+      argv = argv[1:]
+    export(argv[1], host, os.environ.get('CORPUS_SALT', ''))
+  else:
+    print __doc__
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,57 @@
+"""
+Benchmarks storing the dependencies recorded on posts.
+
+Compares the pickled deps posts used to store with the encoding in
+dependencies.py, for posts with increasing numbers of tags: the size of the
+stored value, and the time taken to encode and decode it.
+"""
+
+import cPickle as pickle
+import hashlib
+
+import common
+common.setup_paths()
+
+import dependencies
+
+
+TAG_COUNTS = [1, 5, 20, 100]
+
+
+def make_deps(tags):
+  """Returns deps like those of a published post with the given tags."""
+  etag = hashlib.sha1('post').hexdigest()
+  summary_etag = hashlib.sha1('summary').hexdigest()
+  tag_names = set(u'tag-number-%d' % i for i in range(tags))
+  return {
+      'PostContentGenerator': (set([5629499534213120]), etag),
+      'PostPrevNextContentGenerator': (set([5066549580791808,
+                                            6192449487634432]), etag),
+      'IndexContentGenerator': (set(['index']), summary_etag),
+      'TagsContentGenerator': (tag_names, summary_etag),
+      'ArchivePageContentGenerator': (set(['2010/06']), summary_etag),
+      'ArchiveIndexContentGenerator': (set(['archive']), etag),
+      'AtomContentGenerator': (set(['atom']), etag),
+  }
+
+
+def bench(tags):
+  deps = make_deps(tags)
+  pickled = pickle.dumps(deps, pickle.HIGHEST_PROTOCOL)
+  encoded = dependencies.encode(deps)
+  print '%d tags: pickled %d bytes, encoded %d bytes' % (
+      tags, len(pickled), len(encoded))
+  old = common.timed(lambda: pickle.dumps(deps, pickle.HIGHEST_PROTOCOL),
+                     number=1000)
+  common.report('%d tags, pickle' % tags, old)
+  new = common.timed(lambda: dependencies.encode(deps), number=1000)
+  common.report('%d tags, encode' % tags, new, old)
+  old = common.timed(lambda: pickle.loads(pickled), number=1000)
+  common.report('%d tags, unpickle' % tags, old)
+  new = common.timed(lambda: dependencies.decode(encoded), number=1000)
+  common.report('%d tags, decode' % tags, new, old)
+
+
+if __name__ == '__main__':
+  for tags in TAG_COUNTS:
+    bench(tags)
@@ -0,0 +1,92 @@
+"""
+Benchmarks syntax highlighting of code-heavy posts.
+
+Covers lexer and formatter lookup (including misspelt language names, which
+used to fall through to a search of setuptools plugins) and rendering posts
+with many code blocks through Markdown, with and without warm caches.
+"""
+
+import common
+common.setup()
+
+import pygments.lexers
+import pygments.util
+from google.appengine.api import memcache
+from pygments.formatters import HtmlFormatter
+
+import highlighting
+import markup
+
+
+ALIASES = ['python', 'js', 'html', 'css', 'sql', 'bash', 'c', 'java']
+TYPOS = ['pyhton', 'javscript', 'htlm', 'shell-session', 'golang', 'c++11']
+
+SNIPPET = '''def fib(n):
+    """Returns the nth Fibonacci number."""
+    a, b = 0, 1
+    for i in range(n):
+        a, b = b, a + b
+    return a
+'''
+
+
+def make_post(blocks, aliases):
+  """Returns Markdown for a post with the given number of code blocks."""
+  parts = []
+  for i in range(blocks):
+    parts.append('Paragraph %d of prose leading into some code.\n' % i)
+    parts.append('[sourcecode:%s]\n# block %d\n%s[/sourcecode]\n'
+                 % (aliases[i % len(aliases)], i, SNIPPET))
+  return '\n'.join(parts)
+
+
+def clear_caches():
+  highlighting._cache.local.clear()
+  memcache.flush_all()
+
+
+def old_lookup(alias):
+  try:
+    pygments.lexers.get_lexer_by_name(alias)
+  except pygments.util.ClassNotFound:
+    pass
+  HtmlFormatter(lineseparator='<br />', linenos='inline')
+
+
+def new_lookup(alias):
+  try:
+    highlighting.get_lexer(alias)
+  except pygments.util.ClassNotFound:
+    pass
+  highlighting.get_formatter(dict(lineseparator='<br />', linenos='inline'))
+
+
+def bench_lookups(name, aliases):
+  old = common.timed(lambda: [old_lookup(a) for a in aliases], number=20)
+  common.report('%s lookup, get_lexer_by_name' % name, old)
+  new = common.timed(lambda: [new_lookup(a) for a in aliases], number=20)
+  common.report('%s lookup, highlighting' % name, new, old)
+
+
+def bench_post(name, aliases, blocks=20):
+  post = make_post(blocks, aliases)
+  cold = common.timed(lambda: markup.render_markdown(post),
+                      before=clear_caches)
+  common.report('%s, %d blocks, cold' % (name, blocks), cold)
+  warm = common.timed(lambda: markup.render_markdown(post), number=5)
+  common.report('%s, %d blocks, warm' % (name, blocks), warm, cold)
+  edited = post.replace('Paragraph 3', 'An edited paragraph')
+  markup.render_markdown(post)
+  prose = common.timed(lambda: markup.render_markdown(edited), number=5)
+  common.report('%s, %d blocks, prose edited' % (name, blocks), prose, cold)
+
+
+def main():
+  bench_lookups('known alias', ALIASES)
+  bench_lookups('misspelt alias', TYPOS)
+  bench_post('markdown post', ALIASES)
+  bench_post('markdown post with typos', ALIASES + TYPOS)
+
+
+if __name__ == '__main__':
+  main()
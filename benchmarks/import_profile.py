@@ -0,0 +1,93 @@
+"""
+Reports how long a cold instance spends importing each module.
+
+Each entry point is imported in a fresh interpreter, with __import__ wrapped
+to time every import that loads new modules. For each entry point, prints
+the total import time and the slowest imports, with their cumulative time
+(including the modules they import) and self time.
+
+Usage: python -m benchmarks.import_profile [-n count] [module ...]
+
+With no modules, profiles the modules that app.yaml routes requests to, plus
+markup on its own.
+"""
+
+import __builtin__
+import getopt
+import os
+import subprocess
+import sys
+import time
+
+import common
+
+
+ENTRY_POINTS = ['static', 'admin', 'deferred', 'markup']
+
+
+def profile_import(module_name):
+  """Imports a module, timing the imports it triggers.
+
+  Returns:
+    A (total seconds, records) tuple, where records is a list of
+    (name, cumulative seconds, self seconds) tuples.
+  """
+  real_import = __builtin__.__import__
+  records = []
+  # Time spent in nested imports, per level of the import stack.
+  child_times = [0.0]
+
+  def timed_import(name, *args, **kwargs):
+    loaded = len(sys.modules)
+    child_times.append(0.0)
+    start = time.time()
+    try:
+      return real_import(name, *args, **kwargs)
+    finally:
+      elapsed = time.time() - start
+      children = child_times.pop()
+      if len(sys.modules) != loaded:
+        records.append((name, elapsed, elapsed - children))
+        child_times[-1] += elapsed
+      else:
+        # Nothing new was loaded; charge any time to the caller.
+        child_times[-1] += children
+
+  __builtin__.__import__ = timed_import
+  start = time.time()
+  try:
+    __import__(module_name)
+  finally:
+    __builtin__.__import__ = real_import
+  return time.time() - start, records
+
+
+def child_main(module_name, count):
+  common.setup_paths()
+  common.setup_stubs()
+  os.environ.setdefault('SERVER_SOFTWARE', 'Development/1.0 (benchmark)')
+  total, records = profile_import(module_name)
+  records.sort(key=lambda r: r[1], reverse=True)
+  print '%s: %.1f ms, %d modules loaded' % (module_name, total * 1000,
+                                             len(records))
+  print '  %-44s %10s %10s' % ('import', 'cumulative', 'self')
+  for name, cumulative, own in records[:count]:
+    print '  %-44s %7.1f ms %7.1f ms' % (name, cumulative * 1000, own * 1000)
+  print
+
+
+def main(argv):
+  opts, args = getopt.getopt(argv, 'n:', ['child'])
+  opts = dict(opts)
+  count = int(opts.get('-n', 20))
+  if '--child' in opts:
+    child_main(args[0], count)
+    return
+  for module_name in args or ENTRY_POINTS:
+    subprocess.call([sys.executable, os.path.abspath(__file__), '--child',
+                     '-n', str(count), module_name],
+                    cwd=common.APP_DIR)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,227 @@
+"""
+Benchmarks rendering post bodies and summaries in every supported markup.
+
+Usage:
+  python -m benchmarks.markup_bench [-n iterations] [-m markup,...]
+      [-c corpus_dir] [--warm] [-o results.json]
+  python -m benchmarks.markup_bench --compare old.json new.json [-t percent]
+
+Each markup is benchmarked in a fresh interpreter, so peak memory is per
+engine. Every document in the synthetic corpus (and the real-world corpus in
+corpus_dir, if given; see benchmarks/corpus.py) is rendered as a body and as
+a summary, iterations times. Caches are cleared before each document unless
+--warm is given.
+
+For each markup, corpus case and operation, prints throughput, latency
+percentiles and the net number of garbage collected objects allocated per
+document, plus each engine's peak memory. -o writes the results as JSON;
+--compare reports the differences between two such files, and exits with
+status 1 if any case's median latency got more than -t percent (default 10)
+worse.
+"""
+
+import gc
+import getopt
+import os
+import subprocess
+import sys
+import time
+
+import common
+import corpus
+
+try:
+  import json
+except ImportError:
+  json = None
+
+
+MARKUPS = ['html', 'txt', 'markdown', 'textile', 'rst']
+
+
+class Post(object):
+  """The parts of a blog post that markup uses."""
+
+  def __init__(self, body, body_markup):
+    self.title = 'Benchmark'
+    self.path = None
+    self.body = body
+    self.body_markup = body_markup
+
+
+def _json():
+  if json:
+    return json
+  from django.utils import simplejson
+  return simplejson
+
+
+def clear_caches():
+  import highlighting
+  import markup
+  from google.appengine.api import memcache
+  memcache.flush_all()
+  highlighting._cache.local.clear()
+  markup._markdown_blocks.local.clear()
+
+
+def measure(func, posts, iterations, warm):
+  """Returns a list of latencies for rendering each post iterations times."""
+  latencies = []
+  for i in range(iterations):
+    for post in posts:
+      if not warm:
+        clear_caches()
+      start = time.time()
+      func(post)
+      latencies.append(time.time() - start)
+  return latencies
+
+
+def count_allocations(func, posts, warm):
+  """Returns the mean net count of GC tracked objects allocated per post."""
+  total = 0
+  gc.disable()
+  try:
+    for post in posts:
+      if not warm:
+        clear_caches()
+      gc.collect()
+      before = gc.get_count()[0]
+      func(post)
+      total += gc.get_count()[0] - before
+  finally:
+    gc.enable()
+  return total / float(len(posts))
+
+
+def run_markup(body_markup, iterations, corpus_dir=None, warm=False):
+  """Benchmarks one markup. Returns a dict of results."""
+  import resource
+  import markup
+
+  cases = corpus.synthetic(body_markup)
+  if corpus_dir:
+    cases.update(corpus.load(corpus_dir, body_markup))
+  results = {}
+  for case, documents in sorted(cases.items()):
+    posts = [Post(x, body_markup) for x in documents]
+    size = sum(len(x.encode('utf-8')) for x in documents)
+    for operation, func in (('body', markup.render_body),
+                            ('summary', markup.render_summary)):
+      for post in posts:
+        func(post)
+      latencies = measure(func, posts, iterations, warm)
+      total = sum(latencies)
+      stats = common.summarize(latencies)
+      stats.update({
+          'documents': len(posts),
+          'bytes': size,
+          'docs_per_sec': len(latencies) / total,
+          'kb_per_sec': size * iterations / 1024.0 / total,
+          'net_gc_allocations': count_allocations(func, posts, warm),
+      })
+      results['%s/%s/%s' % (body_markup, case, operation)] = stats
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return {'results': results, 'peak_rss_kb': {body_markup: peak}}
+
+
+def child_main(body_markup, iterations, corpus_dir, warm):
+  common.setup()
+  result = run_markup(body_markup, iterations, corpus_dir, warm)
+  sys.stdout.write(_json().dumps(result))
+
+
+def print_results(data):
+  print '%-28s %8s %9s %9s %9s %10s' % (
+      'case', 'docs/s', 'KB/s', 'p50 ms', 'p99 ms', 'gc objs')
+  for case, stats in sorted(data['results'].items()):
+    print '%-28s %8.1f %9.1f %9.2f %9.2f %10.0f' % (
+        case, stats['docs_per_sec'], stats['kb_per_sec'], stats['p50_ms'],
+        stats['p99_ms'], stats['net_gc_allocations'])
+  print
+  for body_markup, peak in sorted(data['peak_rss_kb'].items()):
+    print 'peak memory, %-15s %8d KB' % (body_markup, peak)
+
+
+def compare(old_path, new_path, threshold):
+  """Prints the differences between two result files.
+
+  Returns:
+    True if any case's median latency regressed by more than threshold
+    percent.
+  """
+  old = _json().load(open(old_path))
+  new = _json().load(open(new_path))
+  print '%-28s %9s %9s %8s %8s' % ('case', 'old p50', 'new p50', 'p50', 'KB/s')
+  regressed = False
+  for case in sorted(set(old['results']) & set(new['results'])):
+    a = old['results'][case]
+    b = new['results'][case]
+    p50_change = (b['p50_ms'] - a['p50_ms']) / a['p50_ms'] * 100
+    kb_change = (b['kb_per_sec'] - a['kb_per_sec']) / a['kb_per_sec'] * 100
+    flag = ''
+    if p50_change > threshold:
+      flag = '  REGRESSION'
+      regressed = True
+    print '%-28s %9.2f %9.2f %+7.1f%% %+7.1f%%%s' % (
+        case, a['p50_ms'], b['p50_ms'], p50_change, kb_change, flag)
+  for body_markup in sorted(set(old['peak_rss_kb']) & set(new['peak_rss_kb'])):
+    print 'peak memory, %-15s %8d KB -> %8d KB' % (
+        body_markup, old['peak_rss_kb'][body_markup],
+        new['peak_rss_kb'][body_markup])
+  return regressed
+
+
+def main(argv):
+  opts, args = getopt.getopt(argv, 'n:m:c:o:t:',
+                             ['child', 'warm', 'compare'])
+  opts = dict(opts)
+  common.setup_paths()
+  if '--compare' in opts:
+    threshold = float(opts.get('-t', 10))
+    sys.exit(compare(args[0], args[1], threshold) and 1 or 0)
+  iterations = int(opts.get('-n', 3))
+  corpus_dir = opts.get('-c')
+  warm = '--warm' in opts
+  if '--child' in opts:
+    child_main(args[0], iterations, corpus_dir, warm)
+    return
+
+  data = {
+      'revision': common.git_revision(),
+      'timestamp': time.time(),
+      'python': sys.version.split()[0],
+      'iterations': iterations,
+      'warm': warm,
+      'results': {},
+      'peak_rss_kb': {},
+  }
+  markups = opts.get('-m') and opts['-m'].split(',') or MARKUPS
+  for body_markup in markups:
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '-n', str(iterations)]
+    if corpus_dir:
+      command += ['-c', os.path.abspath(corpus_dir)]
+    if warm:
+      command.append('--warm')
+    process = subprocess.Popen(command + [body_markup], cwd=common.APP_DIR,
+                               stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+      print >>sys.stderr, 'Benchmarking %s failed' % body_markup
+      sys.exit(process.returncode)
+    result = _json().loads(output)
+    data['results'].update(result['results'])
+    data['peak_rss_kb'].update(result['peak_rss_kb'])
+  print_results(data)
+  if '-o' in opts:
+    f = open(opts['-o'], 'w')
+    try:
+      _json().dump(data, f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
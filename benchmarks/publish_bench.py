@@ -0,0 +1,273 @@
+"""
+Benchmarks publishing posts and regenerating the whole site.
+
+Usage:
+  python -m benchmarks.publish_bench [-n posts,...] [-t tags] [-p pages]
+      [-v] [-o results.json]
+
+For each number of posts (default 100,1000), a fresh interpreter seeds that
+many posts, tagged from a pool of -t tags, and -p pages into the SDK's
+in-memory datastore, memcache and task queue stubs. It then times:
+
+  regenerate: A rebuild into a new generation of static content, as
+      post_deploy.rebuild() starts it, run until no tasks are left.
+  publish: Publishing a new post, and the deferred tasks it starts.
+  edit: Republishing an existing post with a changed body.
+
+For each operation, prints wall time, the number of API calls, tasks
+enqueued and pages written, for the request itself and for the deferred
+tasks it started. -v also prints API calls by method.
+
+Timings come from the SDK stubs, whose queries scan every entity of a kind,
+so wall time grows faster with the number of posts than it does in
+production. API call and task counts are the same as in production.
+"""
+
+import base64
+import datetime
+import getopt
+import os
+import subprocess
+import sys
+import time
+
+import common
+import corpus
+
+try:
+  import json
+except ImportError:
+  json = None
+
+
+SEED_BATCH_SIZE = 500
+BASE_DATE = datetime.datetime(2010, 6, 1)
+
+
+def _json():
+  if json:
+    return json
+  from django.utils import simplejson
+  return simplejson
+
+
+class Recorder(object):
+  """An API call hook that counts calls, tasks enqueued and pages written."""
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.calls = {}
+    self.tasks = 0
+    self.pages = 0
+
+  def __call__(self, service, call, request, response):
+    name = '%s.%s' % (service, call)
+    self.calls[name] = self.calls.get(name, 0) + 1
+    if service == 'taskqueue':
+      if call == 'BulkAdd':
+        self.tasks += request.add_request_size()
+      elif call == 'Add':
+        self.tasks += 1
+    elif service == 'datastore_v3' and call == 'Put':
+      for entity in request.entity_list():
+        if entity.key().path().element_list()[-1].type() == 'StaticContent':
+          self.pages += 1
+
+  def results(self):
+    return {
+        'api_calls': sum(self.calls.values()),
+        'calls': dict(self.calls),
+        'tasks_enqueued': self.tasks,
+        'pages_written': self.pages,
+    }
+
+
+def seed(posts, tags, pages):
+  """Writes posts and pages, as if they had been published long ago."""
+  from google.appengine.ext import db
+  import models
+  import utils
+
+  generator = corpus.Generator('publish_bench')
+  tag_pool = ['tag %d' % i for i in range(tags)]
+  # Batch puts skip BlogPost.put(), so write summaries separately, once the
+  # posts have ids.
+  def put_posts(batch):
+    db.put(batch)
+    db.put([x for post in batch for x in post.get_entities()])
+  batch = []
+  for i in range(posts):
+    published = BASE_DATE - datetime.timedelta(hours=7 * i)
+    post = models.BlogPost(
+        title='Post %d' % i,
+        body=generator.document('markdown', 300),
+        body_markup='markdown',
+        tags=set(generator.random.sample(
+            tag_pool, generator.random.randint(1, min(tags, 3)))),
+        published=published,
+        updated=published)
+    post.path = utils.format_post_path(post, 0)
+    batch.append(post)
+    if len(batch) == SEED_BATCH_SIZE:
+      put_posts(batch)
+      batch = []
+  if batch:
+    put_posts(batch)
+    batch = []
+  for i in range(pages):
+    batch.append(models.Page(
+        key_name='/about-%d' % i, path='/about-%d' % i, title='Page %d' % i,
+        template='Simple.html', body=generator.document('html', 200)))
+  if batch:
+    db.put(batch)
+
+
+def drain():
+  """Runs queued tasks, and the tasks they queue, until none are left.
+
+  Returns:
+    The number of tasks run.
+  """
+  import cPickle
+  from google.appengine.api import apiproxy_stub_map
+  import static
+
+  stub = apiproxy_stub_map.apiproxy.GetStub('taskqueue')
+  count = 0
+  while True:
+    pending = []
+    for queue_name in ('default', static.BUILD_QUEUE):
+      pending.extend((queue_name, x) for x in stub.GetTasks(queue_name))
+    if not pending:
+      return count
+    for queue_name, task in pending:
+      stub.DeleteTask(queue_name, task['name'])
+      func, args, kwargs = cPickle.loads(base64.b64decode(task['body']))
+      func(*args, **kwargs)
+      count += 1
+
+
+def measure(recorder, func):
+  """Runs func then the tasks it started, and returns what each did."""
+  recorder.reset()
+  start = time.time()
+  func()
+  request = recorder.results()
+  request['seconds'] = time.time() - start
+
+  recorder.reset()
+  start = time.time()
+  tasks_run = drain()
+  deferred = recorder.results()
+  deferred['seconds'] = time.time() - start
+  deferred['tasks_run'] = tasks_run
+  return {'request': request, 'deferred': deferred}
+
+
+def regenerate():
+  import post_deploy
+  import static
+  import tasks
+  generation = static.start_build()
+  context = {'generation': generation, 'queue': static.BUILD_QUEUE}
+  tasks.run(context, post_deploy.PostRegenerator().regenerate)
+  tasks.run(context, post_deploy.PageRegenerator().regenerate)
+
+
+def publish_new():
+  import models
+  post = models.BlogPost(
+      title='A new post',
+      body=corpus.Generator('new').document('markdown', 300),
+      body_markup='markdown',
+      tags=set(['tag 0', 'new']),
+      published=BASE_DATE + datetime.timedelta(hours=1),
+      updated=BASE_DATE + datetime.timedelta(hours=1))
+  post.publish()
+
+
+def publish_edit():
+  import models
+  post = models.BlogPost.all().order('-published').fetch(1, 10)[0]
+  post.body += '\n\nAn update to the post.\n'
+  post.updated = BASE_DATE + datetime.timedelta(hours=2)
+  post.publish()
+
+
+def run_size(posts, tags, pages):
+  """Seeds a site of a given size and benchmarks operations on it."""
+  common.setup()
+  from google.appengine.api import apiproxy_stub_map
+
+  start = time.time()
+  seed(posts, tags, pages)
+  results = {'seed_seconds': time.time() - start}
+  recorder = Recorder()
+  apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('publish_bench',
+                                                      recorder)
+  for name, func in (('regenerate', regenerate),
+                     ('publish', publish_new),
+                     ('edit', publish_edit)):
+    results[name] = measure(recorder, func)
+  return results
+
+
+def print_results(posts, results, verbose=False):
+  print '%d posts (seeded in %.1fs)' % (posts, results['seed_seconds'])
+  print '  %-22s %9s %9s %7s %7s' % ('', 'seconds', 'API calls', 'tasks',
+                                     'pages')
+  for name in ('regenerate', 'publish', 'edit'):
+    for part in ('request', 'deferred'):
+      stats = results[name][part]
+      print '  %-22s %9.2f %9d %7d %7d' % (
+          '%s, %s' % (name, part), stats['seconds'], stats['api_calls'],
+          stats['tasks_enqueued'], stats['pages_written'])
+      if verbose:
+        for call, count in sorted(stats['calls'].items()):
+          print '    %-32s %8d' % (call, count)
+  print
+
+
+def main(argv):
+  opts, args = getopt.getopt(argv, 'n:t:p:o:v', ['child'])
+  opts = dict(opts)
+  tags = int(opts.get('-t', 20))
+  pages = int(opts.get('-p', 10))
+  if '--child' in opts:
+    results = run_size(int(args[0]), tags, pages)
+    sys.stdout.write(_json().dumps(results))
+    return
+
+  common.setup_paths()
+  data = {
+      'revision': common.git_revision(),
+      'timestamp': time.time(),
+      'python': sys.version.split()[0],
+      'tags': tags,
+      'pages': pages,
+      'results': {},
+  }
+  for posts in [int(x) for x in opts.get('-n', '100,1000').split(',')]:
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '-t', str(tags), '-p', str(pages), str(posts)]
+    process = subprocess.Popen(command, cwd=common.APP_DIR,
+                               stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode:
+      print >>sys.stderr, 'Benchmarking %d posts failed' % posts
+      sys.exit(process.returncode)
+    results = _json().loads(output)
+    print_results(posts, results, '-v' in opts)
+    data['results'][str(posts)] = results
+  if '-o' in opts:
+    f = open(opts['-o'], 'w')
+    try:
+      _json().dump(data, f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
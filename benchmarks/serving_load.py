@@ -0,0 +1,324 @@
+"""
+Replays a traffic mix against the static content handler, in-process.
+
+Usage:
+  python -m benchmarks.serving_load [-n requests] [-c threads] [-p posts]
+      [-m kind=weight,...] [--memcache-latency ms] [--datastore-latency ms]
+      [--evict fraction] [-r target_rps] [-o results.json]
+
+Seeds -p posts' worth of static content into the SDK's in-memory stubs, then
+makes -n requests to static.application from -c threads, with no network in
+between. Request kinds, and their default weights in the mix, are:
+
+  home (30): The front page.
+  post (35): A post, chosen with a long-tailed (Zipf) popularity.
+  revalidate (15): A post, conditional on the ETag served for it.
+  not_found (10): Scans for paths that don't exist.
+  feed (10): The Atom feed, conditional on its Last-Modified, as feed
+      readers poll.
+
+Each API call is delayed by the configured latency for its service, to
+stand in for production memcache and datastore round trips, and --evict
+drops that fraction of requested paths from memcache beforehand.
+
+Prints requests per second, latency percentiles, API calls per request and
+status codes, by request kind and overall. Given -r, also estimates the
+number of instances needed to serve that many requests per second.
+"""
+
+import bisect
+import getopt
+import random
+import StringIO
+import sys
+import threading
+import time
+
+import common
+
+try:
+  import json
+except ImportError:
+  json = None
+
+
+DEFAULT_MIX = {
+    'home': 30,
+    'post': 35,
+    'revalidate': 15,
+    'not_found': 10,
+    'feed': 10,
+}
+
+SCAN_PATHS = ['/wp-login.php', '/xmlrpc.php', '/.env', '/admin.php',
+              '/phpmyadmin/', '/.git/config', '/cgi-bin/test.cgi']
+
+FEED_PATH = '/feeds/atom.xml'
+
+
+def _json():
+  if json:
+    return json
+  from django.utils import simplejson
+  return simplejson
+
+
+class Hooks(object):
+  """API call hooks that add latency and count calls made by each thread."""
+
+  def __init__(self, latencies):
+    self.latencies = latencies
+    self._local = threading.local()
+
+  def reset(self):
+    self._local.calls = 0
+
+  @property
+  def calls(self):
+    return getattr(self._local, 'calls', 0)
+
+  def __call__(self, service, call, request, response):
+    self._local.calls = self.calls + 1
+    delay = self.latencies.get(service)
+    if delay:
+      time.sleep(delay)
+
+
+class Site(object):
+  """The static content a load test requests."""
+
+  def __init__(self, posts, seed=1):
+    import config
+    import static
+    self.random = random.Random(seed)
+    body = '<html><body>%s</body></html>' % ('<p>Lorem ipsum.</p>\n' * 800)
+    self.home = static.set('/', body, config.html_mime_type)
+    self.feed = static.set(FEED_PATH, body, 'application/atom+xml',
+                           indexed=False)
+    self.posts = []
+    for i in range(posts):
+      self.posts.append(static.set('/2010/01/post-%d' % i, body,
+                                   config.html_mime_type))
+    # Zipf popularity: the post at rank i is requested in proportion to 1/i.
+    self.cumulative = []
+    total = 0.0
+    for i in range(posts):
+      total += 1.0 / (i + 1)
+      self.cumulative.append(total)
+
+  def popular_post(self):
+    point = self.random.random() * self.cumulative[-1]
+    return self.posts[bisect.bisect_left(self.cumulative, point)]
+
+  def request(self, kind):
+    """Returns (path, headers) for a request of the given kind."""
+    if kind == 'home':
+      return '/', {}
+    elif kind == 'post':
+      return self.popular_post().key().name(), {}
+    elif kind == 'revalidate':
+      post = self.popular_post()
+      return post.key().name(), {'HTTP_IF_NONE_MATCH': '"%s"' % post.etag}
+    elif kind == 'not_found':
+      path = self.random.choice(SCAN_PATHS)
+      return '%s?%d' % (path, self.random.randint(0, 1000)), {}
+    elif kind == 'feed':
+      import static
+      since = self.feed.last_modified.strftime(static.HTTP_DATE_FMT)
+      return FEED_PATH, {'HTTP_IF_MODIFIED_SINCE': since}
+    raise ValueError('Unknown request kind %r' % kind)
+
+
+def make_schedule(mix, count, seed=1):
+  """Returns a list of request kinds, in the proportions given by mix."""
+  rand = random.Random(seed)
+  kinds = sorted(mix)
+  cumulative = []
+  total = 0.0
+  for kind in kinds:
+    total += mix[kind]
+    cumulative.append(total)
+  return [kinds[bisect.bisect_left(cumulative, rand.random() * total)]
+          for i in range(count)]
+
+
+def call_application(application, path, headers):
+  """Makes one request to a WSGI application, returning the status code."""
+  if '?' in path:
+    path, query = path.split('?', 1)
+  else:
+    query = ''
+  environ = {
+      'REQUEST_METHOD': 'GET',
+      'SCRIPT_NAME': '',
+      'PATH_INFO': path,
+      'QUERY_STRING': query,
+      'SERVER_NAME': 'localhost',
+      'SERVER_PORT': '80',
+      'SERVER_PROTOCOL': 'HTTP/1.1',
+      'wsgi.version': (1, 0),
+      'wsgi.url_scheme': 'http',
+      'wsgi.input': StringIO.StringIO(),
+      'wsgi.errors': sys.stderr,
+      'wsgi.multithread': True,
+      'wsgi.multiprocess': True,
+      'wsgi.run_once': False,
+  }
+  environ.update(headers)
+  status = []
+  def start_response(status_line, response_headers, exc_info=None):
+    status.append(int(status_line.split(' ', 1)[0]))
+    return lambda data: None
+  for data in application(environ, start_response):
+    pass
+  return status[0]
+
+
+def run(site, schedule, threads, hooks, evict=0.0):
+  """Makes the scheduled requests. Returns a list of per-request results."""
+  from google.appengine.api import memcache
+  import static
+
+  results = []
+  results_lock = threading.Lock()
+  position = [0]
+
+  def worker():
+    rand = random.Random(threading.currentThread().getName())
+    while True:
+      results_lock.acquire()
+      try:
+        if position[0] >= len(schedule):
+          return
+        kind = schedule[position[0]]
+        path, headers = site.request(kind)
+        position[0] += 1
+      finally:
+        results_lock.release()
+      if evict and rand.random() < evict:
+        memcache.delete(static._cache_key(path.split('?')[0],
+                                          static.read_generation()))
+      hooks.reset()
+      start = time.time()
+      status = call_application(static.application, path, headers)
+      elapsed = time.time() - start
+      results_lock.acquire()
+      try:
+        results.append((kind, status, elapsed, hooks.calls))
+      finally:
+        results_lock.release()
+
+  workers = [threading.Thread(target=worker, name='worker-%d' % i)
+             for i in range(threads)]
+  for t in workers:
+    t.start()
+  for t in workers:
+    t.join()
+  return results
+
+
+def summarize(results, seconds):
+  """Returns statistics for a list of (kind, status, latency, calls)."""
+  stats = common.summarize([x[2] for x in results])
+  statuses = {}
+  for x in results:
+    statuses[str(x[1])] = statuses.get(str(x[1]), 0) + 1
+  stats.update({
+      'requests_per_sec': len(results) / seconds,
+      'api_calls_per_request': sum(x[3] for x in results) / float(len(results)),
+      'statuses': statuses,
+  })
+  return stats
+
+
+def print_results(data):
+  print '%-12s %7s %9s %8s %8s %8s %8s  %s' % (
+      'kind', 'count', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'calls',
+      'statuses')
+  for kind in sorted(data['kinds']) + ['all']:
+    if kind == 'all':
+      stats = data['all']
+    else:
+      stats = data['kinds'][kind]
+    statuses = ' '.join('%s:%d' % x for x in sorted(stats['statuses'].items()))
+    print '%-12s %7d %9.1f %8.2f %8.2f %8.2f %8.2f  %s' % (
+        kind, stats['count'], stats['requests_per_sec'], stats['p50_ms'],
+        stats['p90_ms'], stats['p99_ms'], stats['api_calls_per_request'],
+        statuses)
+  if data.get('target_rps'):
+    print
+    print '%d instances at %d threads each for %d requests/sec' % (
+        data['instances'], data['threads'], data['target_rps'])
+
+
+def parse_mix(value):
+  mix = {}
+  for item in value.split(','):
+    kind, weight = item.split('=')
+    if kind not in DEFAULT_MIX:
+      raise ValueError('Unknown request kind %r' % kind)
+    mix[kind] = float(weight)
+  return mix
+
+
+def main(argv):
+  opts, args = getopt.getopt(argv, 'n:c:p:m:r:o:', [
+      'memcache-latency=', 'datastore-latency=', 'evict='])
+  opts = dict(opts)
+  count = int(opts.get('-n', 2000))
+  threads = int(opts.get('-c', 1))
+  mix = DEFAULT_MIX
+  if '-m' in opts:
+    mix = parse_mix(opts['-m'])
+  latencies = {
+      'memcache': float(opts.get('--memcache-latency', 0)) / 1000,
+      'datastore_v3': float(opts.get('--datastore-latency', 0)) / 1000,
+  }
+
+  common.setup()
+  import logging
+  from google.appengine.api import apiproxy_stub_map
+  # 404s for scans are expected; don't log them.
+  logging.getLogger().setLevel(logging.ERROR)
+
+  site = Site(int(opts.get('-p', 500)))
+  hooks = Hooks(latencies)
+  apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('serving_load', hooks)
+  # Warm up imports, templates and memcache before timing anything.
+  run(site, make_schedule(mix, 100, seed=2), 1, hooks)
+
+  schedule = make_schedule(mix, count)
+  start = time.time()
+  results = run(site, schedule, threads, hooks,
+                float(opts.get('--evict', 0)))
+  seconds = time.time() - start
+
+  data = {
+      'revision': common.git_revision(),
+      'timestamp': time.time(),
+      'python': sys.version.split()[0],
+      'threads': threads,
+      'mix': mix,
+      'latencies_ms': dict((k, v * 1000) for k, v in latencies.items()),
+      'all': summarize(results, seconds),
+      'kinds': {},
+  }
+  for kind in mix:
+    kind_results = [x for x in results if x[0] == kind]
+    if kind_results:
+      data['kinds'][kind] = summarize(kind_results, seconds)
+  if '-r' in opts:
+    data['target_rps'] = float(opts['-r'])
+    rps = data['all']['requests_per_sec']
+    data['instances'] = int(-(-data['target_rps'] // rps))
+  print_results(data)
+  if '-o' in opts:
+    f = open(opts['-o'], 'w')
+    try:
+      _json().dump(data, f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
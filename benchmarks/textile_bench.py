@@ -0,0 +1,63 @@
+"""
+Benchmarks the bundled Textile renderer on long posts.
+
+Usage: python -m benchmarks.textile_bench [-c other_textile.py] [-p paragraphs]
+
+With -c, the same corpus is also rendered with another copy of textile.py
+(eg, one exported from an earlier revision with git show) and the
+throughput of the two is compared.
+"""
+
+import getopt
+import imp
+import sys
+
+import common
+common.setup_paths()
+
+import textile
+
+
+PARAGRAPHS = (
+    'h2. Section %(i)d',
+    'p(intro). Paragraph %(i)d has *strong*, _emphasised_ and -deleted- text, '
+    'a "link to somewhere":http://example.com/%(i)d and a "reference":ref%(i)d. '
+    'It\'s got "quotes", an ellipsis... and an -- em dash, plus NASA(National '
+    'Aeronautics and Space Administration) and 3 x 4 dimensions[1].',
+    '* first item with @inline code@\n* second item\n** nested item\n# ordered',
+    '|_. name|_. value|\n|alpha|%(i)d|\n|(odd). beta|\\2. spanning|',
+    'bc. for i in range(%(i)d):\n    print "<%%d>" %% i',
+    'bq. A quotation with ==no *textile*== and !/images/%(i)d.png(Picture)!',
+    '[ref%(i)d]http://example.com/refs/%(i)d',
+)
+
+
+def make_post(paragraphs):
+  """Returns a Textile post with the given number of paragraphs."""
+  parts = []
+  for i in range(paragraphs):
+    parts.append(PARAGRAPHS[i % len(PARAGRAPHS)] % {'i': i})
+  parts.append('fn1. A footnote.')
+  return '\n\n'.join(parts)
+
+
+def bench(name, module, post):
+  seconds = common.timed(lambda: module.textile(post), repeat=5, number=3)
+  common.report('%s, %d KB post' % (name, len(post) / 1024), seconds)
+  print '%-48s %10.1f KB/s' % ('', len(post) / 1024.0 / seconds)
+  return seconds
+
+
+def main(argv):
+  opts, args = getopt.getopt(argv, 'c:p:')
+  opts = dict(opts)
+  post = make_post(int(opts.get('-p', 500)))
+  current = bench('textile', textile, post)
+  if '-c' in opts:
+    other = imp.load_source('other_textile', opts['-c'])
+    baseline = bench('textile (%s)' % opts['-c'], other, post)
+    common.report('speedup', current, baseline)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
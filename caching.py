@@ -0,0 +1,153 @@
+"""
+Two-tier caches for expensive, deterministic rendering work.
+
+Values are looked up in a bounded in-process LRU first and then in memcache,
+so repeated work is shared both within an instance and across instances.
+Keys should be short strings (callers normally pass a hex digest).
+"""
+
+import threading
+
+from google.appengine.api import memcache
+
+import stats
+
+
+class LRUCache(object):
+  """A bounded, thread-safe mapping that evicts the least recently used key."""
+
+  def __init__(self, size):
+    self.size = size
+    self._lock = threading.Lock()
+    self._map = {}
+    # Circular doubly linked list of [prev, next, key, value] entries, with
+    # the most recently used entry just after the root.
+    self._root = root = []
+    root[:] = [root, root, None, None]
+
+  def __len__(self):
+    return len(self._map)
+
+  def __contains__(self, key):
+    return key in self._map
+
+  def _unlink(self, entry):
+    prev, next = entry[0], entry[1]
+    prev[1] = next
+    next[0] = prev
+
+  def _link_front(self, entry):
+    root = self._root
+    first = root[1]
+    entry[0] = root
+    entry[1] = first
+    first[0] = entry
+    root[1] = entry
+
+  def get(self, key, default=None):
+    self._lock.acquire()
+    try:
+      entry = self._map.get(key)
+      if entry is None:
+        return default
+      self._unlink(entry)
+      self._link_front(entry)
+      return entry[3]
+    finally:
+      self._lock.release()
+
+  def set(self, key, value):
+    self._lock.acquire()
+    try:
+      entry = self._map.get(key)
+      if entry is not None:
+        entry[3] = value
+        self._unlink(entry)
+      else:
+        entry = [None, None, key, value]
+        self._map[key] = entry
+      self._link_front(entry)
+      while len(self._map) > self.size:
+        last = self._root[0]
+        self._unlink(last)
+        del self._map[last[2]]
+    finally:
+      self._lock.release()
+
+  def delete(self, key):
+    self._lock.acquire()
+    try:
+      entry = self._map.pop(key, None)
+      if entry is not None:
+        self._unlink(entry)
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._map.clear()
+      root = self._root
+      root[:] = [root, root, None, None]
+    finally:
+      self._lock.release()
+
+
+class TieredCache(object):
+  """A cache backed by an in-process LRU and a memcache namespace.
+
+  None is never stored, so a None result always means a miss.
+  """
+
+  def __init__(self, namespace, size=1000, time=0):
+    """Constructor.
+
+    Args:
+      namespace: The memcache namespace to store values in.
+      size: Maximum number of values held in-process.
+      time: Memcache expiry for values, in seconds. 0 means no expiry.
+    """
+    self.namespace = namespace
+    self.time = time
+    self.local = LRUCache(size)
+
+  def get(self, key):
+    value = self.local.get(key)
+    stats.hit('%s local' % self.namespace, value is not None)
+    if value is None:
+      value = memcache.get(key, namespace=self.namespace)
+      stats.hit('%s memcache' % self.namespace, value is not None)
+      if value is not None:
+        self.local.set(key, value)
+    return value
+
+  def get_multi(self, keys):
+    """Returns a dict of key -> value for the keys that are cached."""
+    found = {}
+    missing = []
+    for key in keys:
+      value = self.local.get(key)
+      if value is None:
+        missing.append(key)
+      else:
+        found[key] = value
+    stats.hit('%s local' % self.namespace, True, len(found))
+    stats.hit('%s local' % self.namespace, False, len(missing))
+    if missing:
+      remote = memcache.get_multi(missing, namespace=self.namespace)
+      stats.hit('%s memcache' % self.namespace, True, len(remote))
+      stats.hit('%s memcache' % self.namespace, False,
+                len(missing) - len(remote))
+      for key, value in remote.iteritems():
+        self.local.set(key, value)
+      found.update(remote)
+    return found
+
+  def set(self, key, value):
+    self.local.set(key, value)
+    memcache.set(key, value, time=self.time, namespace=self.namespace)
+
+  def set_multi(self, mapping):
+    for key, value in mapping.iteritems():
+      self.local.set(key, value)
+    memcache.set_multi(mapping, time=self.time, namespace=self.namespace)
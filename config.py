@@ -40,6 +40,22 @@ sidebars = [
   ]),
 ]
 
+# If True, HTML pages are stored as just the blocks that vary from page to
+# page (see assembled_page_blocks) and spliced into a shared layout when
+# served. Changing a sidebar or base.html then only requires the layouts to be
+# rewritten, which happens automatically on deploy, rather than regenerating
+# every post and listing page.
+assembled_pages = False
+
+# The template blocks stored per page when assembled_pages is True. Pages
+# share a layout when everything outside these blocks is the same, so the more
+# of a page that varies from page to page is inside them, the fewer layouts.
+assembled_page_blocks = ('title', 'head', 'body')
+
+# Paths that are loaded into memcache whenever a post is published, in
+# addition to the post itself, the homepage and the post's tag pages.
+warm_paths = ['/feeds/atom.xml', '/archive/']
+
 # Number of entries per page in indexes.
 posts_per_page = 10
 
@@ -73,6 +89,22 @@ google_site_verification = None
 # Default markup language for entry bodies (defaults to html).
 default_markup = 'html'
 
+# Budget for rendering a post body. Bodies that take longer than this many
+# seconds, or render to more than this many characters, are shown as
+# preformatted text instead.
+render_time_limit = 10
+render_size_limit = 1024 * 1024
+
+# Render post bodies in a worker process, so that ones over the time budget
+# can be cut off. Needs a runtime that can fork (App Engine can't), and the
+# worker doesn't share this process's renderer and block caches, so it's off
+# by default.
+render_in_worker = False
+
+# Fraction of timed stages and cache lookups that are recorded for the admin
+# stats page (/admin/stats). 0 turns recording off.
+stats_sample_rate = 0
+
 # Syntax highlighting style for RestructuredText and Markdown,
 # one of 'manni', 'perldoc', 'borland', 'colorful', 'default', 'murphy',
 # 'vs', 'trac', 'tango', 'fruity', 'autumn', 'bw', 'emacs', 'pastie',
@@ -27,8 +27,10 @@ See deferred.py for full documentation.
 from google.appengine.ext import deferred
 from google.appengine.ext.webapp.util import run_wsgi_app
 
+import profiler
+
 def main():
-  run_wsgi_app(deferred.application)
+  run_wsgi_app(profiler.middleware(deferred.application))
 
 
 if __name__ == "__main__":
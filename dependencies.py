@@ -0,0 +1,189 @@
+"""
+A compact encoding for the dependencies recorded on each BlogPost.
+
+A post's deps map the name of each content generator to a (resources, etag)
+tuple: the set of resources the post contributed to when it was last
+published, and the etag of the post as that generator saw it. They used to be
+pickled, which stores every generator name and resource as a string, and is
+slow to load.
+
+Encoded deps start with MAGIC and a format version. Then, for each
+generator, sorted by name:
+  - its index in GENERATOR_NAMES, as one byte, or NAMED_GENERATOR followed
+    by its name for generators not in the list;
+  - the etag: ETAG_NONE; ETAG_SHA1 and the 20 bytes of a SHA-1 hex digest;
+    or ETAG_TEXT followed by the etag;
+  - the number of integer resources (post ids), then each as 8 bytes,
+    little-endian, in order;
+  - the number of string resources, then each, sorted.
+Numbers are varints, as in protocol buffers, and strings are a varint length
+followed by UTF-8, so any string, including the empty one, round-trips.
+String resources come back as unicode. Version 1 joined the string
+resources with NULs instead, and is still read. benchmarks/deps_bench.py
+compares sizes and timings with pickling.
+
+Values stored before this encoding was introduced are still read, and are
+rewritten in it the next time the post is put.
+"""
+
+import binascii
+import cPickle as pickle
+import re
+import struct
+
+from google.appengine.ext import db
+
+
+MAGIC = '\x00D'
+VERSION = 2
+
+# Generators are stored as their index in this list, so only add to the end.
+GENERATOR_NAMES = [
+    'PostContentGenerator',
+    'PostPrevNextContentGenerator',
+    'IndexContentGenerator',
+    'TagsContentGenerator',
+    'ArchivePageContentGenerator',
+    'ArchiveIndexContentGenerator',
+    'AtomContentGenerator',
+    'PageContentGenerator',
+]
+NAMED_GENERATOR = 0xff
+
+ETAG_NONE, ETAG_SHA1, ETAG_TEXT = 0, 1, 2
+
+_GENERATOR_IDS = dict((name, i) for i, name in enumerate(GENERATOR_NAMES))
+_SHA1_HEX = re.compile('^[0-9a-f]{40}$')
+
+
+def _write_varint(out, value):
+  while value >= 0x80:
+    out.append(chr((value & 0x7f) | 0x80))
+    value >>= 7
+  out.append(chr(value))
+
+
+def _read_varint(data, pos):
+  value = shift = 0
+  while True:
+    byte = ord(data[pos])
+    pos += 1
+    value |= (byte & 0x7f) << shift
+    if byte < 0x80:
+      return value, pos
+    shift += 7
+
+
+def _write_text(out, value):
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  _write_varint(out, len(value))
+  out.append(value)
+
+
+def _read_text(data, pos):
+  length, pos = _read_varint(data, pos)
+  return data[pos:pos + length].decode('utf-8'), pos + length
+
+
+def encode(deps):
+  """Returns the encoding of a deps dict, as a string."""
+  out = [MAGIC, chr(VERSION)]
+  for name in sorted(deps):
+    resources, etag = deps[name]
+    generator_id = _GENERATOR_IDS.get(name)
+    if generator_id is None:
+      out.append(chr(NAMED_GENERATOR))
+      _write_text(out, name)
+    else:
+      out.append(chr(generator_id))
+    if etag is None:
+      out.append(chr(ETAG_NONE))
+    elif isinstance(etag, basestring) and _SHA1_HEX.match(etag):
+      out.append(chr(ETAG_SHA1))
+      out.append(binascii.unhexlify(etag))
+    else:
+      out.append(chr(ETAG_TEXT))
+      _write_text(out, etag)
+    ids = []
+    strings = []
+    for resource in resources:
+      if isinstance(resource, (int, long)):
+        ids.append(resource)
+      elif isinstance(resource, basestring):
+        strings.append(resource)
+      else:
+        raise ValueError('Cannot encode resource %r' % (resource,))
+    ids.sort()
+    strings.sort()
+    _write_varint(out, len(ids))
+    out.append(struct.pack('<%dQ' % len(ids), *ids))
+    _write_varint(out, len(strings))
+    for resource in strings:
+      _write_text(out, resource)
+  return ''.join(out)
+
+
+def decode(data):
+  """Returns the deps dict encoded in a string.
+
+  Strings that aren't in this encoding are unpickled.
+  """
+  if not data.startswith(MAGIC):
+    return pickle.loads(data)
+  version = ord(data[len(MAGIC)])
+  if version not in (1, VERSION):
+    raise ValueError('Unknown deps encoding version %d' % version)
+  deps = {}
+  pos = len(MAGIC) + 1
+  while pos < len(data):
+    generator_id = ord(data[pos])
+    pos += 1
+    if generator_id == NAMED_GENERATOR:
+      name, pos = _read_text(data, pos)
+      name = str(name)
+    else:
+      name = GENERATOR_NAMES[generator_id]
+    etag_kind = ord(data[pos])
+    pos += 1
+    if etag_kind == ETAG_NONE:
+      etag = None
+    elif etag_kind == ETAG_SHA1:
+      etag = binascii.hexlify(data[pos:pos + 20])
+      pos += 20
+    else:
+      etag, pos = _read_text(data, pos)
+    count, pos = _read_varint(data, pos)
+    resources = set(struct.unpack('<%dQ' % count, data[pos:pos + count * 8]))
+    pos += count * 8
+    if version == 1:
+      strings, pos = _read_text(data, pos)
+      if strings:
+        resources.update(strings.split(u'\x00'))
+    else:
+      count, pos = _read_varint(data, pos)
+      for i in range(count):
+        resource, pos = _read_text(data, pos)
+        resources.add(resource)
+    deps[name] = (resources, etag)
+  return deps
+
+
+class DepsProperty(db.Property):
+  """A property holding a deps dict, stored in the encoding above."""
+
+  data_type = dict
+
+  def get_value_for_datastore(self, model_instance):
+    value = super(DepsProperty, self).get_value_for_datastore(model_instance)
+    if value is None:
+      return None
+    return db.Blob(encode(value))
+
+  def make_value_from_datastore(self, value):
+    if value is None:
+      return None
+    return decode(value)
+
+  def empty(self, value):
+    return value is None
@@ -0,0 +1,98 @@
+"""
+Template fragment caching for the chrome shared between pages.
+
+Sidebars, navigation and the footer are identical across thousands of pages,
+so rendering them once per run (rather than once per page) is a big win
+during bulk regeneration. Wrap such a fragment in a cachefragment tag:
+
+  {% cachefragment "sidebars" %} ... {% endcachefragment %}
+
+Any further arguments are template variables the fragment depends on:
+
+  {% cachefragment "nav" generator_class %} ... {% endcachefragment %}
+
+Fragments are keyed by name, the values of those variables, the theme, a
+fingerprint of config.py and the app version, so deploying a new config or
+template invalidates them automatically. Never wrap a {% block %} in a cached
+fragment, as its contents vary with the child template.
+"""
+
+import hashlib
+import os
+import types
+
+from django import template
+
+import caching
+import config
+
+
+_cache = caching.TieredCache('fragments', size=200)
+_config_fingerprint = None
+
+
+def _canonical(value):
+  """Returns a repr of value that doesn't depend on dict ordering."""
+  if isinstance(value, dict):
+    items = sorted((_canonical(k), _canonical(v)) for k, v in value.items())
+    return '{%s}' % ', '.join('%s: %s' % x for x in items)
+  if isinstance(value, (list, tuple)):
+    return '[%s]' % ', '.join(_canonical(x) for x in value)
+  return repr(value)
+
+
+def config_fingerprint():
+  """Returns a digest of the settings in config.py."""
+  global _config_fingerprint
+  if _config_fingerprint is None:
+    settings = dict((k, v) for k, v in config.__dict__.items()
+                    if not k.startswith('_')
+                    and not isinstance(v, types.ModuleType))
+    _config_fingerprint = hashlib.sha1(_canonical(settings)).hexdigest()
+  return _config_fingerprint
+
+
+def fragment_key(name, vary_on=()):
+  """Returns the cache key for a named fragment.
+
+  Args:
+    name: The fragment name.
+    vary_on: Values the fragment's contents depend on.
+  Returns:
+    A hex digest identifying this rendering of the fragment.
+  """
+  val = (name, _canonical(list(vary_on)), _canonical(config.theme),
+         config_fingerprint(), os.environ.get('CURRENT_VERSION_ID', ''))
+  return hashlib.sha1(repr(val)).hexdigest()
+
+
+class CacheFragmentNode(template.Node):
+  def __init__(self, nodelist, name, vary_on):
+    self.nodelist = nodelist
+    self.name = name
+    self.vary_on = [template.Variable(x) for x in vary_on]
+
+  def render(self, context):
+    vary_values = []
+    for var in self.vary_on:
+      try:
+        vary_values.append(var.resolve(context))
+      except template.VariableDoesNotExist:
+        vary_values.append(None)
+    key = fragment_key(self.name, vary_values)
+    rendered = _cache.get(key)
+    if rendered is None:
+      rendered = self.nodelist.render(context)
+      _cache.set(key, rendered)
+    return rendered
+
+
+def do_cachefragment(parser, token):
+  """Compiles a {% cachefragment name [var ...] %} tag."""
+  bits = token.split_contents()
+  if len(bits) < 2:
+    raise template.TemplateSyntaxError(
+        "'%s' tag requires a fragment name" % (bits[0],))
+  nodelist = parser.parse(('endcachefragment',))
+  parser.delete_first_token()
+  return CacheFragmentNode(nodelist, bits[1].strip('"\''), bits[2:])
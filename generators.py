@@ -1,20 +1,92 @@
 import datetime
-import itertools
+import hashlib
+import logging
 import os
 import urllib
 from google.appengine.api import urlfetch
 from google.appengine.ext import db
-from google.appengine.ext import deferred
 
 import config
+import jobs
 import markup
 import static
+import stats
+import tasks
 import utils
 
 
 generator_list = []
 
 
+def layout_name(template_name, generator_class, shell):
+  """Returns the name of the layout for pages with the provided shell.
+
+  Pages rendered from a template normally share a shell, and so a layout.
+  The name includes a digest of the shell, so that pages whose shells
+  differ, because of template vals used outside the assembled blocks, don't
+  share one.
+  """
+  digest = hashlib.sha1(''.join(x.encode('utf-8') for x in shell))
+  return '%s|%s|%s' % (template_name, generator_class or '',
+                       digest.hexdigest())
+
+
+def render_page(path, template_name, template_vals, **kwargs):
+  """Renders an HTML page and stores it as static content.
+
+  If config.assembled_pages is set, only the blocks named in
+  config.assembled_page_blocks are stored with the page; the rest is stored
+  once, as the layout shared by every page rendered from this template with
+  the same shell.
+
+  Args:
+    path: The path to store the page at.
+    template_name: The template to render.
+    template_vals: Template variables.
+    **kwargs: Additional arguments to be passed to static.set().
+  Returns:
+    A StaticContent object.
+  """
+  if config.assembled_pages:
+    # Rendering adds to the template vals; keep the ones passed in, to store
+    # with the layout.
+    layout_vals = dict(template_vals)
+    result = utils.render_template_slots(template_name, template_vals,
+                                         config.assembled_page_blocks)
+    if result:
+      shell, slots = result
+      name = layout_name(template_name, template_vals.get('generator_class'),
+                         shell)
+      static.set_layout(name, shell, layout_vals)
+      return static.set(path, '', config.html_mime_type, layout=name,
+                        fragments=slots, **kwargs)
+  rendered = utils.render_template(template_name, template_vals)
+  return static.set(path, rendered, config.html_mime_type, **kwargs)
+
+
+def regenerate_layout(name):
+  """Re-renders a shared layout, from the template vals it was stored with.
+
+  The layout keeps its name, so the pages using it pick up the new shell.
+  """
+  template_vals = static.get_layout_vals(name)
+  if template_vals is None:
+    logging.warn("Can't re-render layout %s without its template vals", name)
+    return
+  template_name = name.split('|', 1)[0]
+  result = utils.render_template_slots(template_name, dict(template_vals),
+                                       config.assembled_page_blocks)
+  if result:
+    static.set_layout(name, result[0], template_vals)
+
+
+def _generation_span(cls, post, resource, *args, **kwargs):
+  """Names the stats span for a call to generate_resource()."""
+  if resource is None and post is not None:
+    resource = post.path
+  return 'generate.%s' % cls.__name__, resource
+
+
 class ContentGenerator(object):
   """A class that generates content and dependency lists for blog posts."""
 
@@ -74,22 +146,29 @@ class PostContentGenerator(ContentGenerator):
 
   @classmethod
   def get_prev_next(cls, post):
-    """Retrieves the chronologically previous and next post for this post"""
+    """Retrieves the chronologically previous and next post for this post.
+
+    Returns:
+      A (prev, next) tuple of PostSummary entities, either of which may be
+      None.
+    """
     import models
 
-    q = models.BlogPost.all().order('-published')
-    q.filter('published !=', datetime.datetime.max)# Filter drafts out
+    q = models.PostSummary.all().order('-published')
+    q.filter('status =', models.PUBLISHED)
     q.filter('published <', post.published)
     prev = q.get()
 
-    q = models.BlogPost.all().order('published')
-    q.filter('published !=', datetime.datetime.max)# Filter drafts out
+    q = models.PostSummary.all().order('published')
+    q.filter('status =', models.PUBLISHED)
     q.filter('published >', post.published)
     next = q.get()
 
     return prev,next
 
   @classmethod
+  @jobs.counted
+  @stats.timed(_generation_span)
   def generate_resource(cls, post, resource, action='post'):
     import models
     if not post:
@@ -108,8 +187,7 @@ class PostContentGenerator(ContentGenerator):
       template_vals['prev']=prev
     if next is not None:
       template_vals['next']=next
-    rendered = utils.render_template("post.html", template_vals)
-    static.set(post.path, rendered, config.html_mime_type)
+    render_page(post.path, "post.html", template_vals)
 generator_list.append(PostContentGenerator)
 
 class PostPrevNextContentGenerator(PostContentGenerator):
@@ -122,6 +200,8 @@ class PostPrevNextContentGenerator(PostContentGenerator):
     return resource_list
 
   @classmethod
+  @jobs.counted
+  @stats.timed(_generation_span)
   def generate_resource(cls, post, resource):
     import models
     post = models.BlogPost.get_by_id(resource)
@@ -135,8 +215,7 @@ class PostPrevNextContentGenerator(PostContentGenerator):
      template_vals['prev']=prev
     if next is not None:
      template_vals['next']=next
-    rendered = utils.render_template("post.html", template_vals)
-    static.set(post.path, rendered, config.html_mime_type)
+    render_page(post.path, "post.html", template_vals)
 generator_list.append(PostPrevNextContentGenerator)
 
 class ListingContentGenerator(ContentGenerator):
@@ -152,7 +231,7 @@ class ListingContentGenerator(ContentGenerator):
 
   @classmethod
   def _filter_query(cls, resource, q):
-    """Applies filters to the BlogPost query.
+    """Applies filters to the PostSummary query.
 
     Args:
       resource: The resource being generated.
@@ -161,10 +240,14 @@ class ListingContentGenerator(ContentGenerator):
     pass
 
   @classmethod
+  @jobs.counted
+  @stats.timed(_generation_span)
   def generate_resource(cls, post, resource, pagenum=1, start_ts=None):
     import models
-    q = models.BlogPost.all().order('-published')
-    q.filter('published <', start_ts or datetime.datetime.max)
+    q = models.PostSummary.all().order('-published')
+    q.filter('status =', models.PUBLISHED)
+    if start_ts:
+      q.filter('published <', start_ts)
     cls._filter_query(resource, q)
 
     posts = q.fetch(config.posts_per_page + 1)
@@ -185,13 +268,12 @@ class ListingContentGenerator(ContentGenerator):
         'prev_page': prev_page if pagenum > 1 else None,
         'next_page': next_page if more_posts else None,
     }
-    rendered = utils.render_template("listing.html", template_vals)
-
     path_args['pagenum'] = pagenum
-    static.set(_get_path() % path_args, rendered, config.html_mime_type)
+    render_page(_get_path() % path_args, "listing.html", template_vals)
     if more_posts:
-        deferred.defer(cls.generate_resource, None, resource, pagenum + 1,
-                       posts[-2].published)
+        jobs.count('planned')
+        tasks.defer(cls.generate_resource, None, resource, pagenum + 1,
+                    posts[-2].published)
 
 
 class IndexContentGenerator(ListingContentGenerator):
@@ -239,19 +321,7 @@ class ArchivePageContentGenerator(ListingContentGenerator):
   @classmethod
   def _filter_query(cls, resource, q):
     from models import BlogDate
-    ts = BlogDate.datetime_from_key_name(resource)
-
-    # We don't have to bother clearing hour, min, etc., as
-    # datetime_from_key_name() only sets the year and month.
-    min_ts = ts.replace(day=1)
-
-    # Make the next month the upperbound.
-    # Python doesn't wrap the month for us, so handle it manually.
-    if min_ts.month >= 12:
-      max_ts = min_ts.replace(year=min_ts.year+1, month=1)
-    else:
-      max_ts = min_ts.replace(month=min_ts.month+1)
-
+    min_ts, max_ts = BlogDate.get_month_range(resource)
     q.filter('published >=', min_ts)
     q.filter('published <', max_ts)
 generator_list.append(ArchivePageContentGenerator)
@@ -271,6 +341,8 @@ class ArchiveIndexContentGenerator(ContentGenerator):
     return post.hash
 
   @classmethod
+  @jobs.counted
+  @stats.timed(_generation_span)
   def generate_resource(cls, post, resource):
     from models import BlogDate
 
@@ -280,12 +352,11 @@ class ArchiveIndexContentGenerator(ContentGenerator):
     for date in dates:
       date_struct.setdefault(date.year, []).append(date)
 
-    str = utils.render_template("archive.html", {
+    render_page('/archive/', "archive.html", {
       'generator_class': cls.__name__,
       'dates': dates,
       'date_struct': date_struct.values(),
     })
-    static.set('/archive/', str, config.html_mime_type)
 generator_list.append(ArchiveIndexContentGenerator)
 
 
@@ -301,11 +372,16 @@ class AtomContentGenerator(ContentGenerator):
     return post.hash
 
   @classmethod
+  @jobs.counted
+  @stats.timed(_generation_span)
   def generate_resource(cls, post, resource):
     import models
-    q = models.BlogPost.all().order('-updated')
-    # Fetch the 10 most recently updated non-draft posts
-    posts = list(itertools.islice((x for x in q if x.path), 10))
+    q = models.PostSummary.all().order('-updated')
+    q.filter('status =', models.PUBLISHED)
+    # Find the 10 most recently updated posts, then fetch just those in full,
+    # for their bodies.
+    posts = db.get([x.post_key for x in q.fetch(10)])
+    posts = [x for x in posts if x is not None]
     now = datetime.datetime.now().replace(second=0, microsecond=0)
     template_vals = {
         'posts': posts,
@@ -331,6 +407,8 @@ generator_list.append(AtomContentGenerator)
 
 class PageContentGenerator(ContentGenerator):
   @classmethod
+  @jobs.counted
+  @stats.timed(_generation_span)
   def generate_resource(cls, page, resource, action='post'):
     # Handle deletion
     if action == 'delete':
@@ -339,6 +417,4 @@ class PageContentGenerator(ContentGenerator):
       template_vals = {
           'page': page,
       }
-      rendered = utils.render_template('pages/%s' % (page.template,),
-                                       template_vals)
-      static.set(page.path, rendered, config.html_mime_type)
+      render_page(page.path, 'pages/%s' % (page.template,), template_vals)
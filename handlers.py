@@ -1,14 +1,18 @@
 import datetime
 import logging
 import os
+import urllib
 
-from google.appengine.ext import deferred
+from google.appengine.ext import db
 from google.appengine.ext import webapp
 
 import config
+import jobs
 import markup
 import models
 import post_deploy
+import profiler
+import stats
 import utils
 import xsrfutil
 
@@ -56,20 +60,75 @@ class BaseHandler(webapp.RequestHandler):
     self.response.out.write(utils.render_template(template_name, template_vals,
                                                   theme))
 
-
-class AdminHandler(BaseHandler):
-  def get(self):
-    offset = int(self.request.get('start', 0))
+  def fetch_page(self, q, filters=None):
+    """Fetches a page of a list, starting at the cursor in the request.
+
+    Pages are fetched by cursor rather than offset, so later pages cost no
+    more than the first.
+
+    Args:
+      q: The query to fetch from.
+      filters: A dict of request arguments that q was filtered by, to be
+        carried on to the next page.
+    Returns:
+      A dict of template values: the 'results', 'count', the query string
+      for the 'next_page' if the list may have one, and 'filter_args', the
+      query string for the first page.
+    """
     count = int(self.request.get('count', 20))
-    posts = models.BlogPost.all().order('-published').fetch(count, offset)
+    cursor = self.request.get('cursor')
+    try:
+      if cursor:
+        q.with_cursor(cursor)
+      results = q.fetch(count)
+    except (db.BadRequestError, db.BadValueError), e:
+      logging.warn("Ignoring invalid cursor %r: %s", cursor, e)
+      q.with_cursor(None)
+      cursor = None
+      results = q.fetch(count)
+    args = dict((k, v) for k, v in (filters or {}).iteritems() if v)
+    args['count'] = count
     template_vals = {
-        'offset': offset,
+        'results': results,
         'count': count,
-        'last_post': offset + len(posts) - 1,
-        'prev_offset': max(0, offset - count),
-        'next_offset': offset + count,
-        'posts': posts,
+        'first_page': bool(not cursor),
+        'filter_args': urllib.urlencode(sorted(args.items())),
+        'next_page': None,
     }
+    if len(results) == count:
+      args['cursor'] = q.cursor()
+      template_vals['next_page'] = urllib.urlencode(sorted(args.items()))
+    return template_vals
+
+
+class AdminHandler(BaseHandler):
+  def get(self):
+    status = self.request.get('status')
+    tag = self.request.get('tag')
+    month = self.request.get('month')
+    q = models.PostSummary.all().order('-published')
+    if status in (models.DRAFT, models.PUBLISHED):
+      q.filter('status =', status)
+    if tag:
+      q.filter('normalized_tags =', utils.slugify(tag.lower()))
+    if month:
+      try:
+        start, end = models.BlogDate.get_month_range(month)
+      except ValueError:
+        self.error(400)
+        return
+      q.filter('published >=', start)
+      q.filter('published <', end)
+    template_vals = self.fetch_page(q, {'status': status, 'tag': tag,
+                                        'month': month})
+    template_vals.update({
+        'posts': template_vals['results'],
+        'status': status,
+        'tag': tag,
+        'month': month,
+        'months': [x.name() for x in
+                   models.BlogDate.all(keys_only=True).order('-__key__')],
+    })
     self.render_to_response("index.html", template_vals)
 
 
@@ -94,7 +153,7 @@ class PostHandler(BaseHandler):
     if form.is_valid():
       post = form.save(commit=False)
       if form.cleaned_data['draft']:# Draft post
-        post.published = datetime.datetime.max
+        post.published = None
         post.put()
       else:
         if not post.path: # Publish post
@@ -122,10 +181,9 @@ class DeleteHandler(BaseHandler):
 class PreviewHandler(BaseHandler):
   @with_post
   def get(self, post):
-    # Temporary set a published date iff it's still
-    # datetime.max. Django's date filter has a problem with
-    # datetime.max and a "real" date looks better.
-    if post.published == datetime.datetime.max:
+    # Temporarily set a published date iff there isn't one yet, so the
+    # preview shows a date.
+    if post.published is None:
       post.published = datetime.datetime.now()
     self.response.out.write(utils.render_template('post.html', {
         'post': post,
@@ -135,10 +193,57 @@ class PreviewHandler(BaseHandler):
 class RegenerateHandler(BaseHandler):
   @xsrfutil.xsrf_protect
   def post(self):
-    deferred.defer(post_deploy.PostRegenerator().regenerate)
-    deferred.defer(post_deploy.PageRegenerator().regenerate)
-    deferred.defer(post_deploy.try_post_deploy, force=True)
-    self.render_to_response("regenerating.html")
+    job_id = post_deploy.rebuild(profile=bool(self.request.get('profile')))
+    self.render_to_response("regenerating.html", {'job_id': job_id})
+
+
+class JobsHandler(BaseHandler):
+  def get(self):
+    q = jobs.Job.all().order('-started')
+    progress = [jobs.get_progress(x) for x in q.fetch(10)]
+    self.render_to_response("jobs.html", {
+        'jobs': progress,
+        'running': [x for x in progress if not x['job'].finished],
+    })
+
+
+class StatsHandler(BaseHandler):
+  def get(self):
+    spans, hits, since = stats.load()
+    template_vals = stats.summarize(spans, hits)
+    template_vals['since'] = since
+    self.render_to_response("stats.html", template_vals)
+
+  @xsrfutil.xsrf_protect
+  def post(self):
+    stats.reset()
+    self.redirect(config.url_prefix + '/admin/stats')
+
+
+class ProfilesHandler(BaseHandler):
+  def get(self):
+    until = profiler.profiling_everything_until()
+    profiles = profiler.get_recent()
+    for profile in profiles:
+      profile['started_at'] = datetime.datetime.fromtimestamp(
+          profile['started'])
+    self.render_to_response("profiles.html", {
+        'profiles': profiles,
+        'threshold': profiler.N_PLUS_ONE_THRESHOLD,
+        'header': profiler.PROFILE_HEADER,
+        'until': until and datetime.datetime.fromtimestamp(until),
+    })
+
+  @xsrfutil.xsrf_protect
+  def post(self):
+    action = self.request.get('action')
+    if action == 'start':
+      profiler.profile_everything(int(self.request.get('minutes', 5)) * 60)
+    elif action == 'stop':
+      profiler.profile_everything(0)
+    elif action == 'clear':
+      profiler.clear()
+    self.redirect(config.url_prefix + '/admin/profiles')
 
 
 class PageForm(djangoforms.ModelForm):
@@ -165,17 +270,9 @@ class PageForm(djangoforms.ModelForm):
 
 class PageAdminHandler(BaseHandler):
   def get(self):
-    offset = int(self.request.get('start', 0))
-    count = int(self.request.get('count', 20))
-    pages = models.Page.all().order('-updated').fetch(count, offset)
-    template_vals = {
-        'offset': offset,
-        'count': count,
-        'prev_offset': max(0, offset - count),
-        'next_offset': offset + count,
-        'last_page': offset + len(pages) - 1,
-        'pages': pages,
-    }
+    template_vals = self.fetch_page(
+        models.PageSummary.all().order('-updated'))
+    template_vals['pages'] = template_vals['results']
     self.render_to_response("indexpage.html", template_vals)
 
 
@@ -0,0 +1,122 @@
+"""
+Syntax highlighting shared by all of the markup renderers.
+
+Highlighting with Pygments is the most expensive part of rendering posts with
+a lot of code in them, and code blocks rarely change when a post is edited,
+so highlighted HTML is cached by lexer, formatter options and a digest of the
+code, both in-process and in memcache.
+
+Lexer lookups go through an alias index built once from Pygments' lexer
+mapping instead of pygments.lexers.get_lexer_by_name, which scans every lexer
+(and then every setuptools plugin) on each call. Configured lexer and
+formatter instances are reused, and aliases that turn out to be unknown are
+remembered so typos don't repeat the slow search.
+"""
+
+import hashlib
+
+import pygments
+from pygments.formatters import HtmlFormatter
+from pygments.lexers._mapping import LEXERS
+from pygments.plugin import find_plugin_lexers
+from pygments.util import ClassNotFound
+
+import caching
+
+
+_cache = caching.TieredCache('highlight', size=500)
+
+# Maps alias -> (module name, class name) for every builtin lexer.
+_aliases = None
+# Maps alias -> lexer instance, for aliases that have been used.
+_lexers = {}
+# Aliases that no builtin or plugin lexer answers to.
+_unknown = set()
+# Maps sorted formatter options -> HtmlFormatter instance.
+_formatters = {}
+
+
+def _alias_index():
+  global _aliases
+  if _aliases is None:
+    aliases = {}
+    for class_name, (module_name, _, names, _, _) in LEXERS.iteritems():
+      for alias in names:
+        aliases.setdefault(alias, (module_name, class_name))
+    _aliases = aliases
+  return _aliases
+
+
+def _find_lexer_class(alias):
+  entry = _alias_index().get(alias)
+  if entry:
+    module_name, class_name = entry
+    module = __import__(module_name, None, None, [class_name])
+    return getattr(module, class_name)
+  for cls in find_plugin_lexers():
+    if alias in cls.aliases:
+      return cls
+  return None
+
+
+def get_lexer(alias):
+  """Returns a shared lexer instance for a Pygments alias.
+
+  Raises:
+    pygments.util.ClassNotFound: No lexer is known by that alias.
+  """
+  lexer = _lexers.get(alias)
+  if lexer is None:
+    if alias in _unknown:
+      raise ClassNotFound('no lexer for alias %r found' % alias)
+    cls = _find_lexer_class(alias)
+    if cls is None:
+      _unknown.add(alias)
+      raise ClassNotFound('no lexer for alias %r found' % alias)
+    lexer = _lexers[alias] = cls()
+  return lexer
+
+
+def get_formatter(formatter_options=None):
+  """Returns a shared HtmlFormatter configured with the provided options."""
+  key = tuple(sorted((formatter_options or {}).items()))
+  formatter = _formatters.get(key)
+  if formatter is None:
+    formatter = _formatters[key] = HtmlFormatter(**dict(key))
+  return formatter
+
+
+def cache_key(code, alias, formatter_options=None, fallback=None):
+  """Returns the cache key for a call to highlight()."""
+  if isinstance(code, unicode):
+    code = code.encode('utf-8')
+  options = sorted((formatter_options or {}).items())
+  val = (alias, fallback, options, hashlib.sha1(code).hexdigest())
+  return hashlib.sha1(repr(val)).hexdigest()
+
+
+def highlight(code, alias, formatter_options=None, fallback=None):
+  """Returns code highlighted as HTML.
+
+  Args:
+    code: The source code to highlight.
+    alias: The Pygments alias for the language the code is in.
+    formatter_options: A dict of keyword arguments for Pygments' HtmlFormatter.
+    fallback: An alias to use instead if alias isn't recognised.
+  Returns:
+    The highlighted HTML.
+  Raises:
+    pygments.util.ClassNotFound: Neither alias nor fallback was recognised.
+  """
+  key = cache_key(code, alias, formatter_options, fallback)
+  html = _cache.get(key)
+  if html is None:
+    try:
+      lexer = get_lexer(alias)
+    except ClassNotFound:
+      if fallback is None:
+        raise
+      lexer = get_lexer(fallback)
+    html = pygments.highlight(code, lexer, get_formatter(formatter_options))
+    _cache.set(key, html)
+  return html
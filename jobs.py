@@ -0,0 +1,231 @@
+"""
+Progress tracking for jobs that run as many deferred tasks.
+
+A job (a rebuild of the site, or a migration) is a Job entity with sharded
+counters. Tasks deferred with tasks.defer() from within a job carry its id in
+their context (as 'job'), and count towards it:
+
+  planned: Resources the job has found it needs to process.
+  done: Resources processed.
+  skipped: Resources processed whose content was the same as in the
+      generation being served, so it was copied rather than rewritten. These
+      are included in done.
+  failed: Attempts at processing a resource that raised an exception.
+  tasks_enqueued, tasks_done, task_errors: Tasks deferred as part of the
+      job, tasks that completed, and task attempts that raised.
+
+Counts are buffered per thread, and written to one of NUM_SHARDS counter
+entities when the task (or request) doing the counting finishes; see
+flush().
+"""
+
+import datetime
+import logging
+import random
+import threading
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+import tasks
+
+
+NUM_SHARDS = 20
+
+# A running job whose counters haven't changed for this long is reported as
+# stalled.
+STALL_SECONDS = 300
+
+# How often finish_when_idle() checks for tasks in flight.
+POLL_SECONDS = 30
+
+COUNTERS = ('planned', 'done', 'skipped', 'failed', 'tasks_enqueued',
+            'tasks_done', 'task_errors')
+
+
+class Job(db.Model):
+  job_type = db.StringProperty(required=True, name='kind')
+  description = db.StringProperty(indexed=False)
+  started = db.DateTimeProperty(required=True, auto_now_add=True)
+  finished = db.DateTimeProperty()
+
+
+class JobCounterShard(db.Model):
+  """One shard of a job's counters. The parent is the Job."""
+  planned = db.IntegerProperty(default=0, indexed=False)
+  done = db.IntegerProperty(default=0, indexed=False)
+  skipped = db.IntegerProperty(default=0, indexed=False)
+  failed = db.IntegerProperty(default=0, indexed=False)
+  tasks_enqueued = db.IntegerProperty(default=0, indexed=False)
+  tasks_done = db.IntegerProperty(default=0, indexed=False)
+  task_errors = db.IntegerProperty(default=0, indexed=False)
+  updated = db.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class _Local(threading.local):
+  def __init__(self):
+    # Maps job id -> {counter name: delta}
+    self.pending = {}
+
+_local = _Local()
+
+
+def start(job_type, description=None):
+  """Creates a job, and returns its id."""
+  job = Job(job_type=job_type, description=description)
+  job.put()
+  return job.key().id()
+
+
+def finish(job_id):
+  """Marks a job as finished."""
+  job = Job.get_by_id(job_id)
+  if job and not job.finished:
+    job.finished = datetime.datetime.now()
+    job.put()
+
+
+def finish_when_idle(job_id, idle_checks=0):
+  """Marks a job finished once it has no tasks in flight.
+
+  Counts are written when each task finishes, so a task's children can be
+  counted done before it's counted done itself. The job has to be seen idle
+  twice in a row, POLL_SECONDS apart; until then this re-defers itself.
+
+  Args:
+    job_id: The job.
+    idle_checks: The number of consecutive times the job was found idle.
+  """
+  job = Job.get_by_id(job_id)
+  if not job or job.finished:
+    return
+  if get_progress(job)['in_flight']:
+    idle_checks = 0
+  else:
+    idle_checks += 1
+  if idle_checks < 2:
+    deferred.defer(finish_when_idle, job_id, idle_checks,
+                   _countdown=POLL_SECONDS)
+    return
+  finish(job_id)
+
+
+def current():
+  """Returns the id of the job the current task is part of, or None."""
+  return tasks.get('job')
+
+
+def count(name, delta=1, job_id=None):
+  """Adds to one of a job's counters.
+
+  Args:
+    name: The counter name; one of COUNTERS.
+    delta: The amount to add.
+    job_id: The job. Defaults to the current job; if there isn't one,
+      nothing is counted.
+  """
+  if job_id is None:
+    job_id = current()
+    if job_id is None:
+      return
+  counters = _local.pending.setdefault(job_id, {})
+  counters[name] = counters.get(name, 0) + delta
+
+
+def counted(func):
+  """Decorates a function that processes one resource.
+
+  Calls made as part of a job count towards it as done, or as failed if
+  they raise an exception.
+  """
+  def wrapper(*args, **kwargs):
+    if current() is None:
+      return func(*args, **kwargs)
+    try:
+      result = func(*args, **kwargs)
+    except:
+      count('failed')
+      raise
+    count('done')
+    return result
+  # Deferred tasks find methods by name, so keep it.
+  wrapper.__name__ = func.__name__
+  wrapper.__doc__ = func.__doc__
+  wrapper.__module__ = func.__module__
+  return wrapper
+
+
+def _add_to_shard(job_id, counters):
+  parent = db.Key.from_path('Job', job_id)
+  key_name = 'shard-%d' % random.randrange(NUM_SHARDS)
+  shard = (JobCounterShard.get_by_key_name(key_name, parent=parent)
+           or JobCounterShard(key_name=key_name, parent=parent))
+  for name, delta in counters.iteritems():
+    setattr(shard, name, getattr(shard, name) + delta)
+  shard.put()
+
+
+def flush():
+  """Writes the counts buffered by this thread.
+
+  Counts that can't be written are logged and dropped, rather than failing
+  the task that made them.
+  """
+  pending, _local.pending = _local.pending, {}
+  for job_id, counters in pending.iteritems():
+    counters = dict((k, v) for k, v in counters.iteritems() if v)
+    if not counters:
+      continue
+    try:
+      db.run_in_transaction(_add_to_shard, job_id, counters)
+    except db.Error, e:
+      logging.warn('Dropping counts %r for job %d: %s', counters, job_id, e)
+
+
+def get_progress(job):
+  """Returns a dict describing a job's progress.
+
+  Args:
+    job: A Job entity.
+  Returns:
+    A dict with the job, its counters, 'in_flight' (tasks enqueued but not
+    yet done), 'elapsed' (a timedelta), 'rate' (resources done per second),
+    'eta' (a datetime, or None if it can't be estimated), 'last_activity'
+    (when a counter was last written) and 'stalled'.
+  """
+  keys = [db.Key.from_path('JobCounterShard', 'shard-%d' % i,
+                           parent=job.key())
+          for i in range(NUM_SHARDS)]
+  totals = dict((name, 0) for name in COUNTERS)
+  last_activity = None
+  for shard in db.get(keys):
+    if shard is None:
+      continue
+    for name in COUNTERS:
+      totals[name] += getattr(shard, name)
+    if last_activity is None or shard.updated > last_activity:
+      last_activity = shard.updated
+  now = datetime.datetime.now()
+  elapsed = (job.finished or now) - job.started
+  seconds = elapsed.days * 86400 + elapsed.seconds
+  rate = seconds and float(totals['done']) / seconds
+  remaining = max(totals['planned'] - totals['done'], 0)
+  eta = None
+  if not job.finished and rate and remaining:
+    eta = now + datetime.timedelta(seconds=remaining / rate)
+  progress = dict(totals)
+  progress.update({
+      'job': job,
+      'in_flight': max(totals['tasks_enqueued'] - totals['tasks_done'], 0),
+      'elapsed': elapsed,
+      'rate': rate,
+      'remaining': remaining,
+      'percent': totals['planned'] and
+                 min(100.0, totals['done'] * 100.0 / totals['planned']),
+      'eta': eta,
+      'last_activity': last_activity,
+      'stalled': (not job.finished and
+                  now - (last_activity or job.started) >
+                  datetime.timedelta(seconds=STALL_SECONDS)),
+  })
+  return progress
@@ -43,9 +43,7 @@ import re
 
 from markdown import TextPreprocessor
 
-from pygments import highlight
-from pygments.formatters import HtmlFormatter
-from pygments.lexers import get_lexer_by_name, TextLexer
+import highlighting
 
 
 class CodeBlockPreprocessor(TextPreprocessor):
@@ -53,15 +51,14 @@ class CodeBlockPreprocessor(TextPreprocessor):
     pattern = re.compile(
         r'\s*\[sourcecode:(.+?)\](.+?)\[/sourcecode\]\s*', re.S)
 
-    formatter = HtmlFormatter(noclasses=INLINESTYLES, lineseparator=LINEENDING, linenos='inline')
+    formatter_options = dict(noclasses=INLINESTYLES, lineseparator=LINEENDING,
+                             linenos='inline')
 
     def run(self, lines):
         def repl(m):
-            try:
-                lexer = get_lexer_by_name(m.group(1))
-            except ValueError:
-                lexer = TextLexer()
-            code = highlight(m.group(2), lexer, self.formatter)
+            code = highlighting.highlight(m.group(2), m.group(1),
+                                          self.formatter_options,
+                                          fallback='text')
             i = code.rfind("%s</pre></div>" % LINEENDING)
             code = code[:i] + code[i+len(LINEENDING):]
             return "\n\n%s\n\n" % code.strip()
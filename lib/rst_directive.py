@@ -41,22 +41,19 @@
 # Set to True if you want inline CSS styles instead of classes
 INLINESTYLES = False
 
-from pygments.formatters import HtmlFormatter
+# The default formatter options
+DEFAULT = dict(noclasses=INLINESTYLES)
 
-# The default formatter
-DEFAULT = HtmlFormatter(noclasses=INLINESTYLES)
-
-# Add name -> formatter pairs for every variant you want to use
+# Add name -> formatter options pairs for every variant you want to use
 VARIANTS = {
-    # 'linenos': HtmlFormatter(noclasses=INLINESTYLES, linenos=True),
+    # 'linenos': dict(noclasses=INLINESTYLES, linenos=True),
 }
 
 
 from docutils import nodes
 from docutils.parsers.rst import directives, Directive
 
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name, TextLexer
+import highlighting
 
 class Pygments(Directive):
     """ Source code syntax hightlighting.
@@ -69,14 +66,13 @@ class Pygments(Directive):
 
     def run(self):
         self.assert_has_content()
-        try:
-            lexer = get_lexer_by_name(self.arguments[0])
-        except ValueError:
-            # no lexer found - use the text one instead of an exception
-            lexer = TextLexer()
         # take an arbitrary option if more than one is given
-        formatter = self.options and VARIANTS[self.options.keys()[0]] or DEFAULT
-        parsed = highlight(u'\n'.join(self.content), lexer, formatter)
+        formatter_options = (self.options and VARIANTS[self.options.keys()[0]]
+                             or DEFAULT)
+        # no lexer found - use the text one instead of an exception
+        parsed = highlighting.highlight(u'\n'.join(self.content),
+                                        self.arguments[0], formatter_options,
+                                        fallback='text')
         return [nodes.raw('', parsed, format='html')]
 
 directives.register_directive('sourcecode', Pygments)
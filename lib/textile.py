@@ -57,16 +57,22 @@ POSSIBILITY OF SUCH DAMAGE.
 """
 
 import re
+import threading
 import uuid
 from urlparse import urlparse
 import sgmllib
 
+_newline_patterns = (
+    (re.compile(r'\r\n'), '\n'),
+    (re.compile(r'\n{3,}'), '\n\n'),
+    (re.compile(r'\n\s*\n'), '\n\n'),
+    (re.compile(r'"$'), '" '),
+)
+
 def _normalize_newlines(string):
-    import re
-    out = re.sub(r'\r\n', '\n', string)
-    out = re.sub(r'\n{3,}', '\n\n', out)
-    out = re.sub(r'\n\s*\n', '\n\n', out)
-    out = re.sub(r'"$', '" ', out)
+    out = string
+    for pattern, replacement in _newline_patterns:
+        out = pattern.sub(replacement, out)
     return out
 
 # PyTextile can optionally sanitize the generated XHTML,
@@ -238,6 +244,140 @@ except ImportError:
     except ImportError:
         _tidy = None
 
+# Compiled patterns, per Textile class. None of them depend on the restricted
+# or lite settings, so all configurations of a class share one table.
+_pattern_tables = {}
+
+# Matches the ids that text is shelved under.
+_shelf_id = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+def _compile_patterns(cls):
+    """Compiles the regular expressions used by instances of a Textile class"""
+    p = {}
+    p['pba_colspan'] = re.compile(r'\\(\d+)')
+    p['pba_rowspan'] = re.compile(r'/(\d+)')
+    p['pba_valign'] = re.compile(r'(%s)' % cls.vlgn)
+    p['pba_style'] = re.compile(r'\{([^}]*)\}')
+    p['pba_lang'] = re.compile(r'\[([^\]]+)\]', re.U)
+    p['pba_class'] = re.compile(r'\(([^()]+)\)', re.U)
+    p['pba_padding_left'] = re.compile(r'([(]+)')
+    p['pba_padding_right'] = re.compile(r'([)]+)')
+    p['pba_halign'] = re.compile(r'(%s)' % cls.hlgn)
+    p['pba_id'] = re.compile(r'^(.*)#(.*)$')
+
+    p['raw_blocks'] = re.compile(r'<(p|blockquote|div|form|table|ul|ol|pre|h\d)[^>]*?>.*</\1>', re.S)
+    p['raw_empty_tags'] = re.compile(r'<(hr|br)[^>]*?/>')
+
+    p['table'] = re.compile(r'^(?:table(_?%(s)s%(a)s%(c)s)\. ?\n)?^(%(a)s%(c)s\.? ?\|.*\|)\n\n' % {'s':cls.s, 'a':cls.a, 'c':cls.c}, re.S|re.M|re.U)
+    p['table_row'] = re.compile(r'^(%s%s\. )(.*)' % (cls.a, cls.c))
+    p['table_cell'] = re.compile(r'^(_?%s%s%s\. )(.*)' % (cls.s, cls.a, cls.c))
+
+    p['lists'] = re.compile(r'^([#*]+%s .*)$(?![^#*])' % cls.c, re.U|re.M|re.S)
+    p['list_item'] = re.compile(r"^([#*]+)(%s%s) (.*)$" % (cls.a, cls.c), re.S)
+    p['list_next'] = re.compile(r'^([#*]+)\s.*')
+
+    p['paragraph'] = re.compile(r'<(p)([^>]*?)>(.*)(</\1>)', re.S)
+    p['line_break'] = re.compile(r'(.+)(?:(?<!<br>)|(?<!<br />))\n(?![#*\s|])')
+
+    p['block'] = re.compile(r'^(%s)(%s%s)\.(\.?)(?::(\S+))? (.*)$' % ('|'.join(cls.btag), cls.a, cls.c), re.S)
+    p['block_indented'] = re.compile(r'^\s')
+    p['footnote_tag'] = re.compile(r'fn(\d+)')
+    p['footnote_ref'] = re.compile(r'\b\[([0-9]+)\](\s)?')
+
+    p['glyph_end_quote'] = re.compile(r'"\z')
+    p['glyph_search'] = (
+        re.compile(r"(\w)\'(\w)"),                                      # apostrophe's
+        re.compile(r'(\s)\'(\d+\w?)\b(?!\')'),                          # back in '88
+        re.compile(r'(\S)\'(?=\s|'+cls.pnct+'|<|$)'),                        #  single closing
+        re.compile(r'\'/'),                                             #  single opening
+        re.compile(r'(\S)\"(?=\s|'+cls.pnct+'|<|$)'),                        #  double closing
+        re.compile(r'"'),                                               #  double opening
+        re.compile(r'\b([A-Z][A-Z0-9]{2,})\b(?:[(]([^)]*)[)])'),        #  3+ uppercase acronym
+        re.compile(r'\b([A-Z][A-Z\'\-]+[A-Z])(?=[\s.,\)>])'),           #  3+ uppercase
+        re.compile(r'\b(\s{0,1})?\.{3}'),                                     #  ellipsis
+        re.compile(r'(\s?)--(\s?)'),                                    #  em dash
+        re.compile(r'\s-(?:\s|$)'),                                     #  en dash
+        re.compile(r'(\d+)( ?)x( ?)(?=\d+)'),                           #  dimension sign
+        re.compile(r'\b ?[([]TM[])]', re.I),                            #  trademark
+        re.compile(r'\b ?[([]R[])]', re.I),                             #  registered
+        re.compile(r'\b ?[([]C[])]', re.I),                             #  copyright
+     )
+    p['glyph_replace'] = [x % dict(cls.glyph_defaults) for x in (
+        r'\1%(txt_apostrophe)s\2',           # apostrophe's
+        r'\1%(txt_apostrophe)s\2',           # back in '88
+        r'\1%(txt_quote_single_close)s',     #  single closing
+        r'%(txt_quote_single_open)s',         #  single opening
+        r'\1%(txt_quote_double_close)s',        #  double closing
+        r'%(txt_quote_double_open)s',             #  double opening
+        r'<acronym title="\2">\1</acronym>', #  3+ uppercase acronym
+        r'<span class="caps">\1</span>',     #  3+ uppercase
+        r'\1%(txt_ellipsis)s',                  #  ellipsis
+        r'\1%(txt_emdash)s\2',               #  em dash
+        r' %(txt_endash)s ',                 #  en dash
+        r'\1\2%(txt_dimension)s\3',          #  dimension sign
+        r'%(txt_trademark)s',                #  trademark
+        r'%(txt_registered)s',                #  registered
+        r'%(txt_copyright)s',                #  copyright
+    )]
+    p['glyph_tags'] = re.compile(r'(<.*?>)', re.U)
+    p['glyph_tag'] = re.compile(r'<.*>')
+
+    p['refs'] = re.compile(r'(?:(?<=^)|(?<=\s))\[(.+)\]((?:http:\/\/|\/)\S+)(?=\s|$)', re.U)
+    p['rel_url'] = re.compile(r'^\w')
+
+    punct = '!"#$%&\'*+,-./:;=?@\\^_`|~'
+    p['links'] = re.compile(r'''
+            ([\s\[{(]|[%s])?     # $pre
+            "                          # start
+            (%s)                     # $atts
+            ([^"]+?)                   # $text
+            \s?
+            (?:\(([^)]+?)\)(?="))?     # $title
+            ":
+            (\S+?)                     # $url
+            (\/)?                      # $slash
+            ([^\w\/;]*?)               # $post
+            (?=<|\s|$)
+        ''' % (re.escape(punct), cls.c), re.X)
+
+    qtags = (r'\*\*', r'\*', r'\?\?', r'\-', r'__', r'_', r'%', r'\+', r'~', r'\^')
+    pnct = ".,\"'?!;:"
+    p['spans'] = []
+    for qtag in qtags:
+        p['spans'].append(re.compile(r"""
+            (?:^|(?<=[\s>%(pnct)s])|([\]}]))
+            (%(qtag)s)(?!%(qtag)s)
+            (%(c)s)
+            (?::(\S+))?
+            ([^\s%(qtag)s]+|\S[^%(qtag)s\n]*[^\s%(qtag)s\n])
+            ([%(pnct)s]*)
+            %(qtag)s
+            (?:$|([\]}])|(?=%(selfpnct)s{1,2}|\s))
+        """ % {'qtag':qtag,'c':cls.c,'pnct':pnct,'selfpnct':cls.pnct}, re.X))
+
+    p['image'] = re.compile(r"""
+            (?:[\[{])?          # pre
+            \!                 # opening !
+            (\<|\=|\>)??       # optional alignment atts
+            (%s)               # optional style,class atts
+            (?:\. )?           # optional dot-space
+            ([^\s(!]+)         # presume this is the src
+            \s?                # optional space
+            (?:\(([^\)]+)\))?  # optional title
+            \!                 # closing
+            (?::(\S+))?        # optional href
+            (?:[\]}]|(?=\s|$)) # lookahead: space or end of string
+        """ % cls.c, re.U|re.X)
+
+    p['special'] = {}
+    for start, end in (('<code>', '</code>'), ('@', '@'), ('<pre>', '</pre>'),
+                       ('<notextile>', '</notextile>'), ('==', '==')):
+        p['special'][start, end] = _special_pattern(start, end)
+    return p
+
+def _special_pattern(start, end):
+    return re.compile(r'(^|\s|[\[({>])%s(.*?)%s(\s|$|[\])}])?' % (re.escape(start), re.escape(end)), re.M|re.S)
+
 class Textile(object):
     hlgn = r'(?:\<(?!>)|(?<!<)\>|\<\>|\=|[()]+(?! ))'
     vlgn = r'[\-^~]'
@@ -281,6 +421,19 @@ class Textile(object):
         """docstring for __init__"""
         self.restricted = restricted
         self.lite = lite
+        self.patterns = self.get_patterns()
+        self.reset()
+
+    @classmethod
+    def get_patterns(cls):
+        """Returns the compiled patterns for this class, compiling them once"""
+        patterns = _pattern_tables.get(cls)
+        if patterns is None:
+            patterns = _pattern_tables[cls] = _compile_patterns(cls)
+        return patterns
+
+    def reset(self):
+        """Clears the state kept from one document, so another can be rendered"""
         self.fn = {}
         self.urlrefs = {}
         self.shelf = {}
@@ -372,50 +525,51 @@ class Textile(object):
 
         if not input: return ''
 
+        p = self.patterns
         matched = input
         if element == 'td':
-            m = re.search(r'\\(\d+)', matched)
+            m = p['pba_colspan'].search(matched)
             if m:
                 colspan = m.group(1)
 
-            m = re.search(r'/(\d+)', matched)
+            m = p['pba_rowspan'].search(matched)
             if m:
                 rowspan = m.group(1)
 
         if element == 'td' or element == 'tr':
-            m = re.search(r'(%s)' % self.vlgn, matched)
+            m = p['pba_valign'].search(matched)
             if m: style.append("vertical-align:%s;" % self.vAlign(m.group(1)))
 
-        m = re.search(r'\{([^}]*)\}', matched)
+        m = p['pba_style'].search(matched)
         if m:
             style.append(m.group(1).rstrip(';') + ';')
             matched = matched.replace(m.group(0), '')
 
-        m = re.search(r'\[([^\]]+)\]', matched, re.U)
+        m = p['pba_lang'].search(matched)
         if m:
             lang = m.group(1)
             matched = matched.replace(m.group(0), '')
 
-        m = re.search(r'\(([^()]+)\)', matched, re.U)
+        m = p['pba_class'].search(matched)
         if m:
             aclass = m.group(1)
             matched = matched.replace(m.group(0), '')
 
-        m = re.search(r'([(]+)', matched)
+        m = p['pba_padding_left'].search(matched)
         if m:
             style.append("padding-left:%sem;" % len(m.group(1)))
             matched = matched.replace(m.group(0), '')
 
-        m = re.search(r'([)]+)', matched)
+        m = p['pba_padding_right'].search(matched)
         if m:
             style.append("padding-right:%sem;" % len(m.group(1)))
             matched = matched.replace(m.group(0), '')
 
-        m = re.search(r'(%s)' % self.hlgn, matched)
+        m = p['pba_halign'].search(matched)
         if m:
             style.append("text-align:%s;" % self.hAlign(m.group(1)))
 
-        m = re.search(r'^(.*)#(.*)$', aclass)
+        m = p['pba_id'].search(aclass)
         if m:
             id = m.group(2)
             aclass = m.group(1)
@@ -445,8 +599,8 @@ class Textile(object):
         True
 
         """
-        r = re.compile(r'<(p|blockquote|div|form|table|ul|ol|pre|h\d)[^>]*?>.*</\1>', re.S).sub('', text.strip()).strip()
-        r = re.compile(r'<(hr|br)[^>]*?/>').sub('', r)
+        r = self.patterns['raw_blocks'].sub('', text.strip()).strip()
+        r = self.patterns['raw_empty_tags'].sub('', r)
         return '' != r
 
     def table(self, text):
@@ -456,14 +610,13 @@ class Textile(object):
         '\t<table>\n\t\t<tr>\n\t\t\t<td>one</td>\n\t\t\t<td>two</td>\n\t\t\t<td>three</td>\n\t\t</tr>\n\t\t<tr>\n\t\t\t<td>a</td>\n\t\t\t<td>b</td>\n\t\t\t<td>c</td>\n\t\t</tr>\n\t</table>\n\n'
         """
         text = text + "\n\n"
-        pattern = re.compile(r'^(?:table(_?%(s)s%(a)s%(c)s)\. ?\n)?^(%(a)s%(c)s\.? ?\|.*\|)\n\n' % {'s':self.s, 'a':self.a, 'c':self.c}, re.S|re.M|re.U)
-        return pattern.sub(self.fTable, text)
+        return self.patterns['table'].sub(self.fTable, text)
 
     def fTable(self, match):
         tatts = self.pba(match.group(1), 'table')
         rows = []
         for row in [ x for x in match.group(2).split('\n') if x]:
-            rmtch = re.search(r'^(%s%s\. )(.*)' % (self.a, self.c), row.lstrip())
+            rmtch = self.patterns['table_row'].search(row.lstrip())
             if rmtch:
                 ratts = self.pba(rmtch.group(1), 'tr')
                 row = rmtch.group(2)
@@ -472,8 +625,8 @@ class Textile(object):
             cells = []
             for cell in row.split('|'):
                 ctyp = 'd'
-                if re.search(r'^_', cell): ctyp = "h"
-                cmtch = re.search(r'^(_?%s%s%s\. )(.*)' % (self.s, self.a, self.c), cell)
+                if cell.startswith('_'): ctyp = "h"
+                cmtch = self.patterns['table_cell'].search(cell)
                 if cmtch:
                     catts = self.pba(cmtch.group(1), 'td')
                     cell = cmtch.group(2)
@@ -494,8 +647,7 @@ class Textile(object):
         >>> t.lists("* one\\n* two\\n* three")
         '\\t<ul>\\n\\t\\t<li>one</li>\\n\\t\\t<li>two</li>\\n\\t\\t<li>three</li>\\n\\t</ul>'
         """
-        pattern = re.compile(r'^([#*]+%s .*)$(?![^#*])' % self.c, re.U|re.M|re.S)
-        return pattern.sub(self.fList, text)
+        return self.patterns['lists'].sub(self.fList, text)
 
     def fList(self, match):
         text = match.group(0).split("\n")
@@ -507,11 +659,11 @@ class Textile(object):
             except IndexError:
                 nextline = ''
 
-            m = re.search(r"^([#*]+)(%s%s) (.*)$" % (self.a, self.c), line, re.S)
+            m = self.patterns['list_item'].search(line)
             if m:
                 tl, atts, content = m.groups()
                 nl = ''
-                nm = re.search(r'^([#*]+)\s.*', nextline)
+                nm = self.patterns['list_next'].search(nextline)
                 if nm:
                     nl = nm.group(1)
                 if tl not in lists:
@@ -533,16 +685,16 @@ class Textile(object):
         return "\n".join(result)
 
     def lT(self, input):
-        if re.search(r'^#+', input):
+        if input.startswith('#'):
             return 'o'
         else:
             return 'u'
 
     def doPBr(self, in_):
-        return re.compile(r'<(p)([^>]*?)>(.*)(</\1>)', re.S).sub(self.doBr, in_)
+        return self.patterns['paragraph'].sub(self.doBr, in_)
 
     def doBr(self, match):
-        content = re.sub(r'(.+)(?:(?<!<br>)|(?<!<br />))\n(?![#*\s|])', '\\1<br />', match.group(3))
+        content = self.patterns['line_break'].sub('\\1<br />', match.group(3))
         return '<%s%s>%s%s' % (match.group(1), match.group(2), content, match.group(4))
 
     def block(self, text):
@@ -551,7 +703,7 @@ class Textile(object):
         >>> t.block('h1. foobar baby')
         '\\t<h1>foobar baby</h1>'
         """
-        tre = '|'.join(self.btag)
+        p = self.patterns
         text = text.split('\n\n')
 
         tag = 'p'
@@ -561,8 +713,7 @@ class Textile(object):
 
         anon = False
         for line in text:
-            pattern = r'^(%s)(%s%s)\.(\.?)(?::(\S+))? (.*)$' % (tre, self.a, self.c)
-            match = re.search(pattern, line, re.S)
+            match = p['block'].search(line)
             if match:
                 if ext:
                     out.append(out.pop() + c1)
@@ -577,7 +728,7 @@ class Textile(object):
 
             else:
                 anon = True
-                if ext or not re.search(r'^\s', line):
+                if ext or not p['block_indented'].search(line):
                     o1, o2, content, c2, c1 = self.fBlock(tag, atts, ext, cite, line)
                     # skip $o1/$c1 because this is part of a continuing extended block
                     if tag == 'p' and not self.hasRawText(content):
@@ -588,7 +739,7 @@ class Textile(object):
                     line = self.graf(line)
 
             line = self.doPBr(line)
-            line = re.sub(r'<br>', '<br />', line)
+            line = line.replace('<br>', '<br />')
 
             if ext and anon:
                 out.append(out.pop() + "\n" + line)
@@ -623,7 +774,7 @@ class Textile(object):
         atts = self.pba(atts)
         o1 = o2 = c2 = c1 = ''
 
-        m = re.search(r'fn(\d+)', tag)
+        m = self.patterns['footnote_tag'].search(tag)
         if m:
             tag = 'p'
             if m.group(1) in self.fn:
@@ -677,7 +828,7 @@ class Textile(object):
         >>> t.footnoteRef('foo[1] ') # doctest: +ELLIPSIS
         'foo<sup class="footnote"><a href="#fn...">1</a></sup> '
         """
-        return re.sub(r'\b\[([0-9]+)\](\s)?', self.footnoteID, text)
+        return self.patterns['footnote_ref'].sub(self.footnoteID, text)
 
     def footnoteID(self, match):
         id, t = match.groups()
@@ -711,48 +862,15 @@ class Textile(object):
 
         """
          # fix: hackish
-        text = re.sub(r'"\z', '\" ', text)
-
-        glyph_search = (
-            re.compile(r"(\w)\'(\w)"),                                      # apostrophe's
-            re.compile(r'(\s)\'(\d+\w?)\b(?!\')'),                          # back in '88
-            re.compile(r'(\S)\'(?=\s|'+self.pnct+'|<|$)'),                       #  single closing
-            re.compile(r'\'/'),                                             #  single opening
-            re.compile(r'(\S)\"(?=\s|'+self.pnct+'|<|$)'),                       #  double closing
-            re.compile(r'"'),                                               #  double opening
-            re.compile(r'\b([A-Z][A-Z0-9]{2,})\b(?:[(]([^)]*)[)])'),        #  3+ uppercase acronym
-            re.compile(r'\b([A-Z][A-Z\'\-]+[A-Z])(?=[\s.,\)>])'),           #  3+ uppercase
-            re.compile(r'\b(\s{0,1})?\.{3}'),                                     #  ellipsis
-            re.compile(r'(\s?)--(\s?)'),                                    #  em dash
-            re.compile(r'\s-(?:\s|$)'),                                     #  en dash
-            re.compile(r'(\d+)( ?)x( ?)(?=\d+)'),                           #  dimension sign
-            re.compile(r'\b ?[([]TM[])]', re.I),                            #  trademark
-            re.compile(r'\b ?[([]R[])]', re.I),                             #  registered
-            re.compile(r'\b ?[([]C[])]', re.I),                             #  copyright
-         )
-
-        glyph_replace = [x % dict(self.glyph_defaults) for x in (
-            r'\1%(txt_apostrophe)s\2',           # apostrophe's
-            r'\1%(txt_apostrophe)s\2',           # back in '88
-            r'\1%(txt_quote_single_close)s',     #  single closing
-            r'%(txt_quote_single_open)s',         #  single opening
-            r'\1%(txt_quote_double_close)s',        #  double closing
-            r'%(txt_quote_double_open)s',             #  double opening
-            r'<acronym title="\2">\1</acronym>', #  3+ uppercase acronym
-            r'<span class="caps">\1</span>',     #  3+ uppercase
-            r'\1%(txt_ellipsis)s',                  #  ellipsis
-            r'\1%(txt_emdash)s\2',               #  em dash
-            r' %(txt_endash)s ',                 #  en dash
-            r'\1\2%(txt_dimension)s\3',          #  dimension sign
-            r'%(txt_trademark)s',                #  trademark
-            r'%(txt_registered)s',                #  registered
-            r'%(txt_copyright)s',                #  copyright
-        )]
+        p = self.patterns
+        text = p['glyph_end_quote'].sub('\" ', text)
 
+        glyphs = zip(p['glyph_search'], p['glyph_replace'])
+        is_tag = p['glyph_tag'].search
         result = []
-        for line in re.compile(r'(<.*?>)', re.U).split(text):
-            if not re.search(r'<.*>', line):
-                for s, r in zip(glyph_search, glyph_replace):
+        for line in p['glyph_tags'].split(text):
+            if not is_tag(line):
+                for s, r in glyphs:
                     line = s.sub(r, line)
             result.append(line)
         return ''.join(result)
@@ -773,8 +891,7 @@ class Textile(object):
         """
         what is this for?
         """
-        pattern = re.compile(r'(?:(?<=^)|(?<=\s))\[(.+)\]((?:http:\/\/|\/)\S+)(?=\s|$)', re.U)
-        text = pattern.sub(self.refs, text)
+        text = self.patterns['refs'].sub(self.refs, text)
         return text
 
     def refs(self, match):
@@ -788,7 +905,7 @@ class Textile(object):
     def relURL(self, url):
         o = urlparse(url)
         (scheme,netloc,path,params,query,fragment) = o[0:6]
-        if (not scheme or scheme == 'http') and not netloc and re.search(r'^\w', path):
+        if (not scheme or scheme == 'http') and not netloc and self.patterns['rel_url'].search(path):
             url = self.hu + url
         if self.restricted and scheme and scheme not in self.url_schemes:
             return '#'
@@ -806,10 +923,11 @@ class Textile(object):
         >>> t.retrieve(id)
         'foobar'
         """
-        while True:
+        def unshelve(match):
+            return self.shelf.get(match.group(0), match.group(0))
+        while self.shelf:
             old = text
-            for k,v in self.shelf.items():
-                text = text.replace(k,v)
+            text = _shelf_id.sub(unshelve, text)
             if text == old: break
         return text
 
@@ -857,23 +975,7 @@ class Textile(object):
         'fooobar ... and hello world ...'
         """
 
-        punct = '!"#$%&\'*+,-./:;=?@\\^_`|~'
-
-        pattern = r'''
-            ([\s\[{(]|[%s])?     # $pre
-            "                          # start
-            (%s)                     # $atts
-            ([^"]+?)                   # $text
-            \s?
-            (?:\(([^)]+?)\)(?="))?     # $title
-            ":
-            (\S+?)                     # $url
-            (\/)?                      # $slash
-            ([^\w\/;]*?)               # $post
-            (?=<|\s|$)
-        ''' % (re.escape(punct), self.c)
-
-        text = re.compile(pattern, re.X).sub(self.fLink, text)
+        text = self.patterns['links'].sub(self.fLink, text)
 
         return text
 
@@ -906,20 +1008,7 @@ class Textile(object):
         >>> t.span(r"hello %(bob)span *strong* and **bold**% goodbye")
         'hello <span class="bob">span <strong>strong</strong> and <b>bold</b></span> goodbye'
         """
-        qtags = (r'\*\*', r'\*', r'\?\?', r'\-', r'__', r'_', r'%', r'\+', r'~', r'\^')
-        pnct = ".,\"'?!;:"
-
-        for qtag in qtags:
-            pattern = re.compile(r"""
-                (?:^|(?<=[\s>%(pnct)s])|([\]}]))
-                (%(qtag)s)(?!%(qtag)s)
-                (%(c)s)
-                (?::(\S+))?
-                ([^\s%(qtag)s]+|\S[^%(qtag)s\n]*[^\s%(qtag)s\n])
-                ([%(pnct)s]*)
-                %(qtag)s
-                (?:$|([\]}])|(?=%(selfpnct)s{1,2}|\s))
-            """ % {'qtag':qtag,'c':self.c,'pnct':pnct,'selfpnct':self.pnct}, re.X)
+        for pattern in self.patterns['spans']:
             text = pattern.sub(self.fSpan, text)
         return text
 
@@ -953,20 +1042,7 @@ class Textile(object):
         >>> t.image('!/imgs/myphoto.jpg!:http://jsamsa.com')
         '<a href="http://jsamsa.com"><img src="/imgs/myphoto.jpg" alt="" /></a>'
         """
-        pattern = re.compile(r"""
-            (?:[\[{])?          # pre
-            \!                 # opening !
-            (\<|\=|\>)??       # optional alignment atts
-            (%s)               # optional style,class atts
-            (?:\. )?           # optional dot-space
-            ([^\s(!]+)         # presume this is the src
-            \s?                # optional space
-            (?:\(([^\)]+)\))?  # optional title
-            \!                 # closing
-            (?::(\S+))?        # optional href
-            (?:[\]}]|(?=\s|$)) # lookahead: space or end of string
-        """ % self.c, re.U|re.X)
-        return pattern.sub(self.fImage, text)
+        return self.patterns['image'].sub(self.fImage, text)
 
     def fImage(self, match):
         # (None, '', '/imgs/myphoto.jpg', None, None)
@@ -1022,7 +1098,9 @@ class Textile(object):
     def doSpecial(self, text, start, end, method=None):
         if method == None:
             method = self.fSpecial
-        pattern = re.compile(r'(^|\s|[\[({>])%s(.*?)%s(\s|$|[\])}])?' % (re.escape(start), re.escape(end)), re.M|re.S)
+        pattern = self.patterns['special'].get((start, end))
+        if pattern is None:
+            pattern = _special_pattern(start, end)
         return pattern.sub(method, text)
 
     def fSpecial(self, match):
@@ -1051,8 +1129,17 @@ def textile(text, **args):
     validate - perform mxTidy or uTidyLib validation (default: False)
     sanitize - sanitize output good for weblog comments (default: False)
     head_offset - ignored
+
+    Each thread reuses one Textile instance, which is reset between
+    documents.
     """
-    return Textile().textile(text, **args)
+    t = getattr(_local, 'textile', None)
+    if t is None:
+        t = _local.textile = Textile()
+    t.reset()
+    return t.textile(text, **args)
+
+_local = threading.local()
 
 def _test():
     import doctest
@@ -10,54 +10,221 @@ The following markup languages are supported:
 
 For ReStructuredText and Markdown syntax highlighting of source code is
 available.
+
+The markup libraries (and Pygments, which they use for highlighting) are
+imported the first time a post in that markup is rendered, rather than when
+this module is imported, so that requests and tasks that never render a post
+don't pay for loading them.
 """
 
 # TODO: Add summary rendering.
 # TODO: Docstrings.
 
+import copy
+import hashlib
 import logging
+import os
 import re
+import threading
+import time
 from cStringIO import StringIO
 
 from django.utils import html
 from django.utils import text
+from google.appengine.api import memcache
+from google.appengine.runtime import DeadlineExceededError
 
+import caching
 import config
+import stats
 import utils
 
-# Import markup module from lib/
-import markdown
-import markdown_processor
-import rst_directive
-import textile
-from docutils.core import publish_parts
 
+# Matches a single HTML comment containing 'cut', without running on past the
+# end of that comment into any others on the same line.
+CUT_SEPARATOR_REGEX = r'<!--(?:(?!-->)[^\n])*cut(?:(?!-->)[^\n])*-->'
+_cut_separator = re.compile(CUT_SEPARATOR_REGEX)
+
+_blank_line = re.compile(r'\n[ \t]*\n')
+
+# Markups that a summary can be rendered from the first few paragraphs of,
+# mapped to a pattern for lines later in the body that those paragraphs may
+# depend on (such as link definitions), or None. Summaries in other markups
+# are cut from a render of the whole body.
+SUMMARY_PREFIX_MARKUPS = {
+    'html': None,
+    'txt': None,
+    'markdown': re.compile(r'^ {0,3}\[[^\]\n]+\]:[^\n]*$', re.M),
+    'textile': re.compile(r'^\[[^\]\n]+\]\S+[ \t]*$', re.M),
+}
+
+RST_SETTINGS = {
+    '_disable_config': True,
+    'embed_stylesheet': False,
+    'report_level': 2,
+}
+
+# Renderers are built once and reused for every document. Markdown keeps
+# per-document state in module globals and docutils' publisher isn't
+# reentrant, so each renderer is used by one thread at a time.
+_rst_lock = threading.Lock()
+_rst_publisher = None
+_markdown_lock = threading.Lock()
+_markdown = None
+
+# Rendered top-level Markdown blocks, keyed by a digest of their source.
+_markdown_blocks = caching.TieredCache('markdown-blocks', size=1000)
 
-CUT_SEPARATOR_REGEX = r'<!--.*cut.*-->'
+# Markdown containing link definitions or raw HTML is rendered in one piece,
+# since those can affect, or span, more than one block.
+_markdown_whole_document = re.compile(r'^(?: {0,3}\[[^\]\n]+\]:|<)', re.M)
+_markdown_block_separator = re.compile(r'(\n(?:[ \t]*\n)+)')
+_markdown_list_item = re.compile(r' {0,3}(?:[*+-]|\d+\.)[ \t]')
+
+
+def _get_rst_publisher():
+  global _rst_publisher
+  if _rst_publisher is None:
+    # Import markup modules from lib/ on first use.
+    from docutils import core
+    from docutils import io
+    import rst_directive
+    pub = core.Publisher(source_class=io.StringInput,
+                         destination_class=io.StringOutput)
+    pub.set_components('standalone', 'restructuredtext', 'html4css1')
+    pub.process_programmatic_settings(None, RST_SETTINGS, None)
+    _rst_publisher = pub
+  return _rst_publisher
 
 
 def render_rst(content):
   warning_stream = StringIO()
-  parts = publish_parts(content, writer_name='html4css1',
-                        settings_overrides={
-                          '_disable_config': True,
-                          'embed_stylesheet': False,
-                          'warning_stream': warning_stream,
-                          'report_level': 2,
-                        })
+  _rst_lock.acquire()
+  try:
+    pub = _get_rst_publisher()
+    # Documents and transforms may modify their settings, so each one gets
+    # a copy of the settings parsed when the publisher was built.
+    settings = pub.settings
+    pub.settings = copy.copy(settings)
+    pub.settings.warning_stream = warning_stream
+    try:
+      pub.set_source(content, None)
+      pub.set_destination(None, None)
+      pub.publish()
+      body = pub.writer.parts['html_body']
+    finally:
+      pub.settings = settings
+      pub.document = None
+  finally:
+    _rst_lock.release()
   rst_warnings = warning_stream.getvalue()
   if rst_warnings:
       logging.warn(rst_warnings)
-  return parts['html_body']
+  return body
+
+
+def _get_markdown():
+  global _markdown
+  if _markdown is None:
+    import markdown
+    import markdown_processor
+    md = markdown.Markdown()
+    md.textPreprocessors.insert(0, markdown_processor.CodeBlockPreprocessor())
+    _markdown = md
+  return _markdown
+
+
+def _render_markdown(content):
+  _markdown_lock.acquire()
+  try:
+    md = _get_markdown()
+    md.reset()
+    return md.convert(content)
+  finally:
+    _markdown_lock.release()
+
+
+def _continues_markdown_block(block, chunk):
+  """Returns True if chunk has to be rendered along with the block before it.
+
+  Args:
+    block: The source of the block so far.
+    chunk: The source following the next blank line.
+  """
+  if block.count('[sourcecode:') > block.count('[/sourcecode]'):
+    return True
+  if chunk.startswith('    ') or chunk.startswith('\t'):
+    # Code blocks and list item paragraphs.
+    return True
+  if _markdown_list_item.match(chunk) and _markdown_list_item.match(block):
+    return True
+  if chunk.startswith('>') and block.startswith('>'):
+    return True
+  return False
+
+
+def split_markdown(content):
+  """Splits Markdown source into top-level blocks that render independently.
+
+  Rendering each block on its own and joining the results with newlines
+  gives the same HTML as rendering the whole document, give or take
+  whitespace between top-level elements.
+
+  Args:
+    content: Markdown source.
+  Returns:
+    A list of block sources, or None if the document can't be split.
+  """
+  if _markdown_whole_document.search(content):
+    return None
+  content = content.replace('\r\n', '\n').replace('\r', '\n')
+  parts = _markdown_block_separator.split(content)
+  blocks = []
+  for i in range(0, len(parts), 2):
+    chunk = parts[i]
+    if not chunk.strip():
+      continue
+    if blocks and _continues_markdown_block(blocks[-1], chunk):
+      blocks[-1] += parts[i - 1] + chunk
+    else:
+      blocks.append(chunk)
+  return blocks
+
+
+def _markdown_block_key(block):
+  if isinstance(block, unicode):
+    block = block.encode('utf-8')
+  val = (os.environ.get('CURRENT_VERSION_ID', ''), hashlib.sha1(block).digest())
+  return hashlib.sha1(repr(val)).hexdigest()
 
 
 def render_markdown(content):
-  md = markdown.Markdown()
-  md.textPreprocessors.insert(0, markdown_processor.CodeBlockPreprocessor())
-  return md.convert(content)
+  """Renders Markdown, reusing cached renders of unchanged blocks.
+
+  Editing one paragraph of a long post only re-renders that paragraph (and
+  any list, quote or code block it is part of).
+  """
+  blocks = split_markdown(content)
+  if not blocks or len(blocks) == 1:
+    return _render_markdown(content)
+  keys = [_markdown_block_key(block) for block in blocks]
+  cached = _markdown_blocks.get_multi(set(keys))
+  rendered = {}
+  output = []
+  for key, block in zip(keys, blocks):
+    if key in cached:
+      output.append(cached[key])
+    else:
+      if key not in rendered:
+        rendered[key] = _render_markdown(block)
+      output.append(rendered[key])
+  if rendered:
+    _markdown_blocks.set_multi(rendered)
+  return u'\n'.join(output)
 
 
 def render_textile(content):
+  import textile
   return textile.textile(content.encode('utf-8'))
 
 
@@ -71,9 +238,137 @@ MARKUP_MAP = {
 }
 
 
+# Renders that were cut off this many times in a row aren't tried again,
+# until BUDGET_EXPIRY seconds after the last attempt.
+MAX_ABANDONED_RENDERS = 2
+BUDGET_EXPIRY = 3600
+
+_pool_lock = threading.Lock()
+_pool = None
+# Whether a worker process can be started here; None until first tried.
+_worker_available = None
+
+
+class RenderBudgetExceeded(Exception):
+  """Rendering a body took too long or produced too much output."""
+
+
+def _render_markup(body_markup, content):
+  return MARKUP_MAP[body_markup][1](content)
+
+
+def _get_pool():
+  """Returns the render worker pool, or None if no worker can be started.
+
+  Whether a worker can be started is only tried once per process: the App
+  Engine sandbox, for one, has the multiprocessing module but can't fork.
+  """
+  global _pool, _worker_available
+  _pool_lock.acquire()
+  try:
+    if _pool is None and _worker_available is not False:
+      try:
+        import multiprocessing
+        _pool = multiprocessing.Pool(1)
+        _worker_available = True
+      except (ImportError, OSError, NotImplementedError), e:
+        logging.warn("Can't start a render worker (%s); rendering in process.",
+                     e)
+        _worker_available = False
+    return _pool
+  finally:
+    _pool_lock.release()
+
+
+def _render_in_worker(pool, body_markup, content):
+  """Renders in a worker process, abandoning it if it runs over time."""
+  import multiprocessing
+  global _pool
+  result = pool.apply_async(_render_markup, (body_markup, content))
+  try:
+    return result.get(config.render_time_limit)
+  except multiprocessing.TimeoutError:
+    # The worker is still busy with this body, so replace it.
+    _pool_lock.acquire()
+    try:
+      if _pool is pool:
+        _pool = None
+    finally:
+      _pool_lock.release()
+    pool.terminate()
+    raise RenderBudgetExceeded('took over %s seconds'
+                               % config.render_time_limit)
+
+
+def _render_in_process(body_markup, content):
+  """Renders in this process, refusing bodies that keep getting cut off.
+
+  A render can't be interrupted here, so bodies are counted in when they
+  start rendering and out when they finish. A body whose renders were
+  killed at the request deadline more than MAX_ABANDONED_RENDERS times
+  isn't rendered again, so a task that renders it doesn't die on every
+  retry.
+  """
+  if isinstance(content, unicode):
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+  else:
+    digest = hashlib.sha1(content).hexdigest()
+  key = '%s:%s' % (body_markup, digest)
+  memcache.add(key, 0, time=BUDGET_EXPIRY, namespace='render-budget')
+  started = memcache.incr(key, namespace='render-budget')
+  if started and started > MAX_ABANDONED_RENDERS:
+    memcache.decr(key, namespace='render-budget')
+    raise RenderBudgetExceeded('was cut off %d times before'
+                               % (started - 1))
+  start = time.time()
+  cut_off = False
+  try:
+    try:
+      rendered = _render_markup(body_markup, content)
+    except DeadlineExceededError:
+      # Only renders cut off at the deadline stay counted in.
+      cut_off = True
+      raise RenderBudgetExceeded('hit the request deadline')
+  finally:
+    if not cut_off:
+      memcache.decr(key, namespace='render-budget')
+  elapsed = time.time() - start
+  if elapsed > config.render_time_limit:
+    logging.warn('Rendering %s took %.1f seconds', key, elapsed)
+  return rendered
+
+
+def render(post, content):
+  """Renders content in a post's markup, within the configured budget.
+
+  Rendering runs in this process, or in a worker process if
+  config.render_in_worker is set and one can be started. Content that takes
+  longer than config.render_time_limit seconds or renders to more than
+  config.render_size_limit characters is shown as preformatted text instead.
+  """
+  span = stats.start('markup.%s' % post.body_markup, post.path or post.title)
+  try:
+    pool = config.render_in_worker and _get_pool()
+    if pool:
+      rendered = _render_in_worker(pool, post.body_markup, content)
+    else:
+      rendered = _render_in_process(post.body_markup, content)
+    if len(rendered) > config.render_size_limit:
+      raise RenderBudgetExceeded('rendered to %d characters' % len(rendered))
+  except RenderBudgetExceeded, e:
+    logging.error('Rendering post %r (%s) as %s %s; showing it preformatted.',
+                  post.title, post.path, post.body_markup, e)
+    return u'<pre>%s</pre>' % html.escape(content)
+  finally:
+    stats.finish(span)
+  return rendered
+
+
 def get_renderer(post):
   """Returns a render function for this posts body markup."""
-  return MARKUP_MAP.get(post.body_markup)[1]
+  if post.body_markup == 'html':
+    return MARKUP_MAP['html'][1]
+  return lambda content: render(post, content)
 
 
 def clean_content(content):
@@ -81,7 +376,7 @@ def clean_content(content):
 
   Actually this removes the cut separator.
   """
-  return re.sub(CUT_SEPARATOR_REGEX, '', content)
+  return _cut_separator.sub('', content)
 
 
 def render_body(post):
@@ -90,12 +385,59 @@ def render_body(post):
   return renderer(clean_content(post.body))
 
 
+def _summary_sources(body, references):
+  """Yields successively longer leading parts of a post body.
+
+  Each part ends at a blank line and has about twice as many words as the
+  last, starting at twice the summary length. The last part is the whole
+  body.
+
+  Args:
+    body: The post body.
+    references: A compiled pattern for lines that have to be kept from the
+      rest of the body, or None.
+  Yields:
+    (source, complete) tuples, where complete is True for the whole body.
+  """
+  target = config.summary_length * 2
+  words = 0
+  start = 0
+  for match in _blank_line.finditer(body):
+    words += len(body[start:match.start()].split())
+    start = match.end()
+    if words < target:
+      continue
+    source = body[:match.start()]
+    if source.count('[sourcecode:') > source.count('[/sourcecode]'):
+      # Don't cut a code block in two.
+      continue
+    if references:
+      kept = references.findall(body, match.end())
+      if kept:
+        source = '%s\n\n%s\n' % (source, '\n'.join(kept))
+    yield source, False
+    target *= 2
+  yield body, True
+
+
 def render_summary(post):
-  """Return the post's summary rendered to HTML."""
+  """Return the post's summary rendered to HTML.
+
+  If the body has no cut separator, only as much of it is rendered as is
+  needed to fill config.summary_length words.
+  """
   renderer = get_renderer(post)
-  match = re.search(CUT_SEPARATOR_REGEX, post.body)
+  match = _cut_separator.search(post.body)
   if match:
     return renderer(post.body[:match.start(0)])
-  else:
-    return text.truncate_html_words(renderer(clean_content(post.body)),
+  if post.body_markup not in SUMMARY_PREFIX_MARKUPS:
+    return text.truncate_html_words(renderer(post.body),
                                     config.summary_length)
+  references = SUMMARY_PREFIX_MARKUPS[post.body_markup]
+  for source, complete in _summary_sources(post.body, references):
+    rendered = renderer(source)
+    summary = text.truncate_html_words(rendered, config.summary_length)
+    if complete or summary != rendered:
+      # Either this is the whole body, or there were enough words to
+      # truncate, in which case the rest of the body can't change the result.
+      return summary
@@ -11,12 +11,12 @@ from google.appengine.ext import db
 from google.appengine.ext import deferred
 
 import config
+import highlighting
+import jobs
 import models
 import post_deploy
+import tasks
 
-import pygments
-import pygments.lexers
-import pygments.formatters
 import pygments.util
 
 
@@ -52,6 +52,29 @@ class BaseMigration(object):
         user_api_key=disqus_user_key,
         forum_id=forum_id)['message']
 
+  def start(self):
+    """Starts the migration as a job, which the admin jobs page follows.
+
+    Returns:
+      The job id.
+    """
+    job_id = jobs.start('migration', self.__class__.__name__)
+    tasks.defer_in({'job': job_id}, self.migrate_all)
+    jobs.flush()
+    return job_id
+
+  def finish(self):
+    """Rebuilds the site once every post has been migrated.
+
+    Comments are still being migrated by tasks of the job, so the job is
+    only marked finished once those have run.
+    """
+    logging.warn("Posts migrated; starting rebuild.")
+    if jobs.current() is not None:
+      deferred.defer(jobs.finish_when_idle, jobs.current(),
+                     _countdown=jobs.POLL_SECONDS)
+    deferred.defer(post_deploy.rebuild)
+
 
 class BloogBreakingMigration(BaseMigration):
   class Article(db.Model):
@@ -87,8 +110,8 @@ class BloogBreakingMigration(BaseMigration):
     post_id = disqus_request('create_post', **post_args)['message']['id']
     for parent_id, replies in itertools.groupby(replies, lambda x:x[0]):
       parent_key = db.Key.from_path('Comment', parent_id, parent=comment_key)
-      deferred.defer(self.migrate_one_comment, thread_id, parent_key,
-                     [x[1:] for x in replies if x[1:]], post_id)
+      tasks.defer(self.migrate_one_comment, thread_id, parent_key,
+                  [x[1:] for x in replies if x[1:]], post_id)
 
   def migrate_all_comments(self, article_key, title):
     thread_id = disqus_request(
@@ -111,9 +134,10 @@ class BloogBreakingMigration(BaseMigration):
     for parent_id, replies in itertools.groupby(comment_ids, lambda x:x[0]):
       # Migrate that comment, passing in its child IDs
       parent_key = db.Key.from_path('Comment', parent_id, parent=article_key)
-      deferred.defer(self.migrate_one_comment, thread_id, parent_key,
-                     [x[1:] for x in replies if x[1:]])
+      tasks.defer(self.migrate_one_comment, thread_id, parent_key,
+                  [x[1:] for x in replies if x[1:]])
 
+  @jobs.counted
   def migrate_one(self, article):
     post = models.BlogPost(
         path=article.key().name(),
@@ -124,21 +148,20 @@ class BloogBreakingMigration(BaseMigration):
         updated=article.updated,
         deps={})
     post.put()
-    deferred.defer(self.migrate_all_comments, article.key(), article.title)
+    tasks.defer(self.migrate_all_comments, article.key(), article.title)
   
   def migrate_all(self, batch_size=20, start_key=None):
     q = BloogBreakingMigration.Article.all()
     if start_key:
       q.filter('__key__ >', start_key)
     articles = q.fetch(batch_size)
+    jobs.count('planned', len(articles))
     for article in articles:
       self.migrate_one(article)
     if len(articles) == batch_size:
-      deferred.defer(self.migrate_all, batch_size, articles[-1].key())
+      tasks.defer(self.migrate_all, batch_size, articles[-1].key())
     else:
-      logging.warn("Migration finished; starting rebuild.")
-      regen = post_deploy.PostRegenerator()
-      deferred.defer(regen.regenerate)
+      self.finish()
 
 
 class WordpressMigration(BaseMigration):
@@ -193,21 +216,19 @@ class WordpressMigration(BaseMigration):
       scode = content[match.end():m_end.start()+match.end()]
       lang = match.groupdict().get('lang')
       if lang is not None:
-        formatter = pygments.formatters.get_formatter_by_name('html')
         try:
-          lexer = pygments.lexers.get_lexer_by_name(lang)
+          scode = highlighting.highlight(scode, lang)
         except pygments.util.ClassNotFound:
           logging.info('No lexer found: %s', lang)
-          lexer = None
           new_content.extend(['<pre>', scode, '</pre>'])
         else:
-          scode = pygments.highlight(scode, lexer, formatter)
           new_content.append(scode)
       new_content.append(content[m_end.end()+match.end():])
       content = ''.join(new_content)
       match = p_bgn.search(content)
     return content
 
+  @jobs.counted
   def migrate_one(self, wp_post):
     post = models.BlogPost(
       path=wp_post['path'],
@@ -221,8 +242,8 @@ class WordpressMigration(BaseMigration):
     )
     post.put()
     if wp_post['comments']:
-      deferred.defer(self.migrate_all_comments, wp_post['comments'],
-                     post.path, wp_post['title'])
+      tasks.defer(self.migrate_all_comments, wp_post['comments'],
+                  post.path, wp_post['title'])
 
   def migrate_all_comments(self, wp_comments, post_path, title):
     thread_id = disqus_request(
@@ -238,8 +259,8 @@ class WordpressMigration(BaseMigration):
         thread_id=thread_id,
         url="http://%s%s" % (config.host, post_path))
     for comment in wp_comments[0]:
-      deferred.defer(self.migrate_one_comment, comment, thread_id,
-                     wp_comments)
+      tasks.defer(self.migrate_one_comment, comment, thread_id,
+                  wp_comments)
 
   def migrate_one_comment(self, comment, thread_id, comments, parent_id=None):
     post_args = {
@@ -258,8 +279,8 @@ class WordpressMigration(BaseMigration):
     post_id = disqus_request('create_post', **post_args)['message']['id']
     for reply in comments.get(comment['id'], []):
       logging.info('Adding reply')
-      deferred.defer(self.migrate_one_comment, reply, thread_id,
-                     comments, post_id)
+      tasks.defer(self.migrate_one_comment, reply, thread_id,
+                  comments, post_id)
 
   def _convert_post_node(self, node, channel_link):
     post = {'title': None, 'body': None,
@@ -267,7 +288,7 @@ class WordpressMigration(BaseMigration):
             'tags': set([])}
     post['status'] = self._get_text(node, 'status', ns=self.ns_wordpress)
     if post['status'] == 'draft':
-      post['published'] = datetime.datetime.max
+      post['published'] = None
       post['path'] = None
     else:
       post['published'] = self._parse_date(self._get_text(node, 'post_date',
@@ -329,13 +350,12 @@ class WordpressMigration(BaseMigration):
   def migrate_all(self, batch_size=20, items=None):
     if items is None:
       items = self._get_posts()
+      jobs.count('planned', len(items))
     logging.warn('Start processing of %d items', len(items))
     for item in items[:batch_size]:
       self.migrate_one(item)
     if items[batch_size:]:
-      deferred.defer(self.migrate_all, batch_size, items[batch_size:])
+      tasks.defer(self.migrate_all, batch_size, items[batch_size:])
     else:
-      logging.warn("Migration finished; starting rebuild.")
-      regen = post_deploy.PostRegenerator()
-      deferred.defer(regen.regenerate)
+      self.finish()
 
@@ -6,6 +6,7 @@ from google.appengine.ext import db
 from google.appengine.ext import deferred
 
 import config
+import dependencies
 import generators
 import markup
 import static
@@ -18,6 +19,17 @@ else:
   DEFAULT_MARKUP = 'html'
 
 
+# Seconds to wait after publishing before warming memcache.
+WARM_DELAY = 30
+
+# Number of paths tried at a time when finding a free path for a new post.
+PATH_CANDIDATES = 5
+
+# Values of BlogPost.status.
+DRAFT = 'draft'
+PUBLISHED = 'published'
+
+
 class BlogDate(db.Model):
   """Contains a list of year-months for published blog posts."""
 
@@ -36,12 +48,64 @@ class BlogDate(db.Model):
     year, month = key_name.split("/")
     return datetime.datetime(int(year), int(month), 1, tzinfo=utils.tzinfo())
 
+  @classmethod
+  def get_month_range(cls, key_name):
+    """Returns the start of the month named by key_name, and of the next."""
+    # datetime_from_key_name() only sets the year and month, so there's no
+    # hour, minute etc. to clear.
+    start = cls.datetime_from_key_name(key_name)
+    # Python doesn't wrap the month for us, so handle it manually.
+    if start.month >= 12:
+      end = start.replace(year=start.year+1, month=1)
+    else:
+      end = start.replace(month=start.month+1)
+    return start, end
+
   @property
   def date(self):
     return BlogDate.datetime_from_key_name(self.key().name()).date()
 
 
-class BlogPost(db.Model):
+class PostFields(object):
+  """Properties shared by BlogPost and PostSummary, for templates."""
+
+  def _localized(self, name):
+    """Returns (localized datetime, date string) for a datetime property.
+
+    Templates use these several times for each post they render, so they are
+    kept with the post until the property changes.
+    """
+    value = getattr(self, name)
+    cache = self.__dict__.setdefault('_localized_cache', {})
+    cached = cache.get(name)
+    if cached is None or cached[0] != value:
+      localized = utils.tz_field(value)
+      formatted = None
+      if localized is not None:
+        from django.utils import dateformat
+        formatted = dateformat.format(localized, config.date_format)
+      cached = cache[name] = (value, localized, formatted)
+    return cached[1:]
+
+  @property
+  def published_tz(self):
+    return self._localized('published')[0]
+
+  @property
+  def updated_tz(self):
+    return self._localized('updated')[0]
+
+  @property
+  def published_date(self):
+    """The localized publication date, formatted as per config.date_format."""
+    return self._localized('published')[1]
+
+  @property
+  def tag_pairs(self):
+    return [(x, utils.slugify(x.lower())) for x in self.tags]
+
+
+class BlogPost(PostFields, db.Model):
   # The URL path to the blog post. Posts have a path iff they are published.
   path = db.StringProperty()
   title = db.StringProperty(required=True, indexed=False)
@@ -51,23 +115,24 @@ class BlogPost(db.Model):
   tags = aetycoon.SetProperty(basestring, indexed=False)
   published = db.DateTimeProperty()
   updated = db.DateTimeProperty(auto_now=False)
-  deps = aetycoon.PickleProperty()
-
-  @property
-  def published_tz(self):
-    return utils.tz_field(self.published)
-
-  @property
-  def updated_tz(self):
-    return utils.tz_field(self.updated)
+  deps = dependencies.DepsProperty()
+  # The summary_fields_hash the post's PostSummary was last written with.
+  summary_fields = db.StringProperty(indexed=False)
 
   @aetycoon.TransformProperty(tags)
   def normalized_tags(tags):
     return list(set(utils.slugify(x.lower()) for x in tags))
 
-  @property
-  def tag_pairs(self):
-    return [(x, utils.slugify(x.lower())) for x in self.tags]
+  @aetycoon.DerivedProperty
+  def status(self):
+    """PUBLISHED for posts with a path and a publication date, else DRAFT.
+
+    Queries for published posts filter on this, rather than on published
+    dates, so that they are a single index scan.
+    """
+    if self.path and self.published:
+      return PUBLISHED
+    return DRAFT
 
   @property
   def rendered(self):
@@ -86,33 +151,106 @@ class BlogPost(db.Model):
 
   @property
   def summary_hash(self):
-    val = (self.title, self.summary, self.tags, self.published)
+    """A hash of what the post's summary is rendered from."""
+    val = (self.title, self.body_markup, self.body, self.tags, self.published)
+    return hashlib.sha1(str(val)).hexdigest()
+
+  @property
+  def summary_fields_hash(self):
+    """A hash of every field that PostSummary.from_post() copies."""
+    val = (self.summary_hash, self.path, self.updated)
     return hashlib.sha1(str(val)).hexdigest()
 
+  def get_entities(self):
+    """Returns the entities to put to store the post.
+
+    That's the post, and its PostSummary if any of the fields it's made
+    from have changed since it was last written. Building the PostSummary
+    renders the summary, so this is skipped whenever it can be.
+    """
+    fields = self.summary_fields_hash
+    if fields == self.summary_fields:
+      return [self]
+    self.summary_fields = fields
+    return [self, PostSummary.from_post(self)]
+
+  def put(self, **kwargs):
+    """Stores the post, and its PostSummary if that has changed.
+
+    Both are written in one batch put. A new post is stored on its own
+    first, since its PostSummary needs its id.
+    """
+    if not self.is_saved():
+      db.Model.put(self, **kwargs)
+    db.put(self.get_entities(), **kwargs)
+    return self.key()
+
+  def delete(self, **kwargs):
+    """Deletes the post, and its PostSummary."""
+    db.delete([PostSummary.key_for(self.key()), self.key()], **kwargs)
+
+  def reserve_path(self):
+    """Finds a free path for the post, and reserves it with empty content."""
+    num = 0
+    while True:
+      paths = [utils.format_post_path(self, x)
+               for x in range(num, num + PATH_CANDIDATES)]
+      path, content = static.add_first(paths, '', config.html_mime_type)
+      if path:
+        return path
+      num += PATH_CANDIDATES
+
   def publish(self):
     regenerate = False
     if not self.path:
-      num = 0
-      content = None
-      while not content:
-        path = utils.format_post_path(self, num)
-        content = static.add(path, '', config.html_mime_type)
-        num += 1
-      self.path = path
-      self.put()
+      self.path = self.reserve_path()
+      if not self.is_saved():
+        # Generators need the post's id.
+        db.Model.put(self)
       # Force regenerate on new publish. Also helps with generation of
       # chronologically previous and next page.
       regenerate = True
 
-    BlogDate.create_for_post(self)
-
+    to_generate = []
+    to_defer = []
     for generator_class, deps in self.get_deps(regenerate=regenerate):
       for dep in deps:
         if generator_class.can_defer:
-          deferred.defer(generator_class.generate_resource, None, dep)
+          to_defer.append((generator_class, dep))
         else:
-          generator_class.generate_resource(self, dep)
-    self.put()
+          to_generate.append((generator_class, dep))
+
+    # Store the post, with its new deps, in one batch put. The summary has to
+    # be stored before the previous and next posts are regenerated, so they
+    # link to this one.
+    entities = self.get_entities()
+    if regenerate:
+      entities.append(BlogDate(key_name=BlogDate.get_key_name(self)))
+    db.put(entities)
+
+    try:
+      for generator_class, dep in to_generate:
+        generator_class.generate_resource(self, dep)
+    except:
+      # The stored deps say these resources are up to date; make sure the
+      # next publish regenerates everything instead.
+      self.deps = {}
+      self.put()
+      raise
+    for generator_class, dep in to_defer:
+      deferred.defer(generator_class.generate_resource, None, dep)
+    # Pages that were regenerated are already in memcache; this catches the
+    # ones that weren't, once the deferred regeneration has had time to run.
+    deferred.defer(static.warm, self.get_warm_paths(),
+                   _countdown=WARM_DELAY)
+
+  def get_warm_paths(self):
+    """Returns the paths visitors are likely to request after a publish."""
+    paths = [self.path, generators.IndexContentGenerator.first_page_path]
+    paths.extend(generators.TagsContentGenerator.first_page_path
+                 % {'resource': x} for x in self.normalized_tags)
+    paths.extend(config.warm_paths)
+    return paths
 
   def remove(self):
     if not self.is_saved():
@@ -147,6 +285,47 @@ class BlogPost(db.Model):
       self.deps[generator_class.name()] = (new_deps, new_etag)
       yield generator_class, to_regenerate
 
+
+class PostSummary(PostFields, db.Model):
+  """The parts of a BlogPost needed to list it, without its body or deps.
+
+  Listings, the Atom feed and the admin post list query these rather than
+  BlogPosts, so they don't fetch the bodies of every post they list. Each
+  has the same id as its BlogPost, and is rewritten whenever the post is
+  stored with changes to the fields it copies.
+  """
+  path = db.StringProperty()
+  status = db.StringProperty(choices=set([DRAFT, PUBLISHED]))
+  title = db.StringProperty(required=True, indexed=False)
+  tags = aetycoon.SetProperty(basestring, indexed=False)
+  normalized_tags = db.StringListProperty()
+  published = db.DateTimeProperty()
+  updated = db.DateTimeProperty()
+  # The rendered summary.
+  summary = db.TextProperty()
+
+  @classmethod
+  def key_for(cls, post_key):
+    return db.Key.from_path(cls.kind(), post_key.id())
+
+  @classmethod
+  def from_post(cls, post):
+    return cls(
+        key=cls.key_for(post.key()),
+        path=post.path,
+        status=post.status,
+        title=post.title,
+        tags=post.tags,
+        normalized_tags=post.normalized_tags,
+        published=post.published,
+        updated=post.updated,
+        summary=db.Text(post.summary))
+
+  @property
+  def post_key(self):
+    return db.Key.from_path(BlogPost.kind(), self.key().id())
+
+
 class Page(db.Model):
   # The URL path to the page.
   path = db.StringProperty(required=True)
@@ -166,6 +345,18 @@ class Page(db.Model):
     val = (self.path, self.body, self.published)
     return hashlib.sha1(str(val)).hexdigest()
 
+  def put(self, **kwargs):
+    """Stores the page, and its PageSummary, in one batch put."""
+    if not self.is_saved() and not self._key_name:
+      # The summary needs the page's id.
+      db.Model.put(self, **kwargs)
+    db.put([self, PageSummary.from_page(self)], **kwargs)
+    return self.key()
+
+  def delete(self, **kwargs):
+    """Deletes the page, and its PageSummary."""
+    db.delete([PageSummary.key_for(self.key()), self.key()], **kwargs)
+
   def publish(self):
     self._key_name = self.path
     self.put()
@@ -177,6 +368,32 @@ class Page(db.Model):
     self.delete()
     generators.PageContentGenerator.generate_resource(self, self.path, action='delete')
 
+
+class PageSummary(db.Model):
+  """The parts of a Page needed to list it, without its body.
+
+  The admin page list queries these rather than Pages. Each has the same key
+  as its Page, apart from the kind, and is written whenever the page is.
+  """
+  path = db.StringProperty()
+  title = db.TextProperty()
+  created = db.DateTimeProperty()
+  updated = db.DateTimeProperty()
+
+  @classmethod
+  def key_for(cls, page_key):
+    return db.Key.from_path(cls.kind(), page_key.id_or_name())
+
+  @classmethod
+  def from_page(cls, page):
+    return cls(
+        key=cls.key_for(page.key()),
+        path=page.path,
+        title=page.title,
+        created=page.created,
+        updated=page.updated)
+
+
 class VersionInfo(db.Model):
   bloggart_major = db.IntegerProperty(required=True)
   bloggart_minor = db.IntegerProperty(required=True)
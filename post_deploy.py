@@ -2,15 +2,18 @@ import datetime
 import logging
 import os
 from google.appengine.api import taskqueue
+from google.appengine.ext import db
 from google.appengine.ext import deferred
 
 import config
+import jobs
 import models
 import static
+import tasks
 import utils
 import generators
 
-BLOGGART_VERSION = (1, 0, 1)
+BLOGGART_VERSION = (1, 0, 4)
 
 
 class PostRegenerator(object):
@@ -19,7 +22,9 @@ class PostRegenerator(object):
 
   def regenerate(self, batch_size=50, start_ts=None):
     q = models.BlogPost.all().order('-published')
-    q.filter('published <', start_ts or datetime.datetime.max)
+    q.filter('status =', models.PUBLISHED)
+    if start_ts:
+      q.filter('published <', start_ts)
     posts = q.fetch(batch_size)
     for post in posts:
       for generator_class, deps in post.get_deps(True):
@@ -27,10 +32,11 @@ class PostRegenerator(object):
           if (generator_class.__name__, dep) not in self.seen:
             logging.warn((generator_class.__name__, dep))
             self.seen.add((generator_class.__name__, dep))
-            deferred.defer(generator_class.generate_resource, None, dep)
+            jobs.count('planned')
+            tasks.defer(generator_class.generate_resource, None, dep)
       post.put()
     if len(posts) == batch_size:
-      deferred.defer(self.regenerate, batch_size, posts[-1].published)
+      tasks.defer(self.regenerate, batch_size, posts[-1].published)
 
 class PageRegenerator(object):
   def __init__(self):
@@ -40,11 +46,41 @@ class PageRegenerator(object):
     q = models.Page.all().order('-created')
     q.filter('created <', start_ts or datetime.datetime.max)
     pages = q.fetch(batch_size)
+    jobs.count('planned', len(pages))
     for page in pages:
-      deferred.defer(generators.PageContentGenerator.generate_resource, page, None);
+      tasks.defer(generators.PageContentGenerator.generate_resource, page, None);
       page.put()
     if len(pages) == batch_size:
-      deferred.defer(self.regenerate, batch_size, pages[-1].created)
+      tasks.defer(self.regenerate, batch_size, pages[-1].created)
+
+def rebuild(profile=False):
+  """Regenerates all content as a new generation of static content.
+
+  Visitors are served the existing content until every page has been
+  regenerated, at which point the new generation is switched to at once.
+  Progress can be followed on the admin jobs page.
+
+  Args:
+    profile: If true, the rebuild's tasks are profiled, and reported on the
+      admin profiles page.
+  Returns:
+    The id of the jobs.Job tracking the rebuild.
+  """
+  generation = static.start_build()
+  job_id = jobs.start('rebuild', 'Generation %d' % generation)
+  context = {'generation': generation, 'queue': static.BUILD_QUEUE,
+             'job': job_id}
+  if profile:
+    context['profile'] = True
+  tasks.defer_in(context, PostRegenerator().regenerate)
+  tasks.defer_in(context, PageRegenerator().regenerate)
+  tasks.defer_in(context, try_post_deploy, force=True)
+  # Not part of the job, so it isn't counted among the tasks in flight.
+  deferred.defer(static.finish_build, generation, job_id,
+                 _countdown=static.BUILD_POLL_SECONDS)
+  jobs.flush()
+  return job_id
+
 
 post_deploy_tasks = []
 
@@ -63,18 +99,71 @@ post_deploy_tasks.append(generate_static_pages([
 ]))
 
 
+def upgrade_posts(batch_size=100, start_key=None, then=None):
+  """Brings every post up to date, then calls then, if provided.
+
+  Rewrites each post, and its PostSummary if that's out of date, in batches.
+  This writes summaries (from version 1.0.2) and statuses (from 1.0.3) for
+  posts stored before them, and replaces the datetime.max publication date
+  drafts used to have with None.
+  """
+  q = models.BlogPost.all()
+  if start_key:
+    q.filter('__key__ >', start_key)
+  posts = q.fetch(batch_size)
+  for post in posts:
+    if post.published == datetime.datetime.max:
+      post.published = None
+  # A batch put doesn't call BlogPost.put(), so write the summaries too.
+  db.put([x for post in posts for x in post.get_entities()])
+  if len(posts) == batch_size:
+    deferred.defer(upgrade_posts, batch_size, posts[-1].key(), then)
+  elif then:
+    then()
+
+
+def upgrade_pages(batch_size=100, start_key=None):
+  """Writes a PageSummary for every page, for pages stored before 1.0.4."""
+  q = models.Page.all()
+  if start_key:
+    q.filter('__key__ >', start_key)
+  pages = q.fetch(batch_size)
+  # A batch put doesn't call Page.put(), so write the summaries too.
+  db.put(pages + [models.PageSummary.from_page(x) for x in pages])
+  if len(pages) == batch_size:
+    deferred.defer(upgrade_pages, batch_size, pages[-1].key())
+
+
 def regenerate_all(previous_version):
-  if (
+  previous = (
     previous_version.bloggart_major,
     previous_version.bloggart_minor,
     previous_version.bloggart_rev,
-  ) < BLOGGART_VERSION:
-    regen = PostRegenerator()
-    deferred.defer(regen.regenerate)
+  )
+  if previous < (1, 0, 3):
+    # Listings are generated from summaries, and find posts by status, so
+    # bring those up to date first.
+    deferred.defer(upgrade_posts, then=rebuild)
+  elif previous < BLOGGART_VERSION:
+    deferred.defer(rebuild)
+  if previous < (1, 0, 4):
+    # The admin page list is read from page summaries.
+    deferred.defer(upgrade_pages)
 
 post_deploy_tasks.append(regenerate_all)
 
 
+def regenerate_layouts(previous_version):
+  """Rewrites the layouts of fragment-assembled pages, picking up new chrome."""
+  # Each generation has its own copy of a layout.
+  names = set(x.name() for x in static.Layout.all(keys_only=True))
+  for name in sorted(names):
+    generators.regenerate_layout(name)
+
+if config.assembled_pages:
+  post_deploy_tasks.append(regenerate_layouts)
+
+
 def site_verification(previous_version):
   static.set('/' + config.google_site_verification,
              utils.render_template('site_verification.html'),
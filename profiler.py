@@ -0,0 +1,287 @@
+"""
+Per-request and per-task profiling of datastore, memcache and urlfetch calls.
+
+While a profile is running in a thread, every call to one of PROFILED_SERVICES
+is recorded with its duration, the stack of application code that made it,
+and its shape: the call with the values taken out (the kind and filtered
+properties of a query, the kinds of keys fetched, the memcache namespace, the
+host fetched from...). Calls with the same shape and origin made
+N_PLUS_ONE_THRESHOLD or more times are reported as N+1 candidates, since
+they can usually be replaced by one batch call.
+
+Profiling is switched on:
+  - for a request or task with a PROFILE_HEADER header. Only admins and the
+    task queue can profile requests.
+  - for a task and the tasks it starts, by deferring it with a 'profile' key
+    in its context; see tasks.py.
+  - for every request and task, for a while, from the admin profiles page.
+
+Finished profiles are logged, and the most recent RECENT_COUNT are kept in
+memcache for the admin profiles page.
+"""
+
+import logging
+import os
+import threading
+import time
+import traceback
+import urlparse
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.api import users
+
+
+PROFILED_SERVICES = ('datastore_v3', 'memcache', 'urlfetch')
+PROFILE_HEADER = 'X-Bloggart-Profile'
+N_PLUS_ONE_THRESHOLD = 3
+RECENT_COUNT = 20
+
+# Number of application stack frames kept as the origin of each call.
+ORIGIN_DEPTH = 3
+
+# How long instances may go without checking whether profiling everything has
+# been switched on.
+TOGGLE_CACHE_SECONDS = 10
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_LIB_DIR = os.path.join(APP_DIR, 'lib')
+_THIS_FILE = os.path.abspath(__file__).rstrip('co')
+
+_QUERY_OPERATORS = {1: '<', 2: '<=', 3: '>', 4: '>=', 5: '=', 6: 'IN',
+                    7: 'EXISTS'}
+
+_local = threading.local()
+_toggle = [0, 0]
+
+
+class Profile(object):
+  """The calls made while profiling one request or task."""
+
+  def __init__(self, name):
+    self.name = name
+    self.started = time.time()
+    self.finished = None
+    self.calls = []
+
+  def add(self, service, call, shape, seconds, origin):
+    self.calls.append((service, call, shape, seconds, origin))
+
+  def summary(self):
+    """Returns a dict summarizing the profile.
+
+    Returns:
+      A dict with the profile's name, start time, duration and number of
+      calls, 'by_call': a list of (service.call, count, ms) tuples, and
+      'candidates': a list of dicts describing N+1 candidates.
+    """
+    by_call = {}
+    by_shape = {}
+    for service, call, shape, seconds, origin in self.calls:
+      name = '%s.%s' % (service, call)
+      count, total = by_call.get(name, (0, 0.0))
+      by_call[name] = (count + 1, total + seconds)
+      key = (name, shape, origin)
+      count, total = by_shape.get(key, (0, 0.0))
+      by_shape[key] = (count + 1, total + seconds)
+    candidates = []
+    for (name, shape, origin), (count, total) in by_shape.iteritems():
+      if count >= N_PLUS_ONE_THRESHOLD:
+        candidates.append({
+            'call': name,
+            'shape': shape,
+            'origin': origin,
+            'count': count,
+            'ms': total * 1000,
+        })
+    candidates.sort(key=lambda x: x['count'], reverse=True)
+    return {
+        'name': self.name,
+        'started': self.started,
+        'ms': ((self.finished or time.time()) - self.started) * 1000,
+        'calls': len(self.calls),
+        'by_call': sorted([(name, count, total * 1000)
+                           for name, (count, total) in by_call.iteritems()],
+                          key=lambda x: x[2], reverse=True),
+        'candidates': candidates,
+    }
+
+
+def _origin():
+  """Returns the innermost application frames of the current stack."""
+  frames = []
+  for filename, line, function, text in traceback.extract_stack():
+    filename = os.path.abspath(filename)
+    if (filename.startswith(APP_DIR) and not filename.startswith(_LIB_DIR)
+        and filename != _THIS_FILE):
+      frames.append('%s:%d %s' % (filename[len(APP_DIR) + 1:], line,
+                                  function))
+  return tuple(frames[-ORIGIN_DEPTH:])
+
+
+def _shape(service, call, request):
+  """Returns a description of a call, without the values it uses."""
+  if service == 'datastore_v3':
+    if call == 'RunQuery':
+      filters = sorted('%s %s' % (x.property(0).name(),
+                                  _QUERY_OPERATORS.get(x.op(), x.op()))
+                       for x in request.filter_list())
+      orders = ['%s%s' % (x.direction() == 2 and '-' or '', x.property())
+                for x in request.order_list()]
+      shape = 'kind=%s' % request.kind()
+      if request.has_ancestor():
+        shape += ' ancestor'
+      if filters:
+        shape += ' filters=%s' % ', '.join(filters)
+      if orders:
+        shape += ' order=%s' % ', '.join(orders)
+      return shape
+    if call in ('Get', 'Delete'):
+      keys = request.key_list()
+    elif call == 'Put':
+      keys = [x.key() for x in request.entity_list()]
+    else:
+      return ''
+    kinds = set(x.path().element_list()[-1].type() for x in keys)
+    return 'kind=%s' % ', '.join(sorted(kinds))
+  elif service == 'memcache':
+    if hasattr(request, 'name_space'):
+      return 'namespace=%s' % request.name_space()
+    return ''
+  elif service == 'urlfetch':
+    return 'host=%s' % urlparse.urlparse(request.url())[1]
+  return ''
+
+
+def _pre_call(service, call, request, response):
+  profile = getattr(_local, 'profile', None)
+  if profile is None or service not in PROFILED_SERVICES:
+    return
+  _local.call_started = time.time()
+
+
+def _post_call(service, call, request, response):
+  profile = getattr(_local, 'profile', None)
+  if profile is None or service not in PROFILED_SERVICES:
+    return
+  seconds = time.time() - _local.call_started
+  profile.add(service, call, _shape(service, call, request), seconds,
+              _origin())
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('profiler', _pre_call)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('profiler', _post_call)
+
+
+def active():
+  """Returns True if the current thread is being profiled."""
+  return getattr(_local, 'profile', None) is not None
+
+
+def start(name):
+  """Starts profiling the current thread.
+
+  Returns:
+    False if the thread was already being profiled, True otherwise.
+  """
+  if active():
+    return False
+  _local.profile = Profile(name)
+  return True
+
+
+def stop():
+  """Stops profiling the current thread, and reports the profile.
+
+  Returns:
+    The profile's summary; see Profile.summary().
+  """
+  profile = _local.profile
+  # Reporting makes calls of its own, which shouldn't be profiled.
+  _local.profile = None
+  profile.finished = time.time()
+  summary = profile.summary()
+  report(summary)
+  return summary
+
+
+def run(name, func, *args, **kwargs):
+  """Calls func while profiling, unless the thread is already profiled."""
+  if not start(name):
+    return func(*args, **kwargs)
+  try:
+    return func(*args, **kwargs)
+  finally:
+    stop()
+
+
+def report(summary):
+  """Logs a profile summary, and keeps it for the admin profiles page."""
+  logging.info('Profile of %s: %d calls in %.0f ms: %s', summary['name'],
+               summary['calls'], summary['ms'],
+               ', '.join('%s x%d %.0f ms' % x for x in summary['by_call']))
+  for candidate in summary['candidates']:
+    logging.warn('Possible N+1 in %s: %s (%s) made %d times from %s',
+                 summary['name'], candidate['call'], candidate['shape'],
+                 candidate['count'], ' < '.join(reversed(candidate['origin'])))
+  recent = memcache.get('recent', namespace='profiler') or []
+  recent.insert(0, summary)
+  memcache.set('recent', recent[:RECENT_COUNT], namespace='profiler')
+
+
+def get_recent():
+  """Returns the summaries of the most recent profiles, newest first."""
+  return memcache.get('recent', namespace='profiler') or []
+
+
+def clear():
+  """Discards the summaries of recent profiles."""
+  memcache.delete('recent', namespace='profiler')
+
+
+def profile_everything(seconds):
+  """Profiles every request and task, on every instance, for a while.
+
+  Args:
+    seconds: How long to profile everything for; 0 to stop.
+  """
+  until = seconds and time.time() + seconds
+  memcache.set('until', until, namespace='profiler')
+  _toggle[:] = [time.time() + TOGGLE_CACHE_SECONDS, until]
+
+
+def profiling_everything_until():
+  """Returns when profiling everything stops, or 0 if it's not on."""
+  expires, until = _toggle
+  now = time.time()
+  if expires < now:
+    until = memcache.get('until', namespace='profiler') or 0
+    _toggle[:] = [now + TOGGLE_CACHE_SECONDS, until]
+  if until < now:
+    return 0
+  return until
+
+
+def _wants_profile(environ):
+  if environ.get('HTTP_' + PROFILE_HEADER.upper().replace('-', '_')):
+    # Only the task queue can set X-AppEngine headers.
+    return ('HTTP_X_APPENGINE_TASKNAME' in environ
+            or users.is_current_user_admin())
+  return bool(profiling_everything_until())
+
+
+def middleware(application):
+  """Wraps a WSGI application, profiling requests that ask for it.
+
+  Requests are profiled if they have a PROFILE_HEADER header and come from an
+  admin or the task queue, or if profile_everything() is in effect.
+  """
+  def profiled_application(environ, start_response):
+    if not _wants_profile(environ):
+      return application(environ, start_response)
+    name = '%s %s' % (environ.get('REQUEST_METHOD'),
+                      environ.get('PATH_INFO'))
+    task_name = environ.get('HTTP_X_APPENGINE_TASKNAME')
+    if task_name:
+      name += ' (task %s)' % task_name
+    return run(name, lambda: list(application(environ, start_response)))
+  return profiled_application
@@ -1,5 +1,9 @@
+import cPickle as pickle
 import datetime
 import hashlib
+import logging
+import threading
+import time
 
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
@@ -11,7 +15,12 @@ from google.appengine.ext.webapp import template
 from google.appengine.ext.webapp.util import run_wsgi_app
 
 import aetycoon
+import caching
 import config
+import jobs
+import profiler
+import stats
+import tasks
 import utils
 
 
@@ -22,42 +31,423 @@ if config.google_site_verification is not None:
 else:
     ROOT_ONLY_FILES = ['/robots.txt']
 
+LAYOUT_CACHE_SECONDS = 60
+
+# Cache miss coalescing; see get(). A request that misses memcache while
+# another instance is refilling the same path serves this instance's copy if
+# it is less than STALE_SECONDS old, or otherwise polls memcache for up to
+# LEASE_WAIT_SECONDS.
+LEASE_SECONDS = 5
+LEASE_WAIT_SECONDS = 1.0
+LEASE_POLL_SECONDS = 0.05
+STALE_SECONDS = 300
+STALE_CACHE_SIZE = 100
+
+# How long instances may keep using a cached Generation entity, and how long
+# the copy shared through memcache is kept.
+GENERATION_CACHE_SECONDS = 10
+GENERATION_MEMCACHE_SECONDS = 600
+
+# The task queue that build tasks run on; see finish_build().
+BUILD_QUEUE = 'rebuild'
+BUILD_POLL_SECONDS = 30
+
+# How long retired generations are kept after a switch.
+GARBAGE_COLLECTION_DELAY = 300
+
+
+def _content_etag(content):
+  digest = hashlib.sha1(content.body)
+  for fragment in content.fragments:
+    digest.update('\0')
+    digest.update(fragment)
+  return digest.hexdigest()
+
+
+def _to_blob(value):
+  if isinstance(value, unicode):
+    value = value.encode('utf-8')
+  return db.Blob(value)
+
+
+class LayoutError(Exception):
+  """Raised when fragment-assembled content can't be spliced into its layout."""
+
+
 class StaticContent(db.Model):
   """Container for statically served content.
 
   The serving path for content is provided in the key name.
+
+  Fragment-assembled pages have a layout, and instead of a body store the
+  fragments that are spliced into that layout's parts when served.
   """
   body = db.BlobProperty()
   content_type = db.StringProperty()
   status = db.IntegerProperty(required=True, default=200)
   last_modified = db.DateTimeProperty(required=True)
-  etag = aetycoon.DerivedProperty(lambda x: hashlib.sha1(x.body).hexdigest())
+  etag = aetycoon.DerivedProperty(_content_etag)
   indexed = db.BooleanProperty(required=True, default=True)
   headers = db.StringListProperty()
+  layout = db.StringProperty()
+  fragments = db.ListProperty(db.Blob)
+
+
+class Layout(db.Model):
+  """The page shell shared by fragment-assembled StaticContent.
+
+  The layout name is provided in the key name.
+  """
+  parts = db.ListProperty(db.Blob)
+  last_modified = db.DateTimeProperty(required=True)
+  version = aetycoon.DerivedProperty(
+      lambda x: hashlib.sha1('\0'.join(x.parts)).hexdigest())
+
+  def assemble(self, fragments):
+    """Returns a page body, or None if fragments don't fit this layout."""
+    parts = self.parts
+    if len(fragments) != len(parts) - 1:
+      return None
+    pieces = [parts[0]]
+    for i, fragment in enumerate(fragments):
+      pieces.append(fragment)
+      pieces.append(parts[i + 1])
+    return ''.join(pieces)
+
+
+class LayoutSource(db.Model):
+  """The template vals of a page that a Layout was rendered for.
+
+  The layout can be rendered again from these, when the templates change.
+  It has the same key name and parent as the layout; it's kept apart so
+  that the layouts that are cached and served don't carry it.
+  """
+  template_vals = db.BlobProperty()
+
+
+class Generation(db.Model):
+  """Records which generation of static content is served and which is built.
+
+  There is a single Generation entity, with the key name 'site'. Content in
+  generation 0 is stored in root entities keyed by path, as it was before
+  generations were introduced. Content in later generations is stored in
+  child entities of a 'StaticGeneration' key with the generation as its id.
+  """
+  current = db.IntegerProperty(required=True, default=0)
+  building = db.IntegerProperty()
+  retired = db.ListProperty(int)
+
+
+_generation = [0, None]
+
+
+def _cache_generation(generation):
+  _generation[:] = [time.time() + GENERATION_CACHE_SECONDS, generation]
+
+
+def _share_generation(generation):
+  """Caches a Generation entity that has just been changed."""
+  if not memcache.set('site', db.model_to_protobuf(generation).Encode(),
+                      time=GENERATION_MEMCACHE_SECONDS,
+                      namespace='generation'):
+    memcache.delete('site', namespace='generation')
+  _cache_generation(generation)
+
+
+def _get_shared_generation(fresh=False):
+  """Returns the Generation entity from memcache, or else the datastore.
+
+  Args:
+    fresh: If True, the entity is always read from the datastore.
+  """
+  data = not fresh and memcache.get('site', namespace='generation')
+  if data:
+    generation = db.model_from_protobuf(entity_pb.EntityProto(data))
+  else:
+    generation = (Generation.get_by_key_name('site')
+                  or Generation(key_name='site'))
+    # Don't overwrite a copy shared by a change made since the read.
+    memcache.add('site', db.model_to_protobuf(generation).Encode(),
+                 time=GENERATION_MEMCACHE_SECONDS, namespace='generation')
+  _cache_generation(generation)
+  return generation
+
+
+def get_generation(fresh=False):
+  """Returns the Generation entity.
+
+  Args:
+    fresh: If False, a copy up to GENERATION_CACHE_SECONDS old may be returned.
+  """
+  expires, generation = _generation
+  if fresh or not generation or expires < time.time():
+    generation = _get_shared_generation(fresh)
+  return generation
+
+
+def read_generation():
+  """Returns the generation content is read from in the current context."""
+  generation = tasks.get('generation')
+  if generation is None:
+    generation = get_generation().current
+  return generation
+
+
+def write_generations():
+  """Returns the generations content is written to in the current context.
+
+  Outside of a build, writes go to the current generation and to any
+  generation being built, so the latter doesn't miss changes made meanwhile.
+  Builds start and finish at any time, so this reads the Generation shared
+  through memcache rather than the copy cached in-process.
+  """
+  generation = tasks.get('generation')
+  if generation is not None:
+    return [generation]
+  generation = _get_shared_generation()
+  if generation.building is None:
+    return [generation.current]
+  return [generation.current, generation.building]
+
+
+def _generation_root(generation):
+  if not generation:
+    return None
+  return db.Key.from_path('StaticGeneration', generation)
+
+
+def generation_of(entity):
+  """Returns the generation a StaticContent or Layout belongs to."""
+  parent = entity.key().parent()
+  if parent is None:
+    return 0
+  return parent.id()
+
+
+def _cache_key(name, generation):
+  if not generation:
+    return name
+  return '%d:%s' % (generation, name)
+
+
+_layouts = {}
+
+
+def get_layout(name, generation=None):
+  """Returns the Layout with the provided name, or None if there isn't one.
+
+  Layouts are shared by many pages, so they're also cached in-process for
+  LAYOUT_CACHE_SECONDS.
+
+  Args:
+    name: The layout name.
+    generation: The generation to read from. Defaults to read_generation().
+  """
+  if generation is None:
+    generation = read_generation()
+  cache_key = _cache_key(name, generation)
+  now = time.time()
+  cached = _layouts.get(cache_key)
+  if cached and cached[0] > now:
+    return cached[1]
+  layout = memcache.get(cache_key, namespace='layout')
+  if layout:
+    layout = db.model_from_protobuf(entity_pb.EntityProto(layout))
+  else:
+    layout = Layout.get_by_key_name(name, parent=_generation_root(generation))
+    if layout:
+      memcache.set(cache_key, db.model_to_protobuf(layout).Encode(),
+                   namespace='layout')
+  if layout:
+    _layouts[cache_key] = (now + LAYOUT_CACHE_SECONDS, layout)
+  return layout
+
+
+def set_layout(name, parts, template_vals=None):
+  """Stores the shell for fragment-assembled pages, if it has changed.
+
+  Args:
+    name: The layout name.
+    parts: A list of the pieces of page that fragments are spliced between.
+    template_vals: The template vals the parts were rendered from, stored
+      with the layout so that it can be rendered again; see LayoutSource.
+  Returns:
+    A Layout object.
+  """
+  parts = [_to_blob(x) for x in parts]
+  version = hashlib.sha1('\0'.join(parts)).hexdigest()
+  now = datetime.datetime.now().replace(second=0, microsecond=0)
+  source = None
+  layout = None
+  for generation in write_generations():
+    current = get_layout(name, generation)
+    if current and current.version == version:
+      layout = current
+      continue
+    if source is None:
+      try:
+        source = db.Blob(pickle.dumps(template_vals, pickle.HIGHEST_PROTOCOL))
+      except (pickle.PicklingError, TypeError), e:
+        logging.warn("Layout %s can't be rendered again: %s", name, e)
+        source = db.Blob(pickle.dumps(None))
+    root = _generation_root(generation)
+    layout = Layout(key_name=name, parent=root, parts=parts,
+                    last_modified=now)
+    db.put([layout, LayoutSource(key_name=name, parent=root,
+                                 template_vals=source)])
+    cache_key = _cache_key(name, generation)
+    memcache.set(cache_key, db.model_to_protobuf(layout).Encode(),
+                 namespace='layout')
+    _layouts[cache_key] = (time.time() + LAYOUT_CACHE_SECONDS, layout)
+  return layout
+
+
+def get_layout_vals(name, generation=None):
+  """Returns the template vals a layout was rendered from, or None.
+
+  Args:
+    name: The layout name.
+    generation: The generation to read from. Defaults to read_generation().
+  """
+  if generation is None:
+    generation = read_generation()
+  source = LayoutSource.get_by_key_name(
+      name, parent=_generation_root(generation))
+  if not source or not source.template_vals:
+    return None
+  return pickle.loads(source.template_vals)
 
 
-def get(path):
+@stats.timed(lambda path, *args, **kwargs: ('static.get', path))
+def get(path, generation=None):
   """Returns the StaticContent object for the provided path.
 
+  Concurrent cache misses for the same path are coalesced, so that only one
+  request per instance, and normally only one request across all instances,
+  reads the content from the datastore; see _fetch_once() and _fetch().
+
   Args:
     path: The path to retrieve StaticContent for.
+    generation: The generation to read from. Defaults to read_generation().
   Returns:
     A StaticContent object, or None if no content exists for this path.
   """
-  entity = memcache.get(path)
+  if generation is None:
+    generation = read_generation()
+  cache_key = _cache_key(path, generation)
+  data = memcache.get(cache_key)
+  stats.hit('static.get memcache', data)
+  if data:
+    _stale.set(cache_key, (time.time(), data))
+    return db.model_from_protobuf(entity_pb.EntityProto(data))
+  return _fetch_once(path, generation, cache_key)
+
+
+class _Flight(object):
+  """A datastore fetch that concurrent requests in this instance can share."""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+_stale = caching.LRUCache(STALE_CACHE_SIZE)
+
+
+def _fetch_once(path, generation, cache_key):
+  """Fetches content for a cache miss, sharing the fetch with other threads."""
+  _flights_lock.acquire()
+  try:
+    flight = _flights.get(cache_key)
+    leader = flight is None
+    if leader:
+      flight = _flights[cache_key] = _Flight()
+  finally:
+    _flights_lock.release()
+
+  if not leader:
+    flight.done.wait(LEASE_WAIT_SECONDS)
+    stats.hit('static.get coalesced', flight.done.isSet())
+    if flight.done.isSet():
+      _count('coalesced_local')
+      return flight.result
+    return _fetch(path, generation, cache_key)
+
+  try:
+    flight.result = _fetch(path, generation, cache_key)
+    return flight.result
+  finally:
+    flight.done.set()
+    _flights_lock.acquire()
+    try:
+      del _flights[cache_key]
+    finally:
+      _flights_lock.release()
+
+
+def _fetch(path, generation, cache_key):
+  """Fetches content for a cache miss and refills memcache.
+
+  A memcache lease stops other instances from fetching the same content at
+  the same time. Requests that don't get the lease serve a recently seen copy
+  if this instance has one, or wait briefly for the lease holder to refill
+  memcache, before giving up and fetching the content themselves.
+  """
+  lease_key = 'lease:' + cache_key
+  if not memcache.add(lease_key, 1, time=LEASE_SECONDS):
+    stale = _stale.get(cache_key)
+    fresh_enough = stale and stale[0] > time.time() - STALE_SECONDS
+    stats.hit('static.get stale copy', fresh_enough)
+    if fresh_enough:
+      _count('stale_served')
+      return db.model_from_protobuf(entity_pb.EntityProto(stale[1]))
+    deadline = time.time() + LEASE_WAIT_SECONDS
+    while time.time() < deadline:
+      time.sleep(LEASE_POLL_SECONDS)
+      data = memcache.get(cache_key)
+      if data:
+        _count('coalesced_remote')
+        return db.model_from_protobuf(entity_pb.EntityProto(data))
+    _count('lease_timeout')
+    lease_key = None
+
+  entity = StaticContent.get_by_key_name(
+      path, parent=_generation_root(generation))
+  stats.hit('static.get datastore', entity)
   if entity:
-    entity = db.model_from_protobuf(entity_pb.EntityProto(entity))
+    data = db.model_to_protobuf(entity).Encode()
+    memcache.set(cache_key, data)
+    _stale.set(cache_key, (time.time(), data))
   else:
-    entity = StaticContent.get_by_key_name(path)
-    if entity:
-      memcache.set(path, db.model_to_protobuf(entity).Encode())
-
+    # The content was removed, perhaps by another instance.
+    _stale.delete(cache_key)
+  if lease_key:
+    memcache.delete(lease_key)
   return entity
 
 
+def _count(name):
+  memcache.incr(name, namespace='static-counters', initial_value=0)
+
+
+def get_counters():
+  """Returns a dict of the cache miss coalescing counters."""
+  names = ('coalesced_local', 'coalesced_remote', 'stale_served',
+           'lease_timeout')
+  counters = memcache.get_multi(names, namespace='static-counters')
+  return dict((x, int(counters.get(x, 0))) for x in names)
+
+
+@stats.timed(lambda path, *args, **kwargs: ('static.set', path))
 def set(path, body, content_type, indexed=True, **kwargs):
   """Sets the StaticContent for the provided path.
 
+  The content is written to each of write_generations(). As part of a job,
+  content that is the same as in the generation being served is copied from
+  it instead, and counted as skipped.
+
   Args:
     path: The path to store the content against.
     body: The data to serve for that path.
@@ -72,69 +462,331 @@ def set(path, body, content_type, indexed=True, **kwargs):
     "last_modified": now,
   }
   defaults.update(kwargs)
-  content = StaticContent(
-      key_name=path,
-      body=str(body),
-      content_type=content_type,
-      indexed=indexed,
-      **defaults)
-  content.put()
-  memcache.replace(path, db.model_to_protobuf(content).Encode())
+  if 'fragments' in defaults:
+    defaults['fragments'] = [_to_blob(x) for x in defaults['fragments']]
+  generations = write_generations()
+  existing = None
+  if jobs.current() is not None:
+    # Rebuilds write to a new, empty generation, so compare with the one
+    # being served.
+    source = get_generation().current
+    existing = _unchanged(path, source, {
+        'body': str(body),
+        'content_type': content_type,
+        'indexed': indexed,
+        'status': defaults.get('status', 200),
+        'headers': defaults.get('headers', []),
+        'layout': defaults.get('layout'),
+        'fragments': defaults.get('fragments', []),
+    })
+    if existing:
+      jobs.count('skipped')
+      # Copy the content, as it was last modified, into the other
+      # generations being written.
+      defaults['last_modified'] = existing.last_modified
+      generations = [x for x in generations if x != source]
+      if not generations:
+        return existing
+  entities = []
+  for generation in generations:
+    entities.append(StaticContent(
+        key_name=path,
+        parent=_generation_root(generation),
+        body=str(body),
+        content_type=content_type,
+        indexed=indexed,
+        **defaults))
+  db.put(entities)
+  # Write through, so the first visitors after a change don't all miss.
+  cached = dict(
+      (_cache_key(path, generation_of(x)), db.model_to_protobuf(x).Encode())
+      for x in entities)
+  memcache.set_multi(cached)
+  for cache_key, data in cached.iteritems():
+    _stale.set(cache_key, (time.time(), data))
   try:
     eta = now.replace(second=0, microsecond=0) + datetime.timedelta(seconds=65)
-    if indexed:
+    # Builds regenerate their sitemap when they finish.
+    if indexed and not existing and tasks.get('generation') is None:
       deferred.defer(
           utils._regenerate_sitemap,
           _name='sitemap-%s' % (now.strftime('%Y%m%d%H%M'),),
           _eta=eta)
   except (taskqueue.taskqueue.TaskAlreadyExistsError, taskqueue.taskqueue.TombstonedTaskError), e:
     pass
+  return entities[0]
+
+def _unchanged(path, generation, values):
+  """Returns the content at a path in a generation if it has these values.
+
+  Returns:
+    The StaticContent, or None if there isn't any or it has different values.
+  """
+  content = get(path, generation)
+  if content is None:
+    return None
+  for name, value in values.iteritems():
+    if getattr(content, name) != value:
+      return None
   return content
 
+
 def add(path, body, content_type, indexed=True, **kwargs):
   """Adds a new StaticContent and returns it.
 
+  Only the first of write_generations() is checked for existing content.
+
   Args:
     As per set().
   Returns:
     A StaticContent object, or None if one already exists at the given path.
   """
+  generations = write_generations()
   def _tx():
-    if StaticContent.get_by_key_name(path):
+    if StaticContent.get_by_key_name(
+        path, parent=_generation_root(generations[0])):
       return None
-    return set(path, body, content_type, indexed, **kwargs)
-  return db.run_in_transaction(_tx)
+    return tasks.run({'generation': generations[0]},
+                     set, path, body, content_type, indexed, **kwargs)
+  content = db.run_in_transaction(_tx)
+  if content:
+    for generation in generations[1:]:
+      tasks.run({'generation': generation},
+                set, path, body, content_type, indexed, **kwargs)
+  return content
+
+
+def add_first(paths, body, content_type, indexed=True, **kwargs):
+  """Adds a new StaticContent at the first of several paths that is free.
+
+  All the paths are looked up in one batch get, and only the free ones are
+  tried, each in a transaction as per add().
+
+  Args:
+    paths: A list of candidate paths, in order of preference.
+    Others as per set().
+  Returns:
+    A (path, StaticContent) tuple, or (None, None) if every path is taken.
+  """
+  root = _generation_root(write_generations()[0])
+  existing = db.get([db.Key.from_path('StaticContent', path, parent=root)
+                     for path in paths])
+  for path, entity in zip(paths, existing):
+    if entity is None:
+      content = add(path, body, content_type, indexed, **kwargs)
+      if content:
+        return path, content
+  return None, None
+
 
 def remove(path):
-  """Deletes a StaticContent.
+  """Deletes a StaticContent from each of write_generations().
 
   Args:
     path: Path of the static content to be removed.
   """
-  memcache.delete(path)
+  def _tx(generation):
+    content = StaticContent.get_by_key_name(
+        path, parent=_generation_root(generation))
+    if content:
+      content.delete()
+  for generation in write_generations():
+    db.run_in_transaction(_tx, generation)
+    # Evict the copies get() would otherwise serve, including the stale one
+    # kept for coalesced cache misses.
+    cache_key = _cache_key(path, generation)
+    memcache.delete(cache_key)
+    _stale.delete(cache_key)
+
+
+def warm(paths, generation=None):
+  """Loads content into memcache ahead of demand.
+
+  Args:
+    paths: The paths to load.
+    generation: The generation to read from. Defaults to read_generation().
+  Returns:
+    The number of paths that had to be loaded from the datastore.
+  """
+  if generation is None:
+    generation = read_generation()
+  cache_keys = dict((_cache_key(x, generation), x) for x in paths)
+  cached = memcache.get_multi(cache_keys.keys())
+  missing = [x for x in cache_keys if x not in cached]
+  if not missing:
+    return 0
+  root = _generation_root(generation)
+  entities = db.get([
+      db.Key.from_path('StaticContent', cache_keys[x], parent=root)
+      for x in missing])
+  memcache.set_multi(dict(
+      (key, db.model_to_protobuf(entity).Encode())
+      for key, entity in zip(missing, entities) if entity))
+  return len(missing)
+
+
+def get_all_paths(generation=None):
+  """Returns the paths of all indexed content in a generation.
+
+  Args:
+    generation: The generation to list. Defaults to read_generation().
+  """
+  if generation is None:
+    generation = read_generation()
+  root = _generation_root(generation)
+  def _query():
+    q = StaticContent.all(keys_only=True).filter('indexed', True)
+    if root:
+      q.ancestor(root)
+    return q
+  keys = []
+  q = _query()
+  cur = q.fetch(1000)
+  while len(cur) == 1000:
+    keys.extend(cur)
+    q = _query()
+    q.filter('__key__ >', cur[-1])
+    cur = q.fetch(1000)
+  keys.extend(cur)
+  # Generation 0 is stored in root entities.
+  return [x.name() for x in keys if root or not x.parent()]
+
+
+def start_build():
+  """Starts building a new generation of static content.
+
+  Content written in a task context with this generation (see tasks.py) goes
+  only to the new generation, and content written outside a build goes to it
+  as well as to the current generation. A build that was already in progress
+  is abandoned.
+
+  Returns:
+    The id of the new generation.
+  """
   def _tx():
-    content = StaticContent.get_by_key_name(path)
-    if not content:
-      return
-    content.delete()
-  return db.run_in_transaction(_tx)
+    generation = (Generation.get_by_key_name('site')
+                  or Generation(key_name='site'))
+    if generation.building is not None:
+      generation.retired.append(generation.building)
+    generation.building = max([generation.current] + generation.retired) + 1
+    generation.put()
+    return generation
+  generation = db.run_in_transaction(_tx)
+  _share_generation(generation)
+  return generation.building
+
+
+def finish_build(generation, job_id, idle_checks=0):
+  """Makes a generation current once all of its build tasks have run.
+
+  The build is complete when the job tracking it has no tasks in flight and
+  its queue, BUILD_QUEUE, is empty, twice in a row: counts are written when
+  each task finishes, so a task's children can be counted done before it's
+  counted done itself. Until then this re-defers itself.
+
+  Args:
+    generation: The id of the generation being built.
+    job_id: The id of the jobs.Job tracking the build.
+    idle_checks: The number of consecutive times the build was found idle.
+  """
+  if get_generation(fresh=True).building != generation:
+    # Abandoned in favour of a newer build
+    jobs.finish(job_id)
+    return
+  progress = jobs.get_progress(jobs.Job.get_by_id(job_id))
+  queue_stats = taskqueue.QueueStatistics.fetch(taskqueue.Queue(BUILD_QUEUE))
+  if (progress['in_flight'] or queue_stats.tasks
+      or queue_stats.in_flight):
+    idle_checks = 0
+  else:
+    idle_checks += 1
+  if idle_checks < 2:
+    deferred.defer(finish_build, generation, job_id, idle_checks,
+                   _countdown=BUILD_POLL_SECONDS)
+    return
+
+  tasks.run({'generation': generation}, utils._regenerate_sitemap)
+
+  def _tx():
+    site = Generation.get_by_key_name('site')
+    if site.building != generation:
+      return None
+    site.retired.append(site.current)
+    site.current = generation
+    site.building = None
+    site.put()
+    return site
+  site = db.run_in_transaction(_tx)
+  if site:
+    _share_generation(site)
+    logging.info('Generation %d of static content is now current', generation)
+    jobs.finish(job_id)
+    # Leave instances with a cached Generation time to notice the switch.
+    deferred.defer(collect_garbage, _countdown=GARBAGE_COLLECTION_DELAY)
+
+
+def collect_garbage(batch_size=500):
+  """Deletes the content of retired generations, a batch at a time."""
+  site = get_generation(fresh=True)
+  if not site.retired:
+    return
+  generation = site.retired[0]
+  root = _generation_root(generation)
+  if root:
+    keys = db.Query(keys_only=True).ancestor(root).fetch(batch_size)
+  else:
+    # Root entities sort before any StaticGeneration descendants.
+    keys = []
+    for model in (StaticContent, Layout, LayoutSource):
+      keys.extend(x for x in model.all(keys_only=True).fetch(batch_size)
+                  if not x.parent())
+  if keys:
+    db.delete(keys)
+    deferred.defer(collect_garbage, batch_size)
+    return
+
+  def _tx():
+    site = Generation.get_by_key_name('site')
+    if generation in site.retired:
+      site.retired.remove(generation)
+      site.put()
+    return site
+  _share_generation(db.run_in_transaction(_tx))
+  if site.retired[1:]:
+    deferred.defer(collect_garbage, batch_size)
+
 
 class StaticContentHandler(webapp.RequestHandler):
-  def output_content(self, content, serve=True):
+  def output_content(self, content, serve=True, resolved=None):
+    body, etag, last_modified = resolved or self.resolve(content)
     if content.content_type:
       self.response.headers['Content-Type'] = content.content_type
-    last_modified = content.last_modified.strftime(HTTP_DATE_FMT)
-    self.response.headers['Last-Modified'] = last_modified
-    self.response.headers['ETag'] = '"%s"' % (content.etag,)
+    self.response.headers['Last-Modified'] = last_modified.strftime(HTTP_DATE_FMT)
+    self.response.headers['ETag'] = '"%s"' % (etag,)
     for header in content.headers:
       key, value = header.split(':', 1)
       self.response.headers[key] = value.strip()
     if serve:
       self.response.set_status(content.status)
-      self.response.out.write(content.body)
+      self.response.out.write(body)
     else:
       self.response.set_status(304)
 
+  def resolve(self, content):
+    """Returns the (body, etag, last_modified) to serve for some content.
+
+    Fragment-assembled content is spliced into its layout here, and its etag
+    combines the layout and fragment versions.
+    """
+    if not content.layout:
+      return content.body, content.etag, content.last_modified
+    layout = get_layout(content.layout, generation_of(content))
+    body = layout and layout.assemble(content.fragments)
+    if body is None:
+      raise LayoutError(content.layout)
+    return (body, '%s-%s' % (layout.version, content.etag),
+            max(layout.last_modified, content.last_modified))
+
   def get(self, path):
     if not path.startswith(config.url_prefix):
       if path not in ROOT_ONLY_FILES:
@@ -153,6 +805,12 @@ class StaticContentHandler(webapp.RequestHandler):
       self.error(404)
       self.response.out.write(utils.render_template('404.html'))
       return
+    try:
+      resolved = self.resolve(content)
+    except LayoutError, e:
+      logging.error('Missing or mismatched layout %r for %s', e.args[0], path)
+      self.error(500)
+      return
 
     serve = True
     if 'If-Modified-Since' in self.request.headers:
@@ -160,7 +818,7 @@ class StaticContentHandler(webapp.RequestHandler):
         last_seen = datetime.datetime.strptime(
             self.request.headers['If-Modified-Since'].split(';')[0],# IE8 '; length=XXXX' as extra arg bug
             HTTP_DATE_FMT)
-        if last_seen >= content.last_modified.replace(microsecond=0):
+        if last_seen >= resolved[2].replace(microsecond=0):
           serve = False
       except ValueError, e:
         import logging
@@ -168,9 +826,9 @@ class StaticContentHandler(webapp.RequestHandler):
     if 'If-None-Match' in self.request.headers:
       etags = [x.strip('" ')
                for x in self.request.headers['If-None-Match'].split(',')]
-      if content.etag in etags:
+      if resolved[1] in etags:
         serve = False
-    self.output_content(content, serve)
+    self.output_content(content, serve, resolved)
 
 
 application = webapp.WSGIApplication([
@@ -179,7 +837,7 @@ application = webapp.WSGIApplication([
 
 
 def main():
-  run_wsgi_app(application)
+  run_wsgi_app(profiler.middleware(application))
 
 
 if __name__ == '__main__':
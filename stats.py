@@ -0,0 +1,326 @@
+"""
+Sampled timings and hit rates for the hot paths of serving and generating.
+
+Instrumented code records spans, which time a named stage and optionally the
+resource (path, template, post...) it worked on, and hits, which count
+whether a cache tier had what was asked of it. A fraction
+config.stats_sample_rate of spans and hits are recorded; at the default of 0
+each instrumented call costs one check of a module global, and no API call
+hooks are installed.
+
+Each instance aggregates what it records in memory. Every FLUSH_SECONDS the
+aggregates are handed to a deferred task, which merges them into one of
+NUM_SHARDS StatsShard entities; the admin stats page merges the shards with
+the aggregates of the instance serving it.
+"""
+
+import bisect
+import logging
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+import aetycoon
+import config
+
+
+NUM_SHARDS = 10
+FLUSH_SECONDS = 60
+
+# Upper bounds of the histogram buckets, in milliseconds. There is one more
+# bucket, for anything slower.
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+# The number of slowest resources kept for each span.
+SLOWEST_COUNT = 10
+
+_rate = config.stats_sample_rate
+
+
+class StatsShard(db.Model):
+  """Aggregated spans and hits, merged from many instances' flushes."""
+  spans = aetycoon.PickleProperty()
+  hits = aetycoon.PickleProperty()
+  created = db.DateTimeProperty(auto_now_add=True)
+
+
+_lock = threading.Lock()
+_local = threading.local()
+# Maps span name -> aggregate; see _new_span().
+_spans = {}
+# Maps hit name -> [hits, misses].
+_hits = {}
+_next_flush = time.time() + FLUSH_SECONDS
+
+
+def sampled():
+  """Returns True if the current span or hit should be recorded."""
+  return _rate and (_rate >= 1 or random.random() < _rate)
+
+
+def _new_span():
+  return {
+      'count': 0,
+      'total': 0.0,
+      'max': 0.0,
+      'buckets': [0] * (len(BUCKETS) + 1),
+      'slowest': [],
+  }
+
+
+def _merge_slowest(slowest, entries):
+  """Returns the slowest SLOWEST_COUNT (seconds, resource) of two lists."""
+  worst = dict((resource, seconds) for seconds, resource in slowest)
+  for seconds, resource in entries:
+    if seconds > worst.get(resource, -1):
+      worst[resource] = seconds
+  merged = sorted(((s, r) for r, s in worst.iteritems()), reverse=True)
+  return merged[:SLOWEST_COUNT]
+
+
+def merge(spans, hits, other_spans, other_hits):
+  """Merges one set of aggregates into another, in place."""
+  for name, other in other_spans.iteritems():
+    span = spans.setdefault(name, _new_span())
+    span['count'] += other['count']
+    span['total'] += other['total']
+    span['max'] = max(span['max'], other['max'])
+    span['buckets'] = [a + b for a, b in zip(span['buckets'],
+                                             other['buckets'])]
+    span['slowest'] = _merge_slowest(span['slowest'], other['slowest'])
+  for name, (found, missed) in other_hits.iteritems():
+    counts = hits.setdefault(name, [0, 0])
+    counts[0] += found
+    counts[1] += missed
+
+
+def record(name, seconds, resource=None):
+  """Records a span that was sampled."""
+  if resource is not None and not isinstance(resource, basestring):
+    resource = str(resource)
+  _lock.acquire()
+  try:
+    span = _spans.get(name)
+    if span is None:
+      span = _spans[name] = _new_span()
+    span['count'] += 1
+    span['total'] += seconds
+    span['max'] = max(span['max'], seconds)
+    span['buckets'][bisect.bisect_left(BUCKETS, seconds * 1000)] += 1
+    if resource is not None:
+      span['slowest'] = _merge_slowest(span['slowest'], [(seconds, resource)])
+  finally:
+    _lock.release()
+  _maybe_flush()
+
+
+def start(name, resource=None):
+  """Starts timing a span.
+
+  Returns:
+    An object to pass to finish(), or None if this span isn't sampled.
+  """
+  if not sampled():
+    return None
+  return (name, resource, time.time())
+
+
+def finish(span):
+  """Finishes timing a span returned by start()."""
+  if span:
+    name, resource, started = span
+    record(name, time.time() - started, resource)
+
+
+def timed(name):
+  """Decorates a function so calls to it are recorded as spans.
+
+  Args:
+    name: The span name, or a function that takes the decorated function's
+      arguments and returns a (name, resource) tuple.
+  """
+  def decorate(func):
+    def wrapper(*args, **kwargs):
+      if not sampled():
+        return func(*args, **kwargs)
+      if callable(name):
+        span_name, resource = name(*args, **kwargs)
+      else:
+        span_name, resource = name, None
+      started = time.time()
+      try:
+        return func(*args, **kwargs)
+      finally:
+        record(span_name, time.time() - started, resource)
+    # Deferred tasks find methods by name, so keep it.
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    wrapper.__module__ = func.__module__
+    return wrapper
+  return decorate
+
+
+def hit(name, found, count=1):
+  """Records whether a cache tier had what was asked of it, if sampled."""
+  if not sampled():
+    return
+  _lock.acquire()
+  try:
+    counts = _hits.get(name)
+    if counts is None:
+      counts = _hits[name] = [0, 0]
+    if found:
+      counts[0] += count
+    else:
+      counts[1] += count
+  finally:
+    _lock.release()
+
+
+def _pre_call(service, call, request, response):
+  if sampled():
+    _local.rpc = time.time()
+
+
+def _post_call(service, call, request, response):
+  started = getattr(_local, 'rpc', None)
+  if started is None:
+    return
+  _local.rpc = None
+  resource = None
+  if call == 'RunQuery':
+    resource = request.kind()
+  record('datastore.%s' % call, time.time() - started, resource)
+
+if _rate:
+  apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+      'stats', _pre_call, 'datastore_v3')
+  apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+      'stats', _post_call, 'datastore_v3')
+
+
+def _take():
+  """Returns this instance's aggregates, and starts new ones."""
+  global _spans, _hits
+  _lock.acquire()
+  try:
+    spans, hits = _spans, _hits
+    _spans, _hits = {}, {}
+  finally:
+    _lock.release()
+  return spans, hits
+
+
+def _maybe_flush():
+  global _next_flush
+  now = time.time()
+  if now < _next_flush:
+    return
+  _next_flush = now + FLUSH_SECONDS
+  spans, hits = _take()
+  if not spans and not hits:
+    return
+  try:
+    # Flushing from a task keeps datastore transactions out of the code
+    # being measured, which may itself be in a transaction.
+    deferred.defer(_merge_into_shard, spans, hits)
+  except Exception, e:
+    logging.warn('Discarding stats that could not be flushed: %s', e)
+
+
+def _merge_into_shard(spans, hits):
+  def _tx():
+    key_name = 'shard-%d' % random.randrange(NUM_SHARDS)
+    shard = StatsShard.get_by_key_name(key_name)
+    if shard is None:
+      shard = StatsShard(key_name=key_name, spans={}, hits={})
+    merge(shard.spans, shard.hits, spans, hits)
+    shard.put()
+  db.run_in_transaction(_tx)
+
+
+def load():
+  """Returns (spans, hits, since) for every instance's flushed aggregates.
+
+  The aggregates of this instance that have not been flushed yet are
+  included.
+  """
+  spans, hits = {}, {}
+  since = None
+  shard_names = ['shard-%d' % i for i in range(NUM_SHARDS)]
+  for shard in StatsShard.get_by_key_name(shard_names):
+    if shard is None:
+      continue
+    merge(spans, hits, shard.spans, shard.hits)
+    if since is None or shard.created < since:
+      since = shard.created
+  _lock.acquire()
+  try:
+    merge(spans, hits, _spans, _hits)
+  finally:
+    _lock.release()
+  return spans, hits, since
+
+
+def reset():
+  """Discards all aggregates."""
+  _take()
+  db.delete([db.Key.from_path('StatsShard', 'shard-%d' % i)
+             for i in range(NUM_SHARDS)])
+
+
+def bucket_label(index):
+  if index < len(BUCKETS):
+    return 'up to %d ms' % BUCKETS[index]
+  return 'over %d ms' % BUCKETS[-1]
+
+
+def percentile(buckets, p):
+  """Returns the label of the bucket the p'th percentile (0-100) is in."""
+  target = sum(buckets) * p / 100.0
+  seen = 0
+  for i, count in enumerate(buckets):
+    seen += count
+    if count and seen >= target:
+      return bucket_label(i)
+  return None
+
+
+def summarize(spans, hits):
+  """Returns template values for the admin stats page."""
+  span_rows = []
+  for name, span in spans.iteritems():
+    largest = max(span['buckets']) or 1
+    span_rows.append({
+        'name': name,
+        'count': span['count'],
+        'total_ms': span['total'] * 1000,
+        'mean_ms': span['total'] * 1000 / span['count'],
+        'max_ms': span['max'] * 1000,
+        'p50': percentile(span['buckets'], 50),
+        'p90': percentile(span['buckets'], 90),
+        'p99': percentile(span['buckets'], 99),
+        'histogram': [{'label': bucket_label(i), 'count': count,
+                       'width': count * 200 / largest}
+                      for i, count in enumerate(span['buckets'])],
+        'slowest': [{'resource': r, 'ms': s * 1000}
+                    for s, r in span['slowest']],
+    })
+  span_rows.sort(key=lambda x: x['total_ms'], reverse=True)
+  hit_rows = []
+  for name, (found, missed) in sorted(hits.iteritems()):
+    hit_rows.append({
+        'name': name,
+        'hits': found,
+        'misses': missed,
+        'rate': found * 100.0 / ((found + missed) or 1),
+    })
+  return {
+      'sample_rate': _rate,
+      'spans': span_rows,
+      'hits': hit_rows,
+  }
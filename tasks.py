@@ -0,0 +1,99 @@
+"""
+Deferred task helpers that carry a context on to the tasks they start.
+
+A site rebuild fans out into many deferred tasks (each listing page defers
+the next one, and so on), and all of them need to know which rebuild they
+belong to. Tasks started with defer() run with the same context as the task
+or request that started them; defer_in() starts a task with a new context.
+
+Context keys in use:
+  generation: The generation of static content that writes go to.
+  job: The id of the jobs.Job that tasks count towards.
+  profile: If true, tasks' datastore, memcache and urlfetch calls are
+      profiled; see profiler.py.
+  queue: The task queue that child tasks are added to.
+"""
+
+import threading
+import types
+
+from google.appengine.ext import deferred
+
+
+class _Local(threading.local):
+  def __init__(self):
+    self.context = {}
+
+_local = _Local()
+
+
+def get(name, default=None):
+  """Returns a value from the current context."""
+  return _local.context.get(name, default)
+
+
+def current():
+  """Returns a copy of the current context."""
+  return dict(_local.context)
+
+
+def run(context, func, *args, **kwargs):
+  """Calls func with the provided context in effect."""
+  old_context = _local.context
+  _local.context = context
+  try:
+    if context.get('profile'):
+      import profiler
+      return profiler.run(_describe(func, args), func, *args, **kwargs)
+    return func(*args, **kwargs)
+  finally:
+    _local.context = old_context
+
+
+def _describe(func, args):
+  if func is deferred.invoke_member:
+    return 'task %s.%s' % (type(args[0]).__name__, args[1])
+  return 'task %s.%s' % (func.__module__, func.__name__)
+
+
+def defer_in(context, func, *args, **kwargs):
+  """Defers func, to be run with the provided context.
+
+  Arguments are as per deferred.defer(). Unless one is given, the task is
+  added to the queue named in the context.
+  """
+  if not context:
+    return deferred.defer(func, *args, **kwargs)
+  if isinstance(func, types.MethodType):
+    # deferred only knows how to pickle the method it's given directly, not
+    # one passed on as an argument to run().
+    args = (func.im_self, func.im_func.__name__) + args
+    func = deferred.invoke_member
+  if context.get('queue'):
+    kwargs.setdefault('_queue', context['queue'])
+  if context.get('job') is None:
+    return deferred.defer(run, context, func, *args, **kwargs)
+  import jobs
+  task = deferred.defer(_run_job_task, context, func, *args, **kwargs)
+  jobs.count('tasks_enqueued', job_id=context['job'])
+  return task
+
+
+def _run_job_task(context, func, *args, **kwargs):
+  """Runs a deferred task that is part of a job, counting it towards it."""
+  import jobs
+  try:
+    try:
+      result = run(context, func, *args, **kwargs)
+    except:
+      jobs.count('task_errors', job_id=context['job'])
+      raise
+    jobs.count('tasks_done', job_id=context['job'])
+    return result
+  finally:
+    jobs.flush()
+
+
+def defer(func, *args, **kwargs):
+  """Defers func, to be run with the current context."""
+  return defer_in(current(), func, *args, **kwargs)
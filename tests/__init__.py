@@ -0,0 +1,16 @@
+"""
+Tests for the application.
+
+Run from the application directory, with the App Engine SDK at
+$APPENGINE_SDK (as for the benchmarks):
+
+  python -m unittest discover -s tests -t .
+
+Importing this package puts the SDK and the application on sys.path, and
+installs in-memory service stubs; tests that need a clean datastore or
+memcache call benchmarks.common.setup_stubs() in setUp().
+"""
+
+from benchmarks import common
+
+common.setup()
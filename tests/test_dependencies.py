@@ -0,0 +1,45 @@
+import cPickle as pickle
+import hashlib
+import unittest
+
+import dependencies
+
+
+ETAG = hashlib.sha1('post').hexdigest()
+
+
+class EncodingTest(unittest.TestCase):
+  def assertRoundTrips(self, deps):
+    self.assertEqual(dependencies.decode(dependencies.encode(deps)), deps)
+
+  def test_round_trip(self):
+    self.assertRoundTrips({
+        'PostContentGenerator': (set([5629499534213120]), ETAG),
+        'TagsContentGenerator': (set([u'python', u'caf\xe9']), ETAG),
+        'IndexContentGenerator': (set(['index']), ETAG),
+        'ArchiveIndexContentGenerator': (set(), None),
+        'SomeOtherGenerator': (set([1, 'a']), 'not a digest'),
+    })
+
+  def test_empty_resource(self):
+    # utils.slugify() returns '' for tags with no ASCII letters or digits.
+    self.assertRoundTrips({'TagsContentGenerator': (set(['a', '']), None)})
+    self.assertRoundTrips({'TagsContentGenerator': (set(['']), ETAG)})
+
+  def test_resource_with_nul(self):
+    self.assertRoundTrips({'TagsContentGenerator': (set([u'a\x00b']), None)})
+
+  def test_reads_pickled_deps(self):
+    deps = {'TagsContentGenerator': (set(['a', '']), ETAG)}
+    for protocol in (0, 2):
+      self.assertEqual(dependencies.decode(pickle.dumps(deps, protocol)), deps)
+
+  def test_reads_version_1(self):
+    data = ''.join([dependencies.MAGIC, chr(1), chr(3), chr(0), chr(0),
+                    chr(5), 'a\x00bc'])
+    self.assertEqual(dependencies.decode(data),
+                     {'TagsContentGenerator': (set([u'a', u'bc']), None)})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from benchmarks import common
+
+from google.appengine.ext import webapp
+
+import handlers
+import models
+
+
+class FetchPageTest(unittest.TestCase):
+  def setUp(self):
+    common.setup_stubs()
+    for i in range(3):
+      models.Page(key_name='/page-%d' % i, path='/page-%d' % i,
+                  title='Page %d' % i, template='Simple.html',
+                  body='Body %d' % i).put()
+
+  def fetch_page(self, url):
+    handler = handlers.PageAdminHandler()
+    handler.initialize(webapp.Request.blank(url), webapp.Response())
+    return handler.fetch_page(
+        models.PageSummary.all().order('-updated'))
+
+  def test_pages_by_cursor(self):
+    first = self.fetch_page('/admin/pages?count=2')
+    self.assertTrue(first['first_page'])
+    self.assertEqual(len(first['results']), 2)
+    second = self.fetch_page('/admin/pages?' + first['next_page'])
+    self.assertFalse(second['first_page'])
+    self.assertEqual(len(second['results']), 1)
+    self.assertEqual(second['next_page'], None)
+
+  def test_garbage_cursor_starts_at_first_page(self):
+    page = self.fetch_page('/admin/pages?count=2&cursor=not-a-cursor')
+    self.assertTrue(page['first_page'])
+    self.assertEqual(len(page['results']), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
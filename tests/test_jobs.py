@@ -0,0 +1,34 @@
+import unittest
+
+from benchmarks import common
+
+import jobs
+
+
+class FinishWhenIdleTest(unittest.TestCase):
+  def setUp(self):
+    common.setup_stubs()
+    self.job_id = jobs.start('migration')
+
+  def finished(self):
+    return jobs.Job.get_by_id(self.job_id).finished is not None
+
+  def test_finishes_once_seen_idle_twice(self):
+    jobs.finish_when_idle(self.job_id)
+    self.assertFalse(self.finished())
+    jobs.finish_when_idle(self.job_id, 1)
+    self.assertTrue(self.finished())
+
+  def test_waits_for_tasks_in_flight(self):
+    jobs.count('tasks_enqueued', job_id=self.job_id)
+    jobs.flush()
+    jobs.finish_when_idle(self.job_id, 1)
+    self.assertFalse(self.finished())
+    jobs.count('tasks_done', job_id=self.job_id)
+    jobs.flush()
+    jobs.finish_when_idle(self.job_id, 1)
+    self.assertTrue(self.finished())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,77 @@
+import hashlib
+import multiprocessing
+import unittest
+
+from benchmarks import common
+
+from google.appengine.api import memcache
+
+import config
+import markup
+
+
+class RenderInProcessTest(unittest.TestCase):
+  def setUp(self):
+    common.setup_stubs()
+    self.calls = 0
+    markup.MARKUP_MAP['failing'] = ('Failing', self.failing_renderer)
+
+  def tearDown(self):
+    del markup.MARKUP_MAP['failing']
+
+  def failing_renderer(self, content):
+    self.calls += 1
+    if self.calls <= markup.MAX_ABANDONED_RENDERS + 1:
+      raise ValueError('Bad markup')
+    return '<p>%s</p>' % content
+
+  def test_renderer_errors_are_not_counted_as_cut_off(self):
+    content = 'Some content'
+    for i in range(markup.MAX_ABANDONED_RENDERS + 1):
+      self.assertRaises(ValueError, markup._render_in_process, 'failing',
+                        content)
+    key = 'failing:%s' % hashlib.sha1(content).hexdigest()
+    self.assertEqual(memcache.get(key, namespace='render-budget'), 0)
+    self.assertEqual(markup._render_in_process('failing', content),
+                     '<p>Some content</p>')
+
+
+class Post(object):
+  def __init__(self, body_markup):
+    self.body_markup = body_markup
+    self.path = None
+    self.title = 'A post'
+
+
+class RenderInWorkerTest(unittest.TestCase):
+  def setUp(self):
+    common.setup_stubs()
+    self.pool_calls = 0
+    self.old_pool = multiprocessing.Pool
+    self.old_render_in_worker = config.render_in_worker
+    multiprocessing.Pool = self.unavailable_pool
+    config.render_in_worker = True
+    markup._pool = None
+    markup._worker_available = None
+
+  def tearDown(self):
+    multiprocessing.Pool = self.old_pool
+    config.render_in_worker = self.old_render_in_worker
+    markup._pool = None
+    markup._worker_available = None
+
+  def unavailable_pool(self, processes=None):
+    self.pool_calls += 1
+    raise OSError('Function not implemented')
+
+  def test_renders_in_process_if_no_worker_can_be_started(self):
+    post = Post('txt')
+    self.assertEqual(markup.render(post, 'Some content'),
+                     '<p>Some content</p>')
+    self.assertEqual(markup.render(post, 'More content'),
+                     '<p>More content</p>')
+    self.assertEqual(self.pool_calls, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from benchmarks import common
+
+import markup
+import models
+
+
+class PutPostTest(unittest.TestCase):
+  def setUp(self):
+    common.setup_stubs()
+    self.summaries = 0
+    self.old_render_summary = markup.render_summary
+    markup.render_summary = self.render_summary
+
+  def tearDown(self):
+    markup.render_summary = self.old_render_summary
+
+  def render_summary(self, post):
+    self.summaries += 1
+    return self.old_render_summary(post)
+
+  def test_summary_is_only_rebuilt_when_its_fields_change(self):
+    post = models.BlogPost(title='A post', body='<p>Some content</p>',
+                           body_markup='html')
+    post.put()
+    self.assertEqual(self.summaries, 1)
+    summary = models.PostSummary.get(models.PostSummary.key_for(post.key()))
+    self.assertEqual(summary.title, 'A post')
+
+    post = models.BlogPost.get(post.key())
+    post.deps = {}
+    post.put()
+    self.assertEqual(self.summaries, 1)
+
+    post.title = 'A renamed post'
+    post.put()
+    self.assertEqual(self.summaries, 2)
+    summary = models.PostSummary.get(models.PostSummary.key_for(post.key()))
+    self.assertEqual(summary.title, 'A renamed post')
+
+
+class PutPageTest(unittest.TestCase):
+  def setUp(self):
+    common.setup_stubs()
+
+  def test_summary_is_written_and_deleted_with_the_page(self):
+    page = models.Page(key_name='/about', path='/about', title='About',
+                       template='Simple.html', body='About this blog.')
+    page.put()
+    summary = models.PageSummary.get_by_key_name('/about')
+    self.assertEqual(summary.title, 'About')
+    self.assertEqual(summary.path, '/about')
+    page.delete()
+    self.assertEqual(models.PageSummary.get_by_key_name('/about'), None)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from benchmarks import common
+
+import config
+import generators
+import static
+import utils
+
+
+class Page(object):
+  def __init__(self, path, title, body):
+    self.path = path
+    self.title = title
+    self.body = body
+
+
+class RenderPageTest(unittest.TestCase):
+  def setUp(self):
+    common.setup_stubs()
+    self.assembled_pages = config.assembled_pages
+    config.assembled_pages = True
+
+  def tearDown(self):
+    config.assembled_pages = self.assembled_pages
+
+  def test_template_without_blocks_has_no_slots(self):
+    page = Page('/about', 'About', '<p>About this blog.</p>')
+    self.assertEqual(
+        utils.render_template_slots('pages/Simple.html', {'page': page},
+                                    config.assembled_page_blocks),
+        None)
+
+  def test_template_without_blocks_is_rendered_whole(self):
+    about = Page('/about', 'About', '<p>About this blog.</p>')
+    contact = Page('/contact', 'Contact', '<p>Write to us.</p>')
+    for page in (about, contact):
+      generators.render_page(page.path, 'pages/Simple.html', {'page': page})
+    self.assertEqual(static.Layout.all().count(), 0)
+    about_body = static.get('/about').body
+    self.assertTrue('About this blog.' in about_body)
+    self.assertFalse('Write to us.' in about_body)
+    self.assertTrue('Write to us.' in static.get('/contact').body)
+
+  def assembled_body(self, path):
+    content = static.get(path)
+    return static.get_layout(content.layout).assemble(content.fragments)
+
+  def test_pages_with_the_same_shell_share_a_layout(self):
+    about = Page('/about', 'About', '<p>About this blog.</p>')
+    contact = Page('/contact', 'Contact', '<p>Write to us.</p>')
+    for page in (about, contact):
+      generators.render_page(page.path, 'pages/Theme.html', {'page': page})
+    self.assertEqual(static.Layout.all().count(), 1)
+    self.assertEqual(static.get('/about').layout,
+                     static.get('/contact').layout)
+    about_body = self.assembled_body('/about')
+    self.assertTrue('About this blog.' in about_body)
+    self.assertFalse('Write to us.' in about_body)
+
+  def test_layout_is_rendered_again_from_its_vals(self):
+    page = Page('/about', 'About', '<p>About this blog.</p>')
+    generators.render_page(page.path, 'pages/Theme.html', {'page': page})
+    slogan = config.slogan
+    config.slogan = 'A new slogan'
+    try:
+      generators.regenerate_layout(static.get('/about').layout)
+    finally:
+      config.slogan = slogan
+    about_body = self.assembled_body('/about')
+    self.assertTrue('A new slogan' in about_body)
+    self.assertTrue('About this blog.' in about_body)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from benchmarks import common
+
+import jobs
+import static
+import tasks
+
+
+class RebuildTest(unittest.TestCase):
+  def setUp(self):
+    common.setup_stubs()
+    static._generation[:] = [0, None]
+    static.set('/page', 'Page content', 'text/html', indexed=False)
+    self.generation = static.start_build()
+    self.job_id = jobs.start('rebuild')
+
+  def set_in_build(self, body):
+    context = {'generation': self.generation, 'job': self.job_id}
+    content = tasks.run(context, static.set, '/page', body, 'text/html',
+                        indexed=False)
+    jobs.flush()
+    return content
+
+  def get_progress(self):
+    return jobs.get_progress(jobs.Job.get_by_id(self.job_id))
+
+  def test_unchanged_content_is_copied_and_skipped(self):
+    current = static.get('/page', 0)
+    self.set_in_build('Page content')
+    self.assertEqual(self.get_progress()['skipped'], 1)
+    copy = static.get('/page', self.generation)
+    self.assertEqual(copy.body, 'Page content')
+    self.assertEqual(copy.last_modified, current.last_modified)
+
+  def test_changed_content_is_written(self):
+    self.set_in_build('New page content')
+    self.assertEqual(self.get_progress()['skipped'], 0)
+    self.assertEqual(static.get('/page', self.generation).body,
+                     'New page content')
+    self.assertEqual(static.get('/page', 0).body, 'Page content')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -10,6 +10,8 @@ from django import template
 from django.template import loader
 
 import config
+import fragments
+import stats
 import xsrfutil
 
 BASE_DIR = os.path.dirname(__file__)
@@ -51,10 +53,15 @@ def get_template_vals_defaults(template_vals=None):
   return template_vals
 
 
+register = webapp.template.create_template_register()
+register.filter('xsrf_token', xsrfutil.xsrf_token)
+register.tag('cachefragment', fragments.do_cachefragment)
+template.builtins.append(register)
+
+
+@stats.timed(lambda template_name, *args, **kwargs:
+             ('render_template', template_name))
 def render_template(template_name, template_vals=None, theme=None):
-  register = webapp.template.create_template_register()
-  register.filter('xsrf_token', xsrfutil.xsrf_token)
-  template.builtins.append(register)
   template_vals = get_template_vals_defaults(template_vals)
   template_vals.update({'template_name': template_name})
   old_settings = _swap_settings({'TEMPLATE_DIRS': TEMPLATE_DIRS})
@@ -66,26 +73,56 @@ def render_template(template_name, template_vals=None, theme=None):
   return rendered
 
 
-def _get_all_paths():
-  import static
-  keys = []
-  q = static.StaticContent.all(keys_only=True).filter('indexed', True)
-  cur = q.fetch(1000)
-  while len(cur) == 1000:
-    keys.extend(cur)
-    q = static.StaticContent.all(keys_only=True)
-    q.filter('indexed', True)
-    q.filter('__key__ >', cur[-1])
-    cur = q.fetch(1000)
-  keys.extend(cur)
-  return [x.name() for x in keys]
+SLOT_START = u'\x00slot-start\x00'
+SLOT_END = u'\x00slot-end\x00'
+
+
+def render_template_slots(template_name, template_vals=None, blocks=()):
+  """Renders a template, separating the named blocks from the page around them.
+
+  Args:
+    template_name: The template to render.
+    template_vals: Template variables, as per render_template.
+    blocks: Names of the blocks that vary from page to page.
+  Returns:
+    A (shell, slots) tuple, where slots is a list of the rendered blocks in
+    document order and shell is a list of the len(slots) + 1 pieces of page
+    that surround them. Returns None unless each of the blocks can be
+    separated cleanly: if the template doesn't have one of them, or one is
+    nested inside another.
+  """
+  source = ['{%% extends "%s" %%}' % (template_name,)]
+  for block in blocks:
+    source.append('{%% block %s %%}%s{{ block.super }}%s{%% endblock %%}'
+                  % (block, SLOT_START, SLOT_END))
+  template_vals = get_template_vals_defaults(template_vals)
+  template_vals.update({'template_name': template_name})
+  old_settings = _swap_settings({'TEMPLATE_DIRS': TEMPLATE_DIRS})
+  try:
+    tpl = template.Template(''.join(source))
+    rendered = tpl.render(template.Context(template_vals))
+  finally:
+    _swap_settings(old_settings)
+
+  pieces = rendered.split(SLOT_START)
+  shell = [pieces[0]]
+  slots = []
+  for piece in pieces[1:]:
+    parts = piece.split(SLOT_END)
+    if len(parts) != 2:
+      return None
+    slots.append(parts[0])
+    shell.append(parts[1])
+  if SLOT_END in shell[0] or len(slots) != len(blocks):
+    return None
+  return shell, slots
 
 
 def _regenerate_sitemap():
   import static
   import gzip
   from StringIO import StringIO
-  paths = _get_all_paths()
+  paths = static.get_all_paths()
   rendered = render_template('sitemap.xml', {'paths': paths})
   static.set('/sitemap.xml', rendered, 'application/xml', False)
   s = StringIO()
@@ -104,40 +141,52 @@ def ping_googlesitemap():
   if response.status_code / 100 != 2:
     raise Warning("Google Sitemap ping failed", response.status_code, response.content)
 
+# Maps tzinfo class names to instances; see tzinfo().
+_tzinfos = {}
+
 def tzinfo():
   """
   Returns an instance of a tzinfo implementation, as specified in
   config.tzinfo_class; else, None.
+
+  The class is imported and instantiated once per process.
   """
 
-  if not config.__dict__.get('tzinfo_class'):
+  str = config.__dict__.get('tzinfo_class')
+  if not str:
     return None
+  if str in _tzinfos:
+    return _tzinfos[str]
 
-  str = config.tzinfo_class
   i = str.rfind(".")
-
   try:
     # from str[:i] import str[i+1:]
     klass_str = str[i+1:]
     mod = __import__(str[:i], globals(), locals(), [klass_str])
     klass = getattr(mod, klass_str)
-    return klass()
+    tz = klass()
   except ImportError:
-    return None
+    tz = None
+  _tzinfos[str] = tz
+  return tz
+
+_utc = []
 
 def tz_field(property):
   """
   For a DateTime property, make it timezone-aware if possible.
 
-  If it already is timezone-aware, don't do anything.
+  If it already is timezone-aware, or is None, don't do anything.
   """
-  if property.tzinfo:
+  if property is None or property.tzinfo:
     return property
 
   tz = tzinfo()
   if tz:
-    from timezones.utc import UTC
+    if not _utc:
+      from timezones.utc import UTC
+      _utc.append(UTC())
 
-    return property.replace(tzinfo=UTC()).astimezone(tz)
+    return property.replace(tzinfo=_utc[0]).astimezone(tz)
   else:
     return property